@@ -1,9 +1,21 @@
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask
 
 from . import aubrey_transcription
+from .bloom import build_bloom_filter_command, load_bloom_filter
+from .cache import ListingCache, create_listing_cache
+from .concurrency import FilesystemLimiter, RootExecutors, SingleFlight
+from .files import SEND_METHODS, file_view
+from .harvest import harvest_command, harvest_view
+from .index import ListingIndex, build_index_command
+from .json_provider import make_json_provider
+from .metrics import Metrics, metrics_view
+from .utils import compile_response_plan, configured_roots, make_filename_parser
+from .vtt import VttMetadataReader
+from .watcher import create_watcher
 
 
 def create_app(test_config=None, instance_path=None):
@@ -26,7 +38,102 @@ def create_app(test_config=None, instance_path=None):
 
     app.register_blueprint(aubrey_transcription.bp)
 
+    # Encode JSON with orjson when it's available, honoring JSON_SORT_KEYS.
+    app.json = make_json_provider(app)
+
     # Compile and save the regex pattern so we don't have to do it for every request.
     app.config['FILENAME_REGEX'] = re.compile(app.config['FILENAME_PATTERN'])
+    app.config['FILENAME_PARSER'] = make_filename_parser(app.config['FILENAME_REGEX'],
+                                                         app.config['FILENAME_CACHE_SIZE'])
+    # Likewise, work out how listings are put together from the settings just once.
+    app.config['RESPONSE_PLAN'] = compile_response_plan(app.config)
+    # Cue metadata is read from the files themselves, for the extensions that ask for it.
+    if app.config['VTT_METADATA_EXTENSIONS']:
+        app.config['VTT_METADATA'] = VttMetadataReader(app.config['VTT_METADATA_EXTENSIONS'],
+                                                       app.config['VTT_METADATA_CACHE_SIZE'])
+    else:
+        app.config['VTT_METADATA'] = None
+
+    # Listings are cached in-process or shared between processes, keyed on the pairpath and
+    # validated by directory mtime.
+    app.config['LISTING_CACHE'] = create_listing_cache(app)
+
+    # Concurrent requests for a listing that isn't cached yet share one scan and build of it,
+    # and the scans may be limited to so many at a time.
+    app.config['SINGLE_FLIGHT'] = SingleFlight()
+    if app.config['FS_MAX_OPERATIONS']:
+        app.config['FS_LIMITER'] = FilesystemLimiter(app.config['FS_MAX_OPERATIONS'],
+                                                     timeout=app.config['FS_WAIT_TIMEOUT'])
+    else:
+        app.config['FS_LIMITER'] = None
+    # Threads for reading a record from each of several pairtree roots at once.
+    app.config['ROOT_EXECUTORS'] = RootExecutors(app.config['PAIRTREE_ROOT_WORKERS'])
+
+    # Records found not to exist are cached separately, with a short TTL.
+    if app.config['NEGATIVE_CACHE_MAX_ENTRIES']:
+        app.config['NEGATIVE_CACHE'] = ListingCache(
+            max_entries=app.config['NEGATIVE_CACHE_MAX_ENTRIES'],
+            ttl=app.config['NEGATIVE_CACHE_TTL'],
+        )
+    else:
+        app.config['NEGATIVE_CACHE'] = None
+
+    # Unknown identifiers can be turned away by a Bloom filter built ahead of time.
+    if app.config['BLOOM_FILTER_PATH']:
+        app.config['BLOOM_FILTER'] = load_bloom_filter(app.config['BLOOM_FILTER_PATH'])
+    else:
+        app.config['BLOOM_FILTER'] = None
+    app.cli.add_command(build_bloom_filter_command)
+
+    # Listings can be served from an index built ahead of time by the build-index command.
+    if app.config['SERVE_FROM_INDEX'] and app.config['INDEX_PATH']:
+        app.config['LISTING_INDEX'] = ListingIndex(app.config['INDEX_PATH'])
+    else:
+        app.config['LISTING_INDEX'] = None
+    # The same index answers /search whether or not listings are served from it.
+    if app.config['INDEX_PATH']:
+        app.config['SEARCH_INDEX'] = (app.config['LISTING_INDEX'] or
+                                      ListingIndex(app.config['INDEX_PATH']))
+    else:
+        app.config['SEARCH_INDEX'] = None
+    app.cli.add_command(build_index_command)
+
+    # The whole pairtree can be harvested as one stream of NDJSON. Each harvest is a crawl of
+    # the whole pairtree, so the route has to be turned on; the command is always there.
+    if app.config['HARVEST_ENABLED']:
+        app.add_url_rule('/harvest', 'harvest', harvest_view)
+    app.cli.add_command(harvest_command)
+
+    # The files themselves can be served too, so TRANSCRIPTION_URL can point at the app.
+    if app.config['SERVE_FILES']:
+        if app.config['FILES_SEND_METHOD'] not in SEND_METHODS:
+            raise ValueError('FILES_SEND_METHOD must be one of {}'.format(', '.join(SEND_METHODS)))
+        if app.config['FILES_SEND_METHOD'] == 'x-accel-redirect':
+            missing = [root for root in configured_roots(app.config)
+                       if root not in app.config['FILES_ACCEL_LOCATIONS']]
+            if missing:
+                raise ValueError('FILES_ACCEL_LOCATIONS has no location for {}'.format(
+                    ', '.join(missing)))
+        app.config['USE_X_SENDFILE'] = app.config['FILES_SEND_METHOD'] == 'x-sendfile'
+        app.add_url_rule(app.config['FILES_ROUTE'].rstrip('/') + '/<path:pairpath>/<filename>',
+                         'transcription_file', file_view)
+
+    # Per-stage timings of listings, reported in Server-Timing headers and on /metrics.
+    if app.config['METRICS_ENABLED']:
+        app.config['METRICS'] = Metrics()
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+    else:
+        app.config['METRICS'] = None
+
+    # Threads for looking up the identifiers of batch requests in parallel.
+    app.config['BATCH_EXECUTOR'] = ThreadPoolExecutor(
+        max_workers=app.config['BATCH_MAX_WORKERS'], thread_name_prefix='aubrey-batch')
+
+    # Keep the cache and index up to date as files are added to the pairtree.
+    if app.config['WATCH_PAIRTREE']:
+        app.config['PAIRTREE_WATCHER'] = create_watcher(app)
+        app.config['PAIRTREE_WATCHER'].start()
+    else:
+        app.config['PAIRTREE_WATCHER'] = None
 
     return app
@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from . import create_app
+
+
+def build_environ(scope, body):
+    """Make a WSGI environ for the request described by an ASGI HTTP scope."""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        client_host, client_port = scope['client']
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = client_host, str(client_port)
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_{}'.format(name)
+        value = value.decode('latin-1')
+        if name in environ:
+            value = '{},{}'.format(environ[name], value)
+        environ[name] = value
+    # The whole body has already been read, so its length is known even if it was chunked.
+    environ.setdefault('CONTENT_LENGTH', str(len(body)))
+    return environ
+
+
+class AsgiApp:
+    """Serve a WSGI app over ASGI, running it in a bounded pool of threads.
+
+    The event loop only waits on the pool, so blocking filesystem work in the WSGI app
+    never stalls it, and requests beyond the pool size queue up instead of making more
+    threads. Response bodies are passed along chunk by chunk as the app produces them.
+    """
+
+    def __init__(self, wsgi_app, max_workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='aubrey-asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type {!r}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, bytes(body))
+        # Each step may run on a different thread, but all of them run in the same context,
+        # so the contextvars the app sets (like Flask's request context for a streamed
+        # response) are there for every chunk.
+        context = contextvars.copy_context()
+        status, headers, chunks = await loop.run_in_executor(self.executor, context.run,
+                                                             self.start, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, context.run, next, chunks,
+                                                   None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+        finally:
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(self.executor, context.run, chunks.close)
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def start(self, environ):
+        """Call the WSGI app, returning the status, headers and an iterator over the body."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return lambda data: response.setdefault('written', []).append(data)
+
+        result = self.wsgi_app(environ, start_response)
+        chunks = iter(result)
+        # The first chunk makes sure start_response has been called.
+        first = next(chunks, None)
+        written = response.get('written', [])
+        if first is not None:
+            written.append(first)
+        return response['status'], response['headers'], BodyIterator(written, chunks, result)
+
+
+class BodyIterator:
+    """Iterate over the chunks of a WSGI response, including any already read."""
+
+    def __init__(self, chunks, rest, result):
+        self.chunks = iter(chunks)
+        self.rest = rest
+        self.result = result
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for chunk in self.chunks:
+            return chunk
+        return next(self.rest)
+
+    def close(self):
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+def create_asgi_app(test_config=None, instance_path=None):
+    """Create the app for serving with an ASGI server, such as:
+
+        uvicorn --factory aubrey_transcription.asgi:create_asgi_app
+    """
+    app = create_app(test_config=test_config, instance_path=instance_path)
+    return AsgiApp(app, max_workers=app.config['ASGI_MAX_WORKERS'])
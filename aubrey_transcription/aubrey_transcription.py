@@ -1,18 +1,302 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, current_app, jsonify, request
+from pypairtree import pairtree
+from werkzeug.http import is_resource_modified
 
-from .utils import make_path, find_files, get_files_info
+from .compression import (ENCODINGS, add_vary, compress, compressed_response, encoded_etag,
+                          negotiate_encoding)
+from .concurrency import filesystem_access
+from .index import SEARCH_FIELDS
+from .metrics import NULL_TIMER, start_timer
+from .utils import (FILTER_FIELDS, FileFilter, Listing, PartialFiles, make_path,
+                    directory_mtime, filter_files, find_files, get_files_info)
 
 
 bp = Blueprint('aubrey_transcription', __name__, url_prefix='')
 
 
+def load_listing(pairtree_path, timer=NULL_TIMER, file_filter=None):
+    """Get the Listing for the pairpath, from the index, the listing cache or the pairtree.
+
+    A cached listing is only used if the directory's mtime hasn't changed since the
+    listing was built, so a hit costs a single stat instead of a full directory scan.
+    When serving from the index, records found in it don't touch the pairtree at all (see
+    index_listing), and neither do records that were recently found missing or that the
+    Bloom filter rules out.
+
+    With a FileFilter, the listing only has the files it keeps. A complete listing from the
+    index or cache is narrowed down in memory; otherwise the filter is applied while
+    scanning, so the files it leaves out are never stat'ed. Filtered listings aren't cached.
+    """
+    cache = current_app.config['LISTING_CACHE']
+    index = current_app.config['LISTING_INDEX']
+    if index is not None:
+        with timer.stage('index'):
+            found = index.lookup(pairtree_path)
+        if found is not None:
+            return index_listing(pairtree_path, found, timer, file_filter)
+    negative_cache = current_app.config['NEGATIVE_CACHE']
+    if negative_cache is not None:
+        listing = negative_cache.get(pairtree_path, None)
+        if listing is not None:
+            timer.cache_result('negative')
+            return listing
+    bloom_filter = current_app.config['BLOOM_FILTER']
+    if bloom_filter is not None:
+        with timer.stage('bloom_filter'):
+            maybe_present = pairtree_path in bloom_filter
+        if not maybe_present:
+            timer.cache_result('filtered')
+            return missing_listing(pairtree_path)
+    with timer.stage('directory_mtime'), filesystem_access():
+        mtime = directory_mtime(pairtree_path)
+    if mtime is None:
+        # There's no directory to scan.
+        return missing_listing(pairtree_path)
+    if cache is not None:
+        listing = cache.get(pairtree_path, mtime)
+        if listing is not None:
+            timer.cache_result('hit')
+            if file_filter is not None:
+                return Listing(pairtree_path, filter_files(listing.files, file_filter), mtime)
+            return listing
+        timer.cache_result('miss')
+    if file_filter is not None:
+        with timer.stage('find_files'), filesystem_access():
+            files = find_files(pairtree_path, file_filter)
+        return Listing(pairtree_path, files, mtime)
+    # Concurrent requests for the same version of the directory share a single scan of it.
+    with timer.stage('find_files'):
+        return current_app.config['SINGLE_FLIGHT'].do(
+            ('scan', pairtree_path, mtime), scan_listing, pairtree_path, mtime)
+
+
+def index_listing(pairtree_path, found, timer=NULL_TIMER, file_filter=None):
+    """Get the Listing for a record found in the index.
+
+    Listings from the index are cached like scanned ones, validated by the mtime the index
+    has for the record, so their bodies are only built and compressed once. They are the
+    same listings a scan of that version of the directory gives, so either may be served.
+    """
+    mtime, files = found
+    if file_filter is not None:
+        return Listing(pairtree_path, filter_files(files, file_filter), mtime)
+    cache = current_app.config['LISTING_CACHE']
+    if cache is not None:
+        listing = cache.get(pairtree_path, mtime)
+        if listing is not None:
+            timer.cache_result('hit')
+            return listing
+        timer.cache_result('miss')
+    return Listing(pairtree_path, files, mtime, cacheable=cache is not None)
+
+
+def scan_listing(pairtree_path, mtime):
+    """Make the Listing for the pairpath by scanning its directory.
+
+    The cache is checked once more first, in case a scan that finished just before this one
+    started has already stored the listing.
+    """
+    cache = current_app.config['LISTING_CACHE']
+    if cache is not None:
+        listing = cache.get(pairtree_path, mtime)
+        if listing is not None:
+            return listing
+    with filesystem_access():
+        files = find_files(pairtree_path)
+    # A listing missing the files of a root that didn't answer shouldn't outlive the request.
+    cacheable = cache is not None and not isinstance(files, PartialFiles)
+    return Listing(pairtree_path, files, mtime, cacheable=cacheable)
+
+
+def missing_listing(pairtree_path):
+    """Make the empty Listing of a missing record and remember it in the negative cache."""
+    listing = Listing(pairtree_path, [], None)
+    negative_cache = current_app.config['NEGATIVE_CACHE']
+    if negative_cache is not None:
+        negative_cache.set(pairtree_path, None, listing)
+    return listing
+
+
+def listing_body(listing, timer=NULL_TIMER):
+    """Get the listing's encoded JSON, building it (and caching the listing) the first time.
+
+    Cached listings keep their encoded body, so sending one again needs no encoding at all.
+    Concurrent requests for a listing that isn't built yet share the one build.
+    """
+    if listing.body is None:
+        listing.body = current_app.config['SINGLE_FLIGHT'].do(
+            ('body', listing.pairpath, listing.etag), build_body, listing, timer)
+    return listing.body
+
+
+def build_body(listing, timer=NULL_TIMER):
+    """Build and encode the listing's files info, storing it in the listing and the cache."""
+    with timer.stage('get_files_info'):
+        files_info = get_files_info(listing.pairpath, listing.files)
+    with timer.stage('serialization'):
+        listing.body = current_app.json.encode(files_info)
+    if listing.cacheable:
+        current_app.config['LISTING_CACHE'].set(
+            listing.pairpath, listing.mtime, listing, listing.size)
+    return listing.body
+
+
+def listing_encoded(listing, encoding, timer=NULL_TIMER):
+    """Get the listing's body compressed with encoding, only compressing it the first time."""
+    data = listing.encoded.get(encoding)
+    if data is None:
+        with timer.stage('compression'):
+            data = compress(listing_body(listing, timer), encoding,
+                            current_app.config['COMPRESSION_LEVEL'])
+        listing.encoded[encoding] = data
+        if listing.cacheable:
+            # Store it again so the cache counts the compressed copy towards its size.
+            current_app.config['LISTING_CACHE'].set(
+                listing.pairpath, listing.mtime, listing, listing.size)
+    return data
+
+
+def load_body(pairtree_path):
+    """Get the encoded files info for the pairpath."""
+    return listing_body(load_listing(pairtree_path))
+
+
+def current_etag(listing):
+    """Get the ETag of the client's copy of the listing, or None if it isn't current.
+
+    The client may have any coding of the listing, and they all change together.
+    """
+    for encoding in (None,) + tuple(ENCODINGS):
+        etag = encoded_etag(listing.etag, encoding)
+        if not is_resource_modified(request.environ, etag=etag,
+                                    last_modified=listing.last_modified):
+            return etag
+    return None
+
+
+def add_cache_headers(response, listing, etag):
+    """Set the validators and caching policy for a response about the listing."""
+    response.set_etag(etag)
+    if listing.mtime is not None:
+        response.last_modified = listing.last_modified
+    max_age = current_app.config['CACHE_CONTROL_MAX_AGE']
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+
+def request_file_filter():
+    """Get the FileFilter asked for in the query string, or None to list every file.
+
+    Any of "manifestation", "fileset", "kind" and "language" narrow the listing down to the
+    files with that value, and "omit_size" set to "true" (or "1") leaves out the sizes.
+    """
+    criteria = {field: request.args[field] for field in FILTER_FIELDS if field in request.args}
+    sizes = request.args.get('omit_size', '').lower() not in ('true', '1')
+    if not criteria and sizes:
+        return None
+    return FileFilter(criteria, sizes)
+
+
 @bp.route('/<identifier>/')
 def list_files(identifier):
     """Returns a JSON structure detailing the record's transcription files.
 
-    If no files can be found, then an empty JSON object is returned.
+    If no files can be found, then an empty JSON object is returned. If the client already
+    has the current version of the listing, a 304 is returned without building it. Larger
+    listings are compressed if the client accepts it, and kept compressed in the cache.
+    The query string can narrow the listing down (see request_file_filter).
+    """
+    timer = start_timer()
+    with timer.stage('make_path'):
+        pairtree_path = make_path(identifier)
+    listing = load_listing(pairtree_path, timer, request_file_filter())
+    timer.files(len(listing.files))
+    etag = current_etag(listing)
+    if etag is not None:
+        response = current_app.response_class(status=304)
+    else:
+        body = listing_body(listing, timer)
+        encoding = negotiate_encoding(len(body))
+        if encoding is not None:
+            body = listing_encoded(listing, encoding, timer)
+        response = current_app.response_class(body, mimetype=current_app.json.mimetype)
+        if encoding is not None:
+            response.content_encoding = encoding
+        etag = encoded_etag(listing.etag, encoding)
+    return timer.finish(add_vary(add_cache_headers(response, listing, etag)))
+
+
+def _load_identifier(app, identifier):
+    """Load the encoded files info for one identifier from a batch worker thread."""
+    with app.app_context():
+        return load_body(make_path(identifier))
+
+
+@bp.route('/batch', methods=['GET', 'POST'])
+def batch_list_files():
+    """Returns the files info for many identifiers, keyed by identifier.
+
+    The identifiers are given either as repeated "identifier" query parameters or as a JSON
+    list (or an object with an "identifiers" list) in the body of a POST. The directory
+    scans are spread over the app's batch thread pool, and the encoded listings are joined
+    into the response as they are, without decoding them again.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('identifiers')
+        if not isinstance(data, list) or not all(isinstance(i, str) for i in data):
+            return jsonify({'error': 'Expected a JSON list of identifiers.'}), 400
+        identifiers = data
+    else:
+        identifiers = request.args.getlist('identifier')
+    # Drop duplicates but keep the order they were asked for in.
+    identifiers = list(dict.fromkeys(identifiers))
+    max_identifiers = current_app.config['BATCH_MAX_IDENTIFIERS']
+    if len(identifiers) > max_identifiers:
+        return jsonify(
+            {'error': 'No more than {} identifiers may be requested.'.format(max_identifiers)}
+        ), 400
+    app = current_app._get_current_object()
+    executor = current_app.config['BATCH_EXECUTOR']
+    futures = {identifier: executor.submit(_load_identifier, app, identifier)
+               for identifier in identifiers}
+    if current_app.json.sort_keys:
+        identifiers = sorted(identifiers)
+    # Each encoded value ends in a newline, which is left out where they're joined together.
+    encode = current_app.json.encode
+    members = [encode(identifier)[:-1] + b':' + futures[identifier].result()[:-1]
+               for identifier in identifiers]
+    return compressed_response(b'{' + b','.join(members) + b'}\n', current_app.json.mimetype)
+
+
+@bp.route('/search')
+def search():
+    """Returns the identifiers of records with a file matching all the given fields.
+
+    Any of "language", "kind", "extension" and "manifestation" can be given as query
+    parameters, and at least one must be. Results are paged: "limit" sets the page size and
+    "next" in the response is the "after" parameter that gets the following page, or null
+    on the last page.
     """
-    pairtree_path = make_path(identifier)
-    files = find_files(pairtree_path)
-    file_info = get_files_info(pairtree_path, files)
-    return jsonify(file_info)
+    criteria = {field: request.args[field] for field in SEARCH_FIELDS if field in request.args}
+    if not criteria:
+        return jsonify({'error': 'Search by at least one of {}.'.format(
+            ', '.join(SEARCH_FIELDS))}), 400
+    max_page_size = current_app.config['SEARCH_MAX_PAGE_SIZE']
+    limit = request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int)
+    if not 0 < limit <= max_page_size:
+        return jsonify({'error': 'limit must be from 1 to {}.'.format(max_page_size)}), 400
+    after = request.args.get('after')
+    index = current_app.config['SEARCH_INDEX']
+    # One more than the page is asked for to see if there's another page after it.
+    pairpaths = None if index is None else index.search(
+        criteria, after=make_path(after) if after else None, limit=limit + 1)
+    if pairpaths is None:
+        return jsonify({'error': 'The search index has not been built.'}), 503
+    identifiers = [pairtree.deSanitizeString(pairpath.rsplit('/', 1)[-1])
+                   for pairpath in pairpaths[:limit]]
+    next_after = identifiers[-1] if len(pairpaths) > limit else None
+    return jsonify({'identifiers': identifiers, 'next': next_after})
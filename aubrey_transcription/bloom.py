@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+from array import array
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .utils import configured_roots, walk_pairtrees
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AUBLOOM1'
+HEADER = struct.Struct('<8sQI')
+
+
+class BloomFilter:
+    """A Bloom filter of strings, for ruling out records that certainly don't exist.
+
+    A string that was added is always reported as possibly present; a string that wasn't is
+    reported as present only with a small false positive rate.
+    """
+
+    def __init__(self, size, hash_count, bits=None):
+        self.size = size
+        self.hash_count = hash_count
+        self.bits = bytearray((size + 7) // 8) if bits is None else bytearray(bits)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        """Make a filter sized to hold capacity strings with the given false positive rate."""
+        capacity = max(capacity, 1)
+        size = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        hash_count = max(int(round(size / capacity * math.log(2))), 1)
+        return cls(size, hash_count)
+
+    @staticmethod
+    def hashes(key):
+        """Hash key to the pair of 64 bit numbers its bit positions are derived from."""
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+        return struct.unpack('<QQ', digest)
+
+    def positions(self, first, second):
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        self.add_hashes(*self.hashes(key))
+
+    def add_hashes(self, first, second):
+        with self._lock:
+            for position in self.positions(first, second):
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(*self.hashes(key)))
+
+    def save(self, path):
+        """Write the filter to path, replacing any file there only once it's complete."""
+        temp_path = '{}.tmp'.format(path)
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.size, self.hash_count))
+            f.write(self.bits)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a filter written by save. Raises ValueError if it isn't a valid filter file."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError('{} is not a Bloom filter file'.format(path))
+        magic, size, hash_count = HEADER.unpack_from(data)
+        bits = data[HEADER.size:]
+        if magic != MAGIC or len(bits) != (size + 7) // 8:
+            raise ValueError('{} is not a Bloom filter file'.format(path))
+        return cls(size, hash_count, bits)
+
+
+def build_bloom_filter(path, error_rate):
+    """Walk the whole pairtree and write a Bloom filter of its records' pairpaths to path.
+
+    Returns the number of records added.
+    """
+    # Keep just the hashes while walking, as the filter can't be sized until the end.
+    firsts, seconds = array('Q'), array('Q')
+    for pairpath in walk_pairtrees(configured_roots(current_app.config)):
+        first, second = BloomFilter.hashes(pairpath)
+        firsts.append(first)
+        seconds.append(second)
+    bloom_filter = BloomFilter.for_capacity(len(firsts), error_rate)
+    for first, second in zip(firsts, seconds):
+        bloom_filter.add_hashes(first, second)
+    bloom_filter.save(path)
+    return len(firsts)
+
+
+def load_bloom_filter(path):
+    """Load the Bloom filter at path, or return None (logging why) if it can't be read."""
+    try:
+        return BloomFilter.load(path)
+    except (OSError, ValueError) as e:
+        logger.warning('Not using the Bloom filter: %s', e)
+        return None
+
+
+@click.command('build-bloom-filter')
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Where to write the filter. Defaults to the BLOOM_FILTER_PATH setting.')
+@click.option('--error-rate', type=click.FloatRange(0, 1, min_open=True, max_open=True),
+              help='False positive rate. Defaults to the BLOOM_FILTER_ERROR_RATE setting.')
+@with_appcontext
+def build_bloom_filter_command(output, error_rate):
+    """Crawl PAIRTREE_BASE and write a Bloom filter of the records in it."""
+    path = output or current_app.config['BLOOM_FILTER_PATH']
+    if not path:
+        raise click.UsageError('Set BLOOM_FILTER_PATH or pass --output.')
+    error_rate = error_rate or current_app.config['BLOOM_FILTER_ERROR_RATE']
+    records = build_bloom_filter(path, error_rate)
+    click.echo('Added {} records to {}.'.format(records, path))
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .shared_cache import SharedListingCache
+
+
+class ListingCache:
+    """A thread-safe LRU cache of directory listings.
+
+    Each entry is stored with the fingerprint (normally the directory mtime) that was
+    current when the listing was built, and is only returned if the caller presents the
+    same fingerprint. Entries also expire after `ttl` seconds, so changes that don't touch
+    the directory mtime (like a file being rewritten in place) are eventually picked up.
+    The least recently used entries are evicted once there are more than `max_entries`
+    entries or their combined size goes over `max_bytes`.
+    """
+
+    def __init__(self, max_entries, max_bytes=None, ttl=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, fingerprint):
+        """Return the cached value for key, or None if it is missing, stale or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry_fingerprint, expires, value, size = entry
+            if entry_fingerprint != fingerprint or (expires is not None and
+                                                    expires <= self.clock()):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, fingerprint, value, size=0):
+        """Store the value for key, evicting least recently used entries to make room."""
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Caching this would just flush everything else out.
+            self.invalidate(key)
+            return
+        expires = self.clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (fingerprint, expires, value, size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        """Remove key from the cache if it is there."""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[3]
+
+
+def create_listing_cache(app):
+    """Make the listing cache chosen by the LISTING_CACHE_BACKEND setting.
+
+    "memory" keeps a ListingCache in each worker process. "shared" keeps a
+    SharedListingCache in the file at LISTING_CACHE_PATH (by default in the instance
+    directory), of LISTING_CACHE_MAX_ENTRIES slots of LISTING_CACHE_SLOT_SIZE bytes, which
+    every worker on the host uses. Returns None if LISTING_CACHE_MAX_ENTRIES is 0.
+    """
+    config = app.config
+    if not config['LISTING_CACHE_MAX_ENTRIES']:
+        return None
+    backend = config['LISTING_CACHE_BACKEND']
+    if backend == 'memory':
+        return ListingCache(
+            max_entries=config['LISTING_CACHE_MAX_ENTRIES'],
+            max_bytes=config['LISTING_CACHE_MAX_BYTES'],
+            ttl=config['LISTING_CACHE_TTL'],
+        )
+    if backend == 'shared':
+        return SharedListingCache(
+            config['LISTING_CACHE_PATH'] or os.path.join(app.instance_path, 'listing-cache'),
+            slots=config['LISTING_CACHE_MAX_ENTRIES'],
+            slot_size=config['LISTING_CACHE_SLOT_SIZE'],
+            ttl=config['LISTING_CACHE_TTL'],
+        )
+    raise ValueError('Unknown LISTING_CACHE_BACKEND {!r}'.format(backend))
@@ -0,0 +1,66 @@
+import gzip
+import zlib
+
+from flask import current_app, request
+
+
+def _gzip(data, level):
+    # A fixed mtime keeps the output, and so the cached copies of it, the same every time.
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _deflate(data, level):
+    return zlib.compress(data, level)
+
+
+# The supported content codings, in order of preference when the client accepts several.
+ENCODINGS = {
+    'gzip': _gzip,
+    'deflate': _deflate,
+}
+
+
+def compress(data, encoding, level):
+    """Compress data with the content coding named by encoding."""
+    return ENCODINGS[encoding](data, level)
+
+
+def encoded_etag(etag, encoding):
+    """Get the ETag of a representation compressed with encoding.
+
+    Each coding of a listing is a different set of bytes, so it gets its own ETag.
+    """
+    if encoding is None:
+        return etag
+    return '{}-{}'.format(etag, encoding)
+
+
+def negotiate_encoding(size):
+    """Pick the content coding for a response body of size bytes to the current request.
+
+    Returns None to send the body as it is, either because the client doesn't accept any of
+    the supported codings, or because the body is smaller than COMPRESSION_MIN_SIZE (or that
+    setting is None, turning compression off).
+    """
+    min_size = current_app.config['COMPRESSION_MIN_SIZE']
+    if min_size is None or size < min_size:
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def add_vary(response):
+    """Let caches know the response depends on Accept-Encoding, if compression is on."""
+    if current_app.config['COMPRESSION_MIN_SIZE'] is not None:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def compressed_response(data, mimetype):
+    """Make a response of data, compressing it on the way if the client accepts it."""
+    encoding = negotiate_encoding(len(data))
+    if encoding is not None:
+        data = compress(data, encoding, current_app.config['COMPRESSION_LEVEL'])
+    response = current_app.response_class(data, mimetype=mimetype)
+    if encoding is not None:
+        response.content_encoding = encoding
+    return add_vary(response)
@@ -0,0 +1,127 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that would all do the same work.
+
+    While a call for a key is running, other callers for the same key wait for it and get its
+    result (or its exception) instead of running the function themselves.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class FilesystemLimiter:
+    """Limits how many pairtree filesystem operations the worker process runs at once.
+
+    Operations beyond the limit wait for a turn. If `timeout` is set and the wait runs past
+    it, a 503 is raised so a burst of requests queues up for only so long.
+    """
+
+    def __init__(self, max_operations, timeout=None):
+        self.max_operations = max_operations
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_operations)
+
+    @contextmanager
+    def slot(self):
+        if not self._semaphore.acquire(timeout=self.timeout):
+            raise ServiceUnavailable('The transcriptions storage is busy, try again shortly.')
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class RootExecutors:
+    """A separate pool of threads for each pairtree root.
+
+    Each root runs at most max_workers calls at once. Calls beyond that are refused instead
+    of queued, so a hung root that holds on to all of its threads neither ties up threads
+    the other roots need nor makes callers wait on it any longer.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, root):
+        with self._lock:
+            pool = self._pools.get(root)
+            if pool is None:
+                pool = self._pools[root] = (
+                    ThreadPoolExecutor(max_workers=self.max_workers,
+                                       thread_name_prefix='aubrey-root'),
+                    threading.BoundedSemaphore(self.max_workers))
+        return pool
+
+    def submit(self, root, function, *args):
+        """Start function(*args) on the root's pool, or return None if the pool is full."""
+        executor, slots = self._pool(root)
+        if not slots.acquire(blocking=False):
+            return None
+
+        def call():
+            try:
+                return function(*args)
+            finally:
+                slots.release()
+
+        try:
+            return executor.submit(call)
+        except BaseException:
+            slots.release()
+            raise
+
+
+@contextmanager
+def filesystem_access():
+    """Wait for a turn to use the filesystem, if FS_MAX_OPERATIONS limits it."""
+    limiter = current_app.config['FS_LIMITER']
+    if limiter is None:
+        yield
+    else:
+        with limiter.slot():
+            yield
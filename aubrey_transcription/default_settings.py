@@ -1,5 +1,14 @@
 SECRET_KEY = 'dev'
+# PAIRTREE_BASE may also be a list of roots, which are all looked in for each record. Where
+# a file is in more than one, the earlier root's copy is used. PAIRTREE_ROUTES maps identifier
+# prefixes to the root (or list of roots) their records are in, so the others aren't checked.
+# Each root has PAIRTREE_ROOT_TIMEOUT seconds (or None for no limit) to answer before the
+# listing is served without its files. Each root is read by its own PAIRTREE_ROOT_WORKERS
+# threads, and is skipped while they are all busy.
 PAIRTREE_BASE = '/home/transcriptions/pairtree'
+PAIRTREE_ROUTES = {}
+PAIRTREE_ROOT_TIMEOUT = 5
+PAIRTREE_ROOT_WORKERS = 16
 TRANSCRIPTION_URL = 'http://example.com'
 EXTENSIONS_META = {
     'vtt': {
@@ -7,6 +16,88 @@ EXTENSIONS_META = {
         'use': 'vtt',
     },
 }
+# Files with these extensions get "vtt_valid_header", "vtt_cue_count" and "vtt_duration" (the
+# end of the last cue, in seconds) in their files info, read from the files themselves. The
+# results for VTT_METADATA_CACHE_SIZE files are remembered until the files change.
+VTT_METADATA_EXTENSIONS = ()
+VTT_METADATA_CACHE_SIZE = 65536
 FILENAME_PATTERN = (r'(?P<metaid>[^_]*)_m?(?P<manifestation>[^_]*)_(?P<fileset>[^-]*)'
                     r'-(?P<kind>[^-]*)-(?P<language>[^.]*)\.(?P<extension>.*)')
-JSON_SORT_KEYS = False
+# Sort the keys of listings, as Flask always has. Set JSON_SORT_KEYS to False to keep them in
+# the order they are built in. JSON_PROVIDER is "auto", "orjson" or "json"; "auto" uses
+# orjson if it is installed.
+JSON_SORT_KEYS = True
+JSON_PROVIDER = 'auto'
+# Number of parsed filenames remembered so FILENAME_PATTERN doesn't have to match them again.
+FILENAME_CACHE_SIZE = 65536
+# Directory listings are cached per worker process. Set LISTING_CACHE_MAX_ENTRIES to 0 to
+# disable the cache. LISTING_CACHE_TTL is in seconds, or None to only rely on the mtime check.
+LISTING_CACHE_MAX_ENTRIES = 4096
+LISTING_CACHE_MAX_BYTES = 32 * 1024 * 1024
+LISTING_CACHE_TTL = 300
+# With LISTING_CACHE_BACKEND = 'shared', every worker process on the host uses one cache kept in
+# the file at LISTING_CACHE_PATH (the instance directory by default; somewhere in /dev/shm
+# keeps it in memory). It has LISTING_CACHE_MAX_ENTRIES slots of LISTING_CACHE_SLOT_SIZE
+# bytes, and listings too big for a slot aren't cached. LISTING_CACHE_MAX_BYTES is ignored.
+LISTING_CACHE_BACKEND = 'memory'
+LISTING_CACHE_PATH = None
+LISTING_CACHE_SLOT_SIZE = 16384
+# At most FS_MAX_OPERATIONS stats and directory scans of the pairtree run at once in each
+# worker process, or None for no limit. Requests wait up to FS_WAIT_TIMEOUT seconds (or None
+# for as long as it takes) for a turn before getting a 503.
+FS_MAX_OPERATIONS = None
+FS_WAIT_TIMEOUT = None
+# Records that don't exist are remembered for NEGATIVE_CACHE_TTL seconds, so repeated requests
+# for them don't reach the pairtree. Set NEGATIVE_CACHE_MAX_ENTRIES to 0 to disable this.
+NEGATIVE_CACHE_MAX_ENTRIES = 65536
+NEGATIVE_CACHE_TTL = 30
+# A Bloom filter of the records in the pairtree, written by "flask build-bloom-filter". When
+# BLOOM_FILTER_PATH is set, identifiers the filter rules out get an empty listing without any
+# filesystem access. Records added later are only picked up with WATCH_PAIRTREE or a rebuild.
+BLOOM_FILTER_PATH = None
+BLOOM_FILTER_ERROR_RATE = 0.001
+# Batch requests (/batch) look up at most BATCH_MAX_IDENTIFIERS identifiers, using a pool of
+# BATCH_MAX_WORKERS threads shared by all requests in the worker process.
+BATCH_MAX_IDENTIFIERS = 100
+BATCH_MAX_WORKERS = 8
+# Where "flask build-index" writes its index of the pairtree. When SERVE_FROM_INDEX is True,
+# listings come from that index and the pairtree is only read for records it doesn't have.
+INDEX_PATH = None
+SERVE_FROM_INDEX = False
+# Results per page from /search, which looks records up in the index at INDEX_PATH.
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_PAGE_SIZE = 1000
+# Watch PAIRTREE_BASE from a background thread and refresh the cache and index entries of the
+# records that change. WATCH_METHOD is "auto", "inotify" or "poll"; "auto" uses inotify if
+# it is available, and polls if it runs out of inotify watches. WATCH_POLL_INTERVAL is the
+# number of seconds between polls.
+WATCH_PAIRTREE = False
+WATCH_METHOD = 'auto'
+WATCH_POLL_INTERVAL = 60
+# Serve the transcription files at FILES_ROUTE followed by their pairpath and name, so
+# TRANSCRIPTION_URL can be this app's URL plus FILES_ROUTE. FILES_SEND_METHOD is "sendfile"
+# (the WSGI server's file wrapper), "x-sendfile" (an X-Sendfile header for Apache or
+# lighttpd) or "x-accel-redirect" (for nginx, with FILES_ACCEL_LOCATIONS mapping each pairtree
+# root to its internal location). Files may be reused for FILES_MAX_AGE seconds.
+SERVE_FILES = False
+FILES_ROUTE = '/files'
+FILES_SEND_METHOD = 'sendfile'
+FILES_ACCEL_LOCATIONS = {}
+FILES_MAX_AGE = 86400
+# Number of seconds clients and proxies may reuse a listing without revalidating it, or None
+# to leave out the Cache-Control header. Listings always have an ETag and Last-Modified.
+CACHE_CONTROL_MAX_AGE = 60
+# Listings and batch responses of at least COMPRESSION_MIN_SIZE bytes are sent gzip or deflate
+# compressed to clients that accept it, or set it to None to never compress. COMPRESSION_LEVEL
+# goes from 1 (fastest) to 9 (smallest).
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+# Number of threads the ASGI app (aubrey_transcription.asgi) handles requests with.
+ASGI_MAX_WORKERS = 32
+# Time each stage of building a listing, sending the timings in a Server-Timing header and
+# serving histograms of them (per worker process) in the Prometheus format at /metrics.
+METRICS_ENABLED = False
+# Serve every record's files info as one stream of NDJSON at /harvest. Each request crawls the
+# whole pairtree, so only turn it on where the route can't be reached by anyone but harvesters.
+# The "flask harvest" command works either way.
+HARVEST_ENABLED = False
@@ -0,0 +1,85 @@
+import os
+import stat
+
+from flask import abort, current_app, send_file
+from pypairtree import pairtree
+from werkzeug.exceptions import ServiceUnavailable
+
+from .concurrency import filesystem_access
+from .utils import configured_roots, make_path, map_roots
+
+
+# How a file's bytes get to the client: by the WSGI server (with wsgi.file_wrapper, which
+# uses sendfile where it can), or by a front proxy told where the file is in a header.
+SEND_METHODS = ('sendfile', 'x-sendfile', 'x-accel-redirect')
+
+
+def find_file(pairpath, filename):
+    """Get the full path and stat result of a file in the record's directory, or None.
+
+    With several roots, the file is taken from the root with the highest precedence that
+    has it, like find_files does. A 503 is raised if no root had it but some didn't answer.
+    """
+    def stat_file(directory):
+        path = os.path.join(directory, filename)
+        try:
+            result = os.stat(path)
+        except OSError:
+            return None
+        return (path, result) if stat.S_ISREG(result.st_mode) else None
+
+    found, complete = map_roots(stat_file, pairpath)
+    for result in found:
+        if result is not None:
+            return result
+    if not complete:
+        raise ServiceUnavailable('The transcriptions storage did not respond in time.')
+    return None
+
+
+def accel_redirect_location(path):
+    """Map a file's full path to the proxy's internal location for it.
+
+    FILES_ACCEL_LOCATIONS maps each pairtree root to the location it is served at.
+    """
+    locations = current_app.config['FILES_ACCEL_LOCATIONS']
+    for root in configured_roots(current_app.config):
+        relative = os.path.relpath(path, root)
+        if root in locations and not relative.startswith('..'):
+            return '{}/{}'.format(locations[root].rstrip('/'), relative)
+    raise LookupError('FILES_ACCEL_LOCATIONS has no location for {}'.format(path))
+
+
+def file_view(pairpath, filename):
+    """Sends a transcription file from the pairtree.
+
+    The URL is the file's pairpath and name, the same as its flocat after TRANSCRIPTION_URL,
+    and only names matching FILENAME_PATTERN with an extension in EXTENSIONS_META are
+    served. Range and conditional requests are answered, and the file's bytes are sent by
+    the server or a front proxy (see FILES_SEND_METHOD) without being read by Python.
+    """
+    pairpath = '/' + pairpath
+    # Only the canonical pairpath of an identifier is accepted, which also keeps ".." out.
+    if make_path(pairtree.deSanitizeString(pairpath.rsplit('/', 1)[-1])) != pairpath:
+        abort(404)
+    if current_app.config['FILENAME_REGEX'].fullmatch(filename) is None:
+        abort(404)
+    meta = current_app.config['EXTENSIONS_META'].get(filename.split('.')[-1])
+    if meta is None:
+        abort(404)
+    with filesystem_access():
+        found = find_file(pairpath, filename)
+    if found is None:
+        abort(404)
+    path, result = found
+    max_age = current_app.config['FILES_MAX_AGE']
+    if current_app.config['FILES_SEND_METHOD'] != 'x-accel-redirect':
+        return send_file(path, mimetype=meta['mimetype'], conditional=True,
+                         last_modified=result.st_mtime, max_age=max_age)
+    # The proxy sends the file, and handles ranges and conditional requests itself.
+    response = current_app.response_class(mimetype=meta['mimetype'])
+    response.headers['X-Accel-Redirect'] = accel_redirect_location(path)
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
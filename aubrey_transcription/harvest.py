@@ -0,0 +1,103 @@
+import logging
+from datetime import datetime, timezone
+
+import click
+from flask import current_app, jsonify, request, stream_with_context
+from flask.cli import with_appcontext
+from pypairtree import pairtree
+from werkzeug.exceptions import ServiceUnavailable
+
+from .aubrey_transcription import load_listing
+from .concurrency import filesystem_access
+from .utils import (make_path, configured_roots, walk_pairtrees, directory_mtime,
+                    get_files_info)
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_modified_since(value):
+    """Convert an ISO 8601 date or time to nanoseconds since the epoch, like directory mtimes.
+
+    Times without a timezone are taken to be in UTC. Raises ValueError if it can't be parsed.
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    delta = moment - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 10 ** 9 + delta.microseconds * 1000
+
+
+def harvest_lines(after=None, modified_since=None):
+    """Yield an NDJSON line with the files info of every record in the pairtree.
+
+    Records come in pairtree order, starting after the `after` identifier if one is given,
+    and only those whose directory changed at or after `modified_since` (in nanoseconds) are
+    included. Listings already in the cache are used as they are, but the ones built here
+    aren't added to it, so a harvest doesn't push the popular records out of it.
+
+    A record whose storage doesn't answer in time gets a line with an "error" instead of
+    "files", so the rest of the harvest still goes out and the record can be asked for again.
+    """
+    encode = current_app.json.encode
+    reuse_bodies = not current_app.json.pretty()
+    after_pairpath = make_path(after) if after else None
+    roots = configured_roots(current_app.config)
+    for pairpath in walk_pairtrees(roots, after=after_pairpath):
+        identifier = pairtree.deSanitizeString(pairpath.rsplit('/', 1)[-1])
+        try:
+            if modified_since is not None:
+                with filesystem_access():
+                    mtime = directory_mtime(pairpath)
+                if mtime is None or mtime < modified_since:
+                    continue
+            listing = load_listing(pairpath)
+            body = listing.body if reuse_bodies else None
+            if body is None:
+                body = encode(get_files_info(pairpath, listing.files), pretty=False)
+        except ServiceUnavailable as error:
+            # The headers are long gone, so the error can only be reported in the stream.
+            logger.warning('Harvest could not read %s: %s', pairpath, error.description)
+            yield encode({'identifier': identifier, 'error': error.description}, pretty=False)
+            continue
+        yield (b'{"identifier":' + encode(identifier, pretty=False)[:-1] +
+               b',"files":' + body[:-1] + b'}\n')
+
+
+def harvest_view():
+    """Streams the files info of every record as newline delimited JSON.
+
+    A harvest can be resumed with the "after" query parameter set to the last identifier
+    received, and limited to records changed since a time with "modified_since". The route
+    is only there with HARVEST_ENABLED on.
+    """
+    modified_since = request.args.get('modified_since')
+    if modified_since is not None:
+        try:
+            modified_since = parse_modified_since(modified_since)
+        except ValueError:
+            return jsonify({'error': 'modified_since must be an ISO 8601 date or time.'}), 400
+    lines = harvest_lines(request.args.get('after'), modified_since)
+    return current_app.response_class(stream_with_context(lines),
+                                      mimetype='application/x-ndjson')
+
+
+@click.command('harvest')
+@click.option('--after', help='Start after this identifier, to resume an earlier harvest.')
+@click.option('--modified-since',
+              help='Only include records changed since this ISO 8601 date or time.')
+@click.option('--output', type=click.File('wb'), default='-',
+              help='Where to write the NDJSON. Defaults to standard output.')
+@with_appcontext
+def harvest_command(after, modified_since, output):
+    """Write the files info of every record in PAIRTREE_BASE as NDJSON."""
+    if modified_since is not None:
+        try:
+            modified_since = parse_modified_since(modified_since)
+        except ValueError:
+            raise click.BadParameter('Expected an ISO 8601 date or time.',
+                                     param_hint='--modified-since')
+    for line in harvest_lines(after, modified_since):
+        output.write(line)
@@ -0,0 +1,194 @@
+import logging
+import os
+import sqlite3
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from pypairtree import pairtree
+
+from .utils import (FileEntry, ParsedFilename, PartialFiles, configured_roots,
+                    walk_pairtrees, directory_mtime, find_files, sort_files)
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE records (
+    pairpath TEXT PRIMARY KEY,
+    identifier TEXT NOT NULL,
+    mtime INTEGER
+) WITHOUT ROWID;
+CREATE TABLE files (
+    pairpath TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER,
+    metaid TEXT NOT NULL,
+    manifestation TEXT NOT NULL,
+    fileset TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    language TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    PRIMARY KEY (pairpath, name)
+) WITHOUT ROWID;
+'''
+# The fields /search can look records up by. Each has an index ordered by pairpath, so the
+# records with a value can be read a page at a time straight from it.
+SEARCH_FIELDS = ('language', 'kind', 'extension', 'manifestation')
+SEARCH_INDEXES = ''.join('CREATE INDEX files_{0} ON files ({0}, pairpath);\n'.format(field)
+                         for field in SEARCH_FIELDS)
+
+
+def index_record(connection, pairpath):
+    """Write the index rows for a single pairpath, replacing any that were already there.
+
+    Returns the number of files indexed, or None if the record no longer exists. If one of
+    the record's roots didn't answer in time, its rows are left as they were and None is
+    returned too.
+    """
+    mtime = directory_mtime(pairpath)
+    files = [] if mtime is None else find_files(pairpath)
+    if isinstance(files, PartialFiles):
+        logger.warning('Not indexing %s, some of its roots did not answer', pairpath)
+        return None
+    connection.execute('DELETE FROM files WHERE pairpath = ?', (pairpath,))
+    connection.execute('DELETE FROM records WHERE pairpath = ?', (pairpath,))
+    if mtime is None:
+        return None
+    identifier = pairtree.deSanitizeString(pairpath.rsplit('/', 1)[-1])
+    connection.execute('INSERT INTO records VALUES (?, ?, ?)', (pairpath, identifier, mtime))
+    count = 0
+    for filename, file_size, parsed, file_mtime in files:
+        connection.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (pairpath, filename, file_size, file_mtime) + parsed)
+        count += 1
+    return count
+
+
+def build_index(index_path):
+    """Crawl the whole pairtree and write the index of its records to index_path.
+
+    The index is written to a temporary file first and then moved into place, so anything
+    serving from the old index keeps working until the new one is complete.
+
+    Returns a tuple of the number of records and number of files indexed.
+    """
+    temp_path = '{}.tmp'.format(index_path)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    records = files = 0
+    try:
+        connection.executescript(SCHEMA)
+        for pairpath in walk_pairtrees(configured_roots(current_app.config)):
+            count = index_record(connection, pairpath)
+            if count is not None:
+                records += 1
+                files += count
+        # Building the search indexes once all the rows are in is quicker than keeping them
+        # up to date row by row.
+        connection.executescript(SEARCH_INDEXES)
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_path, index_path)
+    return records, files
+
+
+class ListingIndex:
+    """Read access to an index written by build_index.
+
+    Each thread gets its own SQLite connection. If the index file is replaced by a rebuild,
+    connections are reopened on their next lookup.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def connection(self):
+        try:
+            inode = os.stat(self.index_path).st_ino
+        except OSError:
+            return None
+        local = self._local
+        if getattr(local, 'inode', None) != inode:
+            if getattr(local, 'connection', None) is not None:
+                local.connection.close()
+            local.connection = sqlite3.connect(self.index_path, check_same_thread=False)
+            local.inode = inode
+        return local.connection
+
+    def lookup(self, pairpath):
+        """Get the record's directory mtime and files, in the form find_files returns them.
+
+        Returns None if the record isn't in the index (or there is no index yet).
+        """
+        connection = self.connection()
+        if connection is None:
+            return None
+        record = connection.execute('SELECT mtime FROM records WHERE pairpath = ?',
+                                    (pairpath,)).fetchone()
+        if record is None:
+            return None
+        rows = connection.execute(
+            'SELECT name, size, mtime, metaid, manifestation, fileset, kind, language, '
+            'extension FROM files WHERE pairpath = ?',
+            (pairpath,)
+        )
+        # Sorted the same way as find_files, so the listing and its ETag are the same too.
+        return record[0], sort_files([
+            FileEntry(row[0], row[1], ParsedFilename._make(row[3:]), row[2]) for row in rows])
+
+    def search(self, criteria, after=None, limit=100):
+        """Get the pairpaths of records with a file matching every field value in criteria.
+
+        Pairpaths come in sorted order, starting after the `after` pairpath if it's given.
+        Returns None if there is no index yet.
+        """
+        connection = self.connection()
+        if connection is None:
+            return None
+        conditions, parameters = [], []
+        for field, value in sorted(criteria.items()):
+            if field not in SEARCH_FIELDS:
+                raise ValueError('Cannot search by {!r}'.format(field))
+            conditions.append('{} = ?'.format(field))
+            parameters.append(value)
+        if after is not None:
+            conditions.append('pairpath > ?')
+            parameters.append(after)
+        rows = connection.execute(
+            'SELECT DISTINCT pairpath FROM files WHERE {} ORDER BY pairpath LIMIT ?'.format(
+                ' AND '.join(conditions) or '1'),
+            parameters + [limit]
+        )
+        return [row[0] for row in rows]
+
+    def refresh(self, pairpath):
+        """Re-read a single record from the pairtree and update its rows in the index."""
+        if not os.path.exists(self.index_path):
+            return
+        with self._write_lock:
+            connection = sqlite3.connect(self.index_path, timeout=30)
+            try:
+                with connection:
+                    index_record(connection, pairpath)
+            finally:
+                connection.close()
+
+
+@click.command('build-index')
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Where to write the index. Defaults to the INDEX_PATH setting.')
+@with_appcontext
+def build_index_command(output):
+    """Crawl PAIRTREE_BASE and write the listing index."""
+    index_path = output or current_app.config['INDEX_PATH']
+    if not index_path:
+        raise click.UsageError('Set INDEX_PATH or pass --output.')
+    records, files = build_index(index_path)
+    click.echo('Indexed {} files in {} records to {}.'.format(files, records, index_path))
@@ -0,0 +1,85 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, plus encoding straight to the bytes of a response body.
+
+    Responses made with jsonify are encoded by the same method, so a body encoded ahead of
+    time is byte for byte what jsonify would have sent.
+    """
+
+    def pretty(self):
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def encode(self, obj, pretty=None):
+        """Encode obj as the UTF-8 body of a JSON response, ending in a newline.
+
+        The output is indented in debug mode or if compact is False, unless pretty is given.
+        """
+        if pretty is None:
+            pretty = self.pretty()
+        if pretty:
+            text = self.dumps(obj, indent=2)
+        else:
+            text = self.dumps(obj, separators=(',', ':'))
+        return '{}\n'.format(text).encode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj), mimetype=self.mimetype)
+
+
+class OrjsonProvider(JSONProvider):
+    """A JSON provider that encodes and decodes with orjson.
+
+    Non-ASCII characters are written as UTF-8 rather than escaped. Calls passing options
+    meant for the json module are handed to it instead.
+    """
+
+    def options(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def encode(self, obj, pretty=None):
+        option = self.options() | orjson.OPT_APPEND_NEWLINE
+        if pretty is None:
+            pretty = self.pretty()
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+
+def make_json_provider(app):
+    """Make the JSON provider chosen by the JSON_PROVIDER setting.
+
+    With "auto", orjson is used if it is installed, and the json module otherwise. Keys are
+    sorted if JSON_SORT_KEYS is set, which it is by default.
+    """
+    name = app.config['JSON_PROVIDER']
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_PROVIDER is "orjson" but orjson is not installed.')
+    if name in ('auto', 'orjson') and orjson is not None:
+        provider = OrjsonProvider(app)
+    elif name in ('auto', 'json'):
+        provider = JSONProvider(app)
+    else:
+        raise ValueError('Unknown JSON_PROVIDER {!r}'.format(name))
+    provider.sort_keys = app.config['JSON_SORT_KEYS']
+    return provider
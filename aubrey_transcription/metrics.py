@@ -0,0 +1,183 @@
+import bisect
+import threading
+import time
+
+from flask import current_app
+
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                 5, 10)
+FILE_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    """A thread-safe Prometheus style histogram of observed values."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += value
+
+    def render(self, name, labels=''):
+        """Get the exposition lines for the histogram, with cumulative bucket counts."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        label_prefix = '{},'.format(labels) if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('{}_bucket{{{}le="{}"}} {}'.format(
+                name, label_prefix, bound, cumulative))
+        label_part = '{{{}}}'.format(labels) if labels else ''
+        lines.append('{}_sum{} {}'.format(name, label_part, total))
+        lines.append('{}_count{} {}'.format(name, label_part, cumulative))
+        return lines
+
+
+class Metrics:
+    """Listing metrics aggregated over every request the process has served."""
+
+    def __init__(self):
+        self.stages = {}
+        self.files = Histogram(FILE_COUNT_BUCKETS)
+        self.cache_results = {'hit': 0, 'miss': 0, 'negative': 0, 'filtered': 0}
+        self._lock = threading.Lock()
+
+    def observe_stage(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(stage, Histogram(STAGE_BUCKETS))
+        histogram.observe(seconds)
+
+    def count_cache_result(self, result):
+        with self._lock:
+            self.cache_results[result] += 1
+
+    def render(self):
+        """Get the metrics in the Prometheus text exposition format."""
+        lines = [
+            '# HELP aubrey_transcription_stage_seconds Time spent in each stage of a listing.',
+            '# TYPE aubrey_transcription_stage_seconds histogram',
+        ]
+        with self._lock:
+            stages = sorted(self.stages.items())
+        for stage, histogram in stages:
+            lines.extend(histogram.render('aubrey_transcription_stage_seconds',
+                                          'stage="{}"'.format(stage)))
+        lines.extend([
+            '# HELP aubrey_transcription_listing_files Number of files in each listing.',
+            '# TYPE aubrey_transcription_listing_files histogram',
+        ])
+        lines.extend(self.files.render('aubrey_transcription_listing_files'))
+        lines.extend([
+            '# HELP aubrey_transcription_listing_cache_total Listing cache lookups by result.',
+            '# TYPE aubrey_transcription_listing_cache_total counter',
+        ])
+        with self._lock:
+            cache_results = sorted(self.cache_results.items())
+        for result, count in cache_results:
+            lines.append('aubrey_transcription_listing_cache_total{{result="{}"}} {}'.format(
+                result, count))
+        return '\n'.join(lines) + '\n'
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullTimer:
+    """Stands in for a RequestTimer when metrics are turned off, doing as little as possible."""
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def cache_result(self, result):
+        pass
+
+    def files(self, count):
+        pass
+
+    def finish(self, response):
+        return response
+
+
+NULL_TIMER = NullTimer()
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.durations.append((self.name, time.perf_counter() - self.start))
+        return False
+
+
+class RequestTimer:
+    """Records how long each stage of building one listing response takes."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.durations = []
+        self.cache = None
+        self.file_count = None
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def cache_result(self, result):
+        self.cache = result
+
+    def files(self, count):
+        self.file_count = count
+
+    def finish(self, response):
+        """Add the Server-Timing header to the response and add this request to the metrics."""
+        entries = ['{};dur={:.3f}'.format(name, seconds * 1000)
+                   for name, seconds in self.durations]
+        if self.cache is not None:
+            entries.append('cache;desc={}'.format(self.cache))
+        if entries:
+            response.headers['Server-Timing'] = ', '.join(entries)
+        for name, seconds in self.durations:
+            self.metrics.observe_stage(name, seconds)
+        if self.cache is not None:
+            self.metrics.count_cache_result(self.cache)
+        if self.file_count is not None:
+            self.metrics.files.observe(self.file_count)
+        return response
+
+
+def start_timer():
+    """Get a timer for the current request, or the NullTimer if metrics are turned off."""
+    metrics = current_app.config['METRICS']
+    if metrics is None:
+        return NULL_TIMER
+    return RequestTimer(metrics)
+
+
+def metrics_view():
+    """Returns the process's metrics in the Prometheus text format."""
+    return current_app.response_class(current_app.config['METRICS'].render(),
+                                      mimetype='text/plain; version=0.0.4')
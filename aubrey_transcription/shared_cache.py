@@ -0,0 +1,207 @@
+import fcntl
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from .utils import FileEntry, Listing, ParsedFilename
+
+
+FILE_HEADER = struct.Struct('<8sIII')
+MAGIC = b'AUBCACHE'
+VERSION = 2
+# Each slot starts with a sequence number, then the key hash, fingerprint, expiry time and the
+# lengths of the key and value that follow.
+SEQ = struct.Struct('<Q')
+SLOT_FIELDS = struct.Struct('<QqdII')
+SLOT_HEADER = struct.Struct('<QQqdII')
+NO_EXPIRY = float('inf')
+
+
+def dump_listing(listing):
+    """Serialize a Listing, along with its encoded bodies, into bytes."""
+    files = tuple((entry.name, entry.size, None if entry.parsed is None else tuple(entry.parsed),
+                   entry.mtime)
+                  for entry in listing.files)
+    return marshal.dumps((listing.pairpath, listing.mtime, listing.etag, listing.body,
+                          tuple(listing.encoded.items()), files))
+
+
+def load_listing(data):
+    """Rebuild a Listing serialized by dump_listing."""
+    pairpath, mtime, etag, body, encoded, files = marshal.loads(data)
+    files = [FileEntry(name, size, None if parsed is None else ParsedFilename._make(parsed), mtime)
+             for name, size, parsed, mtime in files]
+    listing = Listing(pairpath, files, mtime, cacheable=True, etag=etag)
+    listing.body = body
+    listing.encoded = dict(encoded)
+    return listing
+
+
+class SharedListingCache:
+    """A listing cache in a memory mapped file, shared by every worker process on the host.
+
+    The file holds a fixed number of fixed size slots, so it never grows past
+    slots * slot_size bytes. Each pairpath hashes to one slot, and storing a listing
+    replaces whatever was in its slot. Listings too big for a slot aren't cached.
+
+    Writers lock the slot they change, both between threads and between processes. Readers
+    don't lock; a sequence number that is bumped before and after every write lets them spot
+    a slot that changed while they were copying it, which is then treated as a miss.
+
+    It can be used in place of a ListingCache, though it only stores Listings, and
+    fingerprints must be ints.
+    """
+
+    def __init__(self, path, slots, slot_size, ttl=None, clock=time.time):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._fd = self._open()
+        self._map = mmap.mmap(self._fd, FILE_HEADER.size + slots * slot_size)
+
+    def _open(self):
+        """Open the cache file, laying it out first if it's new or is laid out differently."""
+        header = FILE_HEADER.pack(MAGIC, VERSION, self.slots, self.slot_size)
+        length = FILE_HEADER.size + self.slots * self.slot_size
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                # The file may have been replaced by another process while we waited for the
+                # lock, in which case the new one is opened instead.
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    if os.pread(fd, FILE_HEADER.size, 0) == header:
+                        return fd
+                    if os.fstat(fd).st_size == 0:
+                        os.ftruncate(fd, length)
+                        os.pwrite(fd, header, 0)
+                        return fd
+                    # The file is laid out for other settings. Processes may still be using
+                    # it, so rather than resizing it under them, it is replaced.
+                    self._replace(header, length)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _replace(self, header, length):
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.')
+        try:
+            os.ftruncate(temp_fd, length)
+            os.pwrite(temp_fd, header, 0)
+        finally:
+            os.close(temp_fd)
+        os.replace(temp_path, self.path)
+
+    def __len__(self):
+        return sum(1 for offset in self._offsets() if self._read_header(offset)[1])
+
+    @property
+    def total_bytes(self):
+        return sum(header[5] for header in map(self._read_header, self._offsets()) if header[1])
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def get(self, key, fingerprint):
+        """Return the cached value for key, or None if it is missing, stale or expired."""
+        key = key.encode('utf-8', 'surrogateescape')
+        key_hash = self._hash(key)
+        offset = self._offset(key_hash)
+        seq, slot_hash, slot_fingerprint, expires, key_length, value_length = \
+            self._read_header(offset)
+        if (seq & 1 or slot_hash != key_hash or slot_fingerprint != fingerprint or
+                expires <= self.clock() or
+                SLOT_HEADER.size + key_length + value_length > self.slot_size):
+            return None
+        start = offset + SLOT_HEADER.size
+        data = self._map[start:start + key_length + value_length]
+        if self._read_header(offset)[0] != seq or data[:key_length] != key:
+            return None
+        try:
+            return load_listing(data[key_length:])
+        except (ValueError, EOFError, TypeError):
+            # Only possible if the slot was torn by a writer that died in the middle.
+            return None
+
+    def set(self, key, fingerprint, value, size=0):
+        """Store the listing for key, replacing whatever was in its slot."""
+        key = key.encode('utf-8', 'surrogateescape')
+        data = dump_listing(value)
+        key_hash = self._hash(key)
+        offset = self._offset(key_hash)
+        if SLOT_HEADER.size + len(key) + len(data) > self.slot_size:
+            self.invalidate(key.decode('utf-8', 'surrogateescape'))
+            return
+        expires = self.clock() + self.ttl if self.ttl else NO_EXPIRY
+        with self._write(offset):
+            start = offset + SLOT_HEADER.size
+            self._map[start:start + len(key) + len(data)] = key + data
+            SLOT_FIELDS.pack_into(self._map, offset + SEQ.size, key_hash, fingerprint, expires,
+                                  len(key), len(data))
+
+    def invalidate(self, key):
+        """Remove key from the cache if it is there."""
+        key_hash = self._hash(key.encode('utf-8', 'surrogateescape'))
+        offset = self._offset(key_hash)
+        if self._read_header(offset)[1] != key_hash:
+            return
+        with self._write(offset):
+            if self._read_header(offset)[1] == key_hash:
+                SLOT_FIELDS.pack_into(self._map, offset + SEQ.size, 0, 0, 0, 0, 0)
+
+    def clear(self):
+        for offset in self._offsets():
+            with self._write(offset):
+                SLOT_FIELDS.pack_into(self._map, offset + SEQ.size, 0, 0, 0, 0, 0)
+
+    @staticmethod
+    def _hash(key):
+        # Zero marks an empty slot, so no key may hash to it.
+        return struct.unpack('<Q', hashlib.blake2b(key, digest_size=8).digest())[0] or 1
+
+    def _offset(self, key_hash):
+        return FILE_HEADER.size + (key_hash % self.slots) * self.slot_size
+
+    def _offsets(self):
+        return range(FILE_HEADER.size, FILE_HEADER.size + self.slots * self.slot_size,
+                     self.slot_size)
+
+    def _read_header(self, offset):
+        return SLOT_HEADER.unpack_from(self._map, offset)
+
+    def _write(self, offset):
+        return _SlotWrite(self, offset)
+
+
+class _SlotWrite:
+    """Holds a slot's locks, and marks it as being written, for the length of a with block."""
+
+    def __init__(self, cache, offset):
+        self.cache = cache
+        self.offset = offset
+
+    def __enter__(self):
+        cache = self.cache
+        cache._lock.acquire()
+        fcntl.lockf(cache._fd, fcntl.LOCK_EX, cache.slot_size, self.offset)
+        # An odd sequence number tells readers the slot is being written. It is set rather
+        # than bumped, as a process killed in the middle of a write leaves it odd.
+        self.seq = SEQ.unpack_from(cache._map, self.offset)[0] | 1
+        SEQ.pack_into(cache._map, self.offset, self.seq)
+        return self
+
+    def __exit__(self, *exc_info):
+        cache = self.cache
+        SEQ.pack_into(cache._map, self.offset, self.seq + 1)
+        fcntl.lockf(cache._fd, fcntl.LOCK_UN, cache.slot_size, self.offset)
+        cache._lock.release()
+        return False
@@ -1,8 +1,73 @@
+import functools
+import hashlib
+import heapq
+import logging
 import os
-from collections import defaultdict
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+from types import MappingProxyType
 
 from pypairtree import pairtree
 from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+
+logger = logging.getLogger(__name__)
+
+
+ParsedFilename = namedtuple('ParsedFilename', ['metaid', 'manifestation', 'fileset', 'kind',
+                                               'language', 'extension'])
+# A file found in a record's directory. The size and mtime (in nanoseconds) come from the same
+# stat, and are None if the file wasn't stat'ed.
+FileEntry = namedtuple('FileEntry', ['name', 'size', 'parsed', 'mtime'], defaults=(None,))
+ResponsePlan = namedtuple('ResponsePlan', ['extensions', 'url_prefix', 'kind_ranks'])
+# Which files a listing is narrowed down to: those whose parsed filename has the given value
+# for every field in criteria. Without sizes, the files' sizes are left out (and never read).
+FileFilter = namedtuple('FileFilter', ['criteria', 'sizes'])
+FILTER_FIELDS = ('manifestation', 'fileset', 'kind', 'language')
+
+# The order transcription types are listed in; anything else is sorted after these.
+TRANSCRIPTION_TYPES = (
+    'captions',
+    'subtitles',
+    'chapters',
+    'descriptions',
+    'metadata',
+    'thumbnails',
+    'other'
+)
+
+
+class Listing:
+    """The transcription files found for a pairpath, with validators for conditional requests.
+
+    The JSON body is only built when the listing is actually sent, so it starts out as None.
+    Compressed copies of it are kept in `encoded`, keyed by content coding.
+    """
+    __slots__ = ('pairpath', 'files', 'mtime', 'etag', 'body', 'encoded', 'cacheable')
+
+    def __init__(self, pairpath, files, mtime, cacheable=False, etag=None):
+        self.pairpath = pairpath
+        self.files = files
+        self.mtime = mtime
+        self.etag = make_etag(pairpath, files, mtime) if etag is None else etag
+        self.body = None
+        self.encoded = {}
+        self.cacheable = cacheable
+
+    @property
+    def size(self):
+        """The number of bytes taken up by the listing's body and its compressed copies."""
+        size = len(self.body) if self.body is not None else 0
+        return size + sum(len(data) for data in self.encoded.values())
+
+    @property
+    def last_modified(self):
+        if self.mtime is None:
+            return None
+        return datetime.fromtimestamp(self.mtime / 1e9, timezone.utc)
 
 
 def make_path(identifier):
@@ -12,19 +77,282 @@ def make_path(identifier):
     return os.path.normpath(pairpath)
 
 
-def find_files(pairpath):
-    """Get a list of all the files that exist under the path."""
-    pairtree_base = current_app.config['PAIRTREE_BASE']
+def get_full_path(pairpath, pairtree_base=None):
+    """Prefix the pairpath with PAIRTREE_BASE (or the first of them) and normalize it."""
+    if pairtree_base is None:
+        pairtree_base = configured_roots(current_app.config)[0]
     full_path = '{}{}'.format(pairtree_base, pairpath)
-    normalized_path = os.path.normpath(full_path)
-    if not os.path.isdir(normalized_path):
-        return []
-    files = os.listdir(normalized_path)
+    return os.path.normpath(full_path)
+
+
+def configured_roots(config):
+    """Get every pairtree root in the settings, in order of precedence.
+
+    PAIRTREE_BASE may be a single root or a list of them; any roots that only appear in
+    PAIRTREE_ROUTES come after those.
+    """
+    roots = []
+    for root_or_roots in [config['PAIRTREE_BASE']] + list(config['PAIRTREE_ROUTES'].values()):
+        for root in [root_or_roots] if isinstance(root_or_roots, str) else root_or_roots:
+            if root not in roots:
+                roots.append(root)
+    return roots
+
+
+def pairtree_roots(pairpath):
+    """Get the roots the pairpath's record may be in, in order of precedence.
+
+    If the record's identifier starts with a prefix in PAIRTREE_ROUTES, only the roots it's
+    routed to are used (the longest matching prefix wins), otherwise all of PAIRTREE_BASE is.
+    """
+    config = current_app.config
+    roots = config['PAIRTREE_BASE']
+    routes = config['PAIRTREE_ROUTES']
+    if routes:
+        identifier = pairtree.deSanitizeString(pairpath.rsplit('/', 1)[-1])
+        prefixes = [prefix for prefix in routes if identifier.startswith(prefix)]
+        if prefixes:
+            roots = routes[max(prefixes, key=len)]
+    return [roots] if isinstance(roots, str) else roots
+
+
+def map_roots(function, pairpath):
+    """Call function with the full path of the pairpath in each of its roots.
+
+    With more than one root, the calls run at the same time on each root's own pool of
+    threads, and any that haven't returned within PAIRTREE_ROOT_TIMEOUT seconds are given up
+    on, so a hung mount only holds up the records in it for so long. A root whose threads
+    are all still busy is skipped straight away.
+
+    Returns the results in order of the roots' precedence, and whether all of them returned.
+    Roots that didn't return have no result in the list.
+    """
+    roots = pairtree_roots(pairpath)
+    if len(roots) == 1:
+        return [function(get_full_path(pairpath, roots[0]))], True
+    executors = current_app.config['ROOT_EXECUTORS']
+    timeout = current_app.config['PAIRTREE_ROOT_TIMEOUT']
+    futures = [executors.submit(root, function, get_full_path(pairpath, root))
+               for root in roots]
+    # Every call started together, so they share a deadline.
+    deadline = None if timeout is None else time.monotonic() + timeout
+    results = []
+    complete = True
+    for root, future in zip(roots, futures):
+        if future is None:
+            logger.warning('Skipped reading %s from %s, all its threads are busy',
+                           pairpath, root)
+            complete = False
+            continue
+        try:
+            results.append(future.result(
+                timeout=None if deadline is None else max(deadline - time.monotonic(), 0)))
+        except FutureTimeoutError:
+            logger.warning('Timed out reading %s from %s', pairpath, root)
+            complete = False
+    return results, complete
+
+
+def _stat_mtime(path):
     try:
-        # Sort the files numerically by the fileset number
-        return sorted(files, key=lambda f: int(decrypt_filename(f)['fileset']))
-    except (ValueError, KeyError):
-        return files
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def directory_mtime(pairpath):
+    """Get the mtime (in nanoseconds) of the pairpath's directory, or None if there isn't one.
+
+    With several roots, it's the newest mtime of the record's directories in any of them. A
+    503 is raised if no root had the directory but some didn't answer in time.
+    """
+    mtimes, complete = map_roots(_stat_mtime, pairpath)
+    mtimes = [mtime for mtime in mtimes if mtime is not None]
+    if mtimes:
+        return max(mtimes)
+    if not complete:
+        raise ServiceUnavailable('The transcriptions storage did not respond in time.')
+    return None
+
+
+def walk_pairtree(pairtree_base, after=None):
+    """Yield the pairpath of every object directory in the pairtree, in sorted order.
+
+    An object directory is recognised by its name being the concatenation of the shorty
+    directories above it, which is how make_path lays out identifiers. If `after` is a
+    pairpath, only the pairpaths that come after it are yielded, and the directories that
+    come entirely before it aren't read at all.
+    """
+    after = after.strip('/').split('/') if after else None
+
+    def walk(path, components):
+        prefix = ''.join(components)
+        try:
+            with os.scandir(path) as entries:
+                names = sorted(entry.name for entry in entries if entry.is_dir())
+        except OSError:
+            return
+        for name in names:
+            child_components = components + [name]
+            if after is not None and child_components < after[:len(child_components)]:
+                continue
+            if components and name == prefix and (after is None or child_components > after):
+                yield '/' + '/'.join(child_components)
+            if len(name) <= 2:
+                # Identifiers of two characters or fewer are also valid shorty names.
+                yield from walk(os.path.join(path, name), child_components)
+
+    yield from walk(pairtree_base, [])
+
+
+def walk_pairtrees(pairtree_bases, after=None):
+    """Yield the pairpath of every object directory in any of the pairtrees, in sorted order.
+
+    Records that are in more than one of them are only yielded once.
+    """
+    walks = [walk_pairtree(pairtree_base, after=after) for pairtree_base in pairtree_bases]
+    previous = None
+    for pairpath in heapq.merge(*walks, key=lambda pairpath: pairpath.split('/')):
+        if pairpath != previous:
+            yield pairpath
+        previous = pairpath
+
+
+def compile_response_plan(config):
+    """Work out everything get_files_info needs from the settings ahead of time.
+
+    The plan holds the first entries of each file's info for every extension in
+    EXTENSIONS_META, TRANSCRIPTION_URL without any trailing slash, and the sort rank of
+    every transcription type.
+    """
+    extensions = {
+        extension: MappingProxyType({'MIMETYPE': meta['mimetype'], 'USE': meta['use']})
+        for extension, meta in config['EXTENSIONS_META'].items()
+    }
+    kind_ranks = {kind: rank for rank, kind in enumerate(TRANSCRIPTION_TYPES)}
+    return ResponsePlan(
+        extensions=MappingProxyType(extensions),
+        url_prefix=config['TRANSCRIPTION_URL'].rstrip('/'),
+        kind_ranks=MappingProxyType(kind_ranks),
+    )
+
+
+def make_filename_parser(filename_regex, cache_size):
+    """Make a function that parses filenames into ParsedFilename records (or None).
+
+    Results are remembered for the cache_size most recently parsed filenames, since the
+    same files are listed over and over.
+    """
+    @functools.lru_cache(maxsize=cache_size)
+    def parse_filename(filename):
+        filename_match = filename_regex.match(filename)
+        if filename_match is None:
+            return None
+        groups = filename_match.groupdict()
+        return ParsedFilename._make(groups.get(field) for field in ParsedFilename._fields)
+    return parse_filename
+
+
+def scan_directory(path, extensions, parse_filename, file_filter=None):
+    """Yield a FileEntry for each regular transcription file in the directory.
+
+    The directory is read in a single scandir pass. Entries with other extensions or names
+    that don't parse are skipped before any stat call is made, and the type check uses the
+    entry's cached type information where the filesystem provides it. So are files that
+    file_filter leaves out, and if it drops the sizes, files aren't stat'ed at all.
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.split('.')[-1] not in extensions:
+                continue
+            parsed = parse_filename(entry.name)
+            if parsed is None:
+                continue
+            if file_filter is not None and not matches_filter(parsed, file_filter):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                if file_filter is None or file_filter.sizes:
+                    result = entry.stat()
+                    file_size, file_mtime = result.st_size, result.st_mtime_ns
+                else:
+                    file_size = file_mtime = None
+            except OSError:
+                continue
+            yield FileEntry(entry.name, file_size, parsed, file_mtime)
+
+
+def matches_filter(parsed, file_filter):
+    """Check whether a parsed filename has every value the filter asks for."""
+    return all(getattr(parsed, field) == value
+               for field, value in file_filter.criteria.items())
+
+
+def filter_files(files, file_filter):
+    """Narrow down a list of FileEntry tuples that was found without a filter."""
+    return [entry if file_filter.sizes else entry._replace(size=None, mtime=None)
+            for entry in files
+            if entry.parsed is not None and matches_filter(entry.parsed, file_filter)]
+
+
+def make_etag(pairpath, files, mtime):
+    """Make a strong ETag from everything the record's files info is built from."""
+    digest = hashlib.sha1()
+    url_prefix = current_app.config['RESPONSE_PLAN'].url_prefix
+    digest.update('{}\0{}\0{}'.format(url_prefix, pairpath, mtime).encode(
+        'utf-8', 'surrogateescape'))
+    for entry in files:
+        digest.update('\0{}\0{}'.format(entry.name, entry.size).encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+class PartialFiles(list):
+    """The files find_files found when some of the record's roots didn't answer in time.
+
+    These are served but not cached, so the missing files show up once the root recovers.
+    """
+
+
+def find_files(pairpath, file_filter=None):
+    """Get a list of all the transcription files that exist under the path, with their sizes.
+
+    With several roots, the record's directory is scanned in all of them at once. If a file
+    is in more than one, it's taken from the root with the highest precedence. If a
+    FileFilter is given, only the files it keeps are listed.
+    """
+    extensions_meta = current_app.config['EXTENSIONS_META']
+    parse_filename = current_app.config['FILENAME_PARSER']
+
+    def scan(normalized_path):
+        try:
+            return list(scan_directory(normalized_path, extensions_meta, parse_filename,
+                                       file_filter))
+        except OSError:
+            # The path doesn't exist or isn't a directory.
+            return []
+
+    found, complete = map_roots(scan, pairpath)
+    if len(found) == 1:
+        files = found[0]
+    else:
+        files = list({entry.name: entry
+                      for root_files in reversed(found) for entry in root_files}.values())
+    files = sort_files(files)
+    return files if complete else PartialFiles(files)
+
+
+def sort_files(files):
+    """Put FileEntry tuples in the order listings are built from.
+
+    Files are sorted numerically by fileset number and then by name, or just by name if a
+    fileset isn't a number, so a record's listing, and its ETag, don't depend on the order
+    the filesystem happens to list its directory in.
+    """
+    try:
+        return sorted(files, key=lambda f: (int(f.parsed.fileset), f.name))
+    except (ValueError, TypeError, AttributeError):
+        return sorted(files, key=lambda f: f.name)
 
 
 def assign_val_for_sorting(file_info):
@@ -34,18 +362,11 @@ def assign_val_for_sorting(file_info):
     captions -> subtitles -> chapters -> descriptions -> metadata -> thumbnails -> everything else
     and then we want to secondarily sort alphabetically by language, but putting English first.
     """
-    transcription_types = [
-        'captions',
-        'subtitles',
-        'chapters',
-        'descriptions',
-        'metadata',
-        'thumbnails',
-        'other'
-    ]
     transcription_type = file_info.get('vtt_kind', 'other')
+    if transcription_type not in TRANSCRIPTION_TYPES:
+        transcription_type = 'other'
     # First letter of the sort word is based on the transcription type
-    sort_word = chr(ord('a') + transcription_types.index(transcription_type))
+    sort_word = chr(ord('a') + TRANSCRIPTION_TYPES.index(transcription_type))
     # Last 3 letters are from the language, using 'aaa' for English so it sorts first
     language = file_info.get('language', 'zzz')
     if language == 'eng':
@@ -57,45 +378,47 @@ def assign_val_for_sorting(file_info):
 def get_files_info(pairpath, files):
     """Make a dictionary with information about each of the given files.
 
-    The files are also checked to make sure that they have the expected
+    The files are the FileEntry tuples found by find_files, already parsed and with their
+    sizes, so their names don't need matching again. Files with an extension in
+    VTT_METADATA_EXTENSIONS also get their cue metadata, which means a read of any version
+    of them not seen before; versions are told apart by the mtime and size they were listed
+    with. Files found without their sizes have neither SIZE nor cue metadata, so they aren't
+    touched at all. The files are also checked to make sure that they have the expected
     extension. Files which are of the wrong type are not included in the dict.
     """
-    extensions_meta = current_app.config['EXTENSIONS_META']
-    pairtree_base = current_app.config['PAIRTREE_BASE']
-    transcription_url = current_app.config['TRANSCRIPTION_URL']
+    plan = current_app.config['RESPONSE_PLAN']
+    vtt_metadata = current_app.config['VTT_METADATA']
+    other_rank = plan.kind_ranks['other']
     files_info = defaultdict(lambda: defaultdict(list))
-    for filename in files:
+    for filename, file_size, parsed, file_mtime in files:
         extension = filename.split('.')[-1]
-        if extension in extensions_meta:
-            file_path = os.path.join(pairpath, filename)
-            filename_dict = decrypt_filename(filename)
-            if not filename_dict:
-                continue
-            local_flocat = os.path.normpath('{}{}{}'.format(pairtree_base, os.sep, file_path))
-            try:
-                file_size = os.path.getsize(local_flocat)
-            except OSError:
-                continue
-            file_info = {
-                'MIMETYPE': extensions_meta[extension]['mimetype'],
-                'USE': extensions_meta[extension]['use'],
-                'flocat': '{}{}'.format(transcription_url.rstrip('/'), file_path),
-                'SIZE': str(file_size),
-                'vtt_kind': filename_dict['kind'],
-                'language': filename_dict['language'],
-            }
-            files_info[filename_dict['manifestation']][filename_dict['fileset']].append(file_info)
-    if files_info:
-        files_info[filename_dict['manifestation']][filename_dict['fileset']].sort(
-            key=assign_val_for_sorting)
+        template = plan.extensions.get(extension)
+        if template is None or parsed is None:
+            continue
+        file_info = dict(template)
+        file_info['flocat'] = '{}{}'.format(plan.url_prefix, os.path.join(pairpath, filename))
+        if file_size is not None:
+            file_info['SIZE'] = str(file_size)
+        file_info['vtt_kind'] = parsed.kind
+        file_info['language'] = parsed.language
+        if (file_mtime is not None and vtt_metadata is not None and
+                extension in vtt_metadata.extensions):
+            file_info.update(vtt_metadata.fields(pairpath, filename, file_mtime, file_size))
+        # Keep the sort key (see assign_val_for_sorting) with the file until it's sorted.
+        sort_key = (plan.kind_ranks.get(parsed.kind, other_rank),
+                    'aaa' if parsed.language == 'eng' else parsed.language)
+        files_info[parsed.manifestation][parsed.fileset].append((sort_key, file_info))
+    for filesets in files_info.values():
+        for fileset, keyed_files in filesets.items():
+            keyed_files.sort(key=lambda keyed_file: keyed_file[0])
+            filesets[fileset] = [file_info for _, file_info in keyed_files]
 
     return files_info
 
 
 def decrypt_filename(filename):
     """Break apart a transcription filename into it's various parts."""
-    filename_regex = current_app.config['FILENAME_REGEX']
-    filename_match = filename_regex.match(filename)
-    if filename_match:
-        return filename_match.groupdict()
+    parsed = current_app.config['FILENAME_PARSER'](filename)
+    if parsed is not None:
+        return parsed._asdict()
     return {}
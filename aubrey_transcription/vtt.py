@@ -0,0 +1,81 @@
+import functools
+import mmap
+import os
+import re
+from collections import namedtuple
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from .concurrency import filesystem_access
+from .files import find_file
+
+
+VttMetadata = namedtuple('VttMetadata', ['valid_header', 'cue_count', 'duration'])
+
+HEADER = re.compile(rb'(?:\xef\xbb\xbf)?WEBVTT(?:[ \t\r\n]|\Z)')
+TIMESTAMP = rb'(?:(\d+):)?(\d{2}):(\d{2})\.(\d{3})'
+# The line that starts a cue. Nothing else in a WebVTT file may contain "-->".
+CUE_TIMINGS = re.compile(rb'^[ \t]*' + TIMESTAMP + rb'[ \t]+-->[ \t]+' + TIMESTAMP,
+                         re.MULTILINE)
+
+
+def _seconds(hours, minutes, seconds, milliseconds):
+    return (int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) +
+            int(milliseconds) / 1000)
+
+
+def parse_vtt(path):
+    """Read the header validity, number of cues and end of the last cue of a WebVTT file.
+
+    The file is memory mapped and only its cue timing lines are matched, so it is never
+    read into memory as a whole. The duration is in seconds.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return VttMetadata(False, 0, 0.0)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            valid_header = HEADER.match(data) is not None
+            cue_count = 0
+            duration = 0.0
+            for timings in CUE_TIMINGS.finditer(data):
+                cue_count += 1
+                duration = max(duration, _seconds(*timings.groups()[4:]))
+    return VttMetadata(valid_header, cue_count, round(duration, 3))
+
+
+class VttMetadataReader:
+    """Adds metadata from the content of WebVTT files to their files info.
+
+    Each version of a file, told apart by its pairpath, name, mtime and size, is only parsed
+    once; the results for the cache_size most recently read versions are remembered. The
+    mtime and size are the ones the file was listed with, so a version that was seen before
+    is answered without touching the file at all.
+    """
+
+    def __init__(self, extensions, cache_size):
+        self.extensions = frozenset(extensions)
+        self._parse = functools.lru_cache(maxsize=cache_size)(self._parse_version)
+
+    @staticmethod
+    def _parse_version(pairpath, filename, mtime, size):
+        with filesystem_access():
+            found = find_file(pairpath, filename)
+            if found is None:
+                raise FileNotFoundError(filename)
+            return parse_vtt(found[0])
+
+    def fields(self, pairpath, filename, mtime, size):
+        """Get the extra files info entries for a version of a file, or none if it can't be read.
+
+        A file whose storage doesn't answer in time just goes without them, rather than
+        holding up the listing.
+        """
+        try:
+            metadata = self._parse(pairpath, filename, mtime, size)
+        except (OSError, ValueError, ServiceUnavailable):
+            return {}
+        return {
+            'vtt_valid_header': metadata.valid_header,
+            'vtt_cue_count': metadata.cue_count,
+            'vtt_duration': metadata.duration,
+        }
@@ -0,0 +1,286 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+
+from flask import current_app
+from pypairtree import pairtree
+from werkzeug.exceptions import ServiceUnavailable
+
+from .utils import (make_path, configured_roots, walk_pairtrees, directory_mtime,
+                    decrypt_filename)
+
+
+logger = logging.getLogger(__name__)
+
+# Constants from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def record_pairpath(pairtree_base, path):
+    """Map a path somewhere under the pairtree to the pairpath of the record it belongs to.
+
+    Returns None if the path isn't inside a record's directory.
+    """
+    relative = os.path.relpath(path, pairtree_base)
+    if relative == '.' or relative.startswith('..'):
+        return None
+    components = relative.split(os.sep)
+    # The record's directory is the one whose pairpath make_path would give for its name.
+    for end in range(len(components), 0, -1):
+        candidate = '/' + '/'.join(components[:end])
+        if make_path(pairtree.deSanitizeString(components[end - 1])) == candidate:
+            return candidate
+    return None
+
+
+def refresh_record(pairpath):
+    """Bring everything holding a copy of the record's listing up to date."""
+    # The index goes first, as listings read from it are cached too.
+    index = current_app.config['LISTING_INDEX'] or current_app.config['SEARCH_INDEX']
+    if index is not None:
+        index.refresh(pairpath)
+    for name in ('LISTING_CACHE', 'NEGATIVE_CACHE'):
+        cache = current_app.config[name]
+        if cache is not None:
+            cache.invalidate(pairpath)
+    bloom_filter = current_app.config['BLOOM_FILTER']
+    if bloom_filter is not None:
+        # Adding records that were removed does no harm, they just become false positives.
+        bloom_filter.add(pairpath)
+
+
+class Watcher:
+    """Base class for the background threads that watch the pairtree roots for changes.
+
+    The callback is called, inside an app context, with the pairpath of each record whose
+    directory changed.
+    """
+
+    def __init__(self, app, callback=refresh_record):
+        self.app = app
+        self.callback = callback
+        self.pairtree_bases = configured_roots(app.config)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='aubrey-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run(self):
+        with self.app.app_context():
+            try:
+                self.watch()
+            except Exception:
+                logger.exception('Stopped watching %s', ', '.join(self.pairtree_bases))
+
+    def watch(self):
+        raise NotImplementedError
+
+    def notify(self, pairpaths):
+        for pairpath in sorted(pairpaths):
+            try:
+                self.callback(pairpath)
+            except Exception:
+                logger.exception('Could not refresh %s', pairpath)
+
+
+class PollingWatcher(Watcher):
+    """Find changed records by comparing every record directory's mtime on an interval."""
+
+    def __init__(self, app, callback=refresh_record, interval=60):
+        super().__init__(app, callback)
+        self.interval = interval
+        self.mtimes = None
+
+    def poll(self):
+        """Walk the pairtree once, returning the pairpaths that changed since the last poll.
+
+        The first poll only records the current mtimes. Records whose mtime can't be read
+        this time keep the one from the last poll, so they're checked again on the next.
+        """
+        previous = self.mtimes or {}
+        mtimes = {}
+        for pairpath in walk_pairtrees(self.pairtree_bases):
+            try:
+                mtimes[pairpath] = directory_mtime(pairpath)
+            except ServiceUnavailable:
+                logger.warning('Could not check %s, a pairtree root did not answer', pairpath)
+                if pairpath in previous:
+                    mtimes[pairpath] = previous[pairpath]
+        previous, self.mtimes = self.mtimes, mtimes
+        if previous is None:
+            return set()
+        changed = {pairpath for pairpath, mtime in mtimes.items()
+                   if previous.get(pairpath) != mtime}
+        return changed | (previous.keys() - mtimes.keys())
+
+    def watch(self):
+        self.poll_safely()
+        while not self._stop.wait(self.interval):
+            self.notify(self.poll_safely())
+
+    def poll_safely(self):
+        """Poll, logging any error instead of letting it stop the watcher."""
+        try:
+            return self.poll()
+        except Exception:
+            logger.exception('Could not poll %s', ', '.join(self.pairtree_bases))
+            return set()
+
+
+class WatchLimitReached(OSError):
+    """Raised when fs.inotify.max_user_watches runs out."""
+
+
+class InotifyWatcher(Watcher):
+    """Follow changes under the pairtree through Linux's inotify.
+
+    Every directory in the pairtree needs its own watch, so fs.inotify.max_user_watches
+    must be at least the number of directories in it. The directories are walked to add
+    the watches on the watcher's own thread. If the watches run out, then with a
+    fallback_interval the watcher switches to polling at that interval, and otherwise stops.
+    """
+
+    def __init__(self, app, callback=refresh_record, fallback_interval=None):
+        super().__init__(app, callback)
+        self.fallback_interval = fallback_interval
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+
+    def add_initial_watches(self):
+        for pairtree_base in self.pairtree_bases:
+            self.add_watches(pairtree_base)
+
+    def record_pairpath(self, path):
+        """Map a path in any of the roots to its record's pairpath, like record_pairpath."""
+        for pairtree_base in self.pairtree_bases:
+            pairpath = record_pairpath(pairtree_base, path)
+            if pairpath is not None:
+                return pairpath
+        return None
+
+    def add_watches(self, top):
+        """Watch top and every directory below it.
+
+        Returns the pairpaths of the records found along the way.
+        """
+        found = set()
+        for path, _, _ in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise WatchLimitReached(error, 'Ran out of inotify watches', path)
+                logger.warning('Could not watch %s: %s', path, os.strerror(error))
+                continue
+            self.watches[wd] = path
+            pairpath = self.record_pairpath(path)
+            if pairpath is not None:
+                found.add(pairpath)
+        return found
+
+    def read_events(self):
+        """Read the waiting events, returning the pairpaths of the records they touched."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('inotify queue overflowed, checking every record')
+                changed.update(walk_pairtrees(self.pairtree_bases))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self.add_watches(path))
+                pairpath = self.record_pairpath(path)
+            elif decrypt_filename(name):
+                pairpath = self.record_pairpath(directory)
+            else:
+                # Not a transcription file, like a partially copied file.
+                continue
+            if pairpath is not None:
+                changed.add(pairpath)
+        return changed
+
+    def watch(self):
+        try:
+            self.add_initial_watches()
+            while not self._stop.is_set():
+                ready, _, _ = select.select([self.fd], [], [], 1)
+                if ready:
+                    self.notify(self.read_events())
+        except WatchLimitReached:
+            if self.fallback_interval is None:
+                raise
+            logger.warning('Ran out of inotify watches (see fs.inotify.max_user_watches), '
+                           'polling %s instead', ', '.join(self.pairtree_bases))
+        finally:
+            os.close(self.fd)
+        # The loop only ends before the watcher is stopped if the watches ran out.
+        if not self._stop.is_set():
+            self.fallback().watch()
+
+    def fallback(self):
+        """Make the PollingWatcher that takes over, stopping along with this watcher."""
+        watcher = PollingWatcher(self.app, self.callback, interval=self.fallback_interval)
+        watcher._stop = self._stop
+        return watcher
+
+
+def create_watcher(app):
+    """Make the watcher chosen by the WATCH_METHOD setting.
+
+    With "auto", inotify is used if the platform supports it, and polling otherwise or
+    once the inotify watches run out.
+    """
+    method = app.config['WATCH_METHOD']
+    if method in ('auto', 'inotify'):
+        fallback_interval = app.config['WATCH_POLL_INTERVAL'] if method == 'auto' else None
+        try:
+            return InotifyWatcher(app, fallback_interval=fallback_interval)
+        except (AttributeError, OSError):
+            if method == 'inotify':
+                raise
+            logger.info('inotify is unavailable, polling %s instead',
+                        ', '.join(configured_roots(app.config)))
+    return PollingWatcher(app, interval=app.config['WATCH_POLL_INTERVAL'])
@@ -0,0 +1,131 @@
+"""Time the listing pipeline against a synthetic pairtree.
+
+Run from the project root, for example:
+
+    python -m benchmarks.bench --identifiers 1000 --output benchmark-results.json
+"""
+import argparse
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from aubrey_transcription import create_app
+from aubrey_transcription.utils import make_path, decrypt_filename, find_files, get_files_info
+
+from .synthetic import generate_pairtree
+
+
+def percentile(sorted_values, percent):
+    """Get the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(durations):
+    """Summarize a list of per-call durations (in nanoseconds)."""
+    durations = sorted(durations)
+    total = sum(durations)
+    to_ms = 1e-6
+    return {
+        'calls': len(durations),
+        'total_seconds': total / 1e9,
+        'ops_per_second': len(durations) / (total / 1e9) if total else None,
+        'latency_ms': {
+            'mean': total / len(durations) * to_ms if durations else 0,
+            'p50': percentile(durations, 50) * to_ms,
+            'p90': percentile(durations, 90) * to_ms,
+            'p99': percentile(durations, 99) * to_ms,
+            'max': durations[-1] * to_ms if durations else 0,
+        },
+    }
+
+
+def time_calls(function, arguments):
+    """Call function once for each tuple of arguments, returning each call's duration."""
+    durations = []
+    for args in arguments:
+        start = time.perf_counter_ns()
+        function(*args)
+        durations.append(time.perf_counter_ns() - start)
+    return durations
+
+
+def run(pairtree_base, identifier_list, iterations, seed=0):
+    """Run every benchmark, returning a dict of their summaries."""
+    rng = random.Random(seed)
+    sample = [rng.choice(identifier_list) for _ in range(iterations)]
+    pairpaths = [make_path(identifier) for identifier in sample]
+    results = {}
+    app = create_app({'PAIRTREE_BASE': pairtree_base})
+    uncached_app = create_app({'PAIRTREE_BASE': pairtree_base, 'LISTING_CACHE_MAX_ENTRIES': 0})
+
+    results['make_path'] = summarize(time_calls(make_path, [(i,) for i in sample]))
+    with app.app_context():
+        listings = {pairpath: find_files(pairpath) for pairpath in set(pairpaths)}
+        filenames = [rng.choice(listings[pairpath]).name for pairpath in pairpaths]
+        results['decrypt_filename'] = summarize(
+            time_calls(decrypt_filename, [(name,) for name in filenames]))
+        results['find_files'] = summarize(
+            time_calls(find_files, [(pairpath,) for pairpath in pairpaths]))
+        results['get_files_info'] = summarize(
+            time_calls(get_files_info, [(pairpath, listings[pairpath]) for pairpath in pairpaths]))
+
+    for name, bench_app in [('request_uncached', uncached_app), ('request', app)]:
+        client = bench_app.test_client()
+        results[name] = summarize(time_calls(
+            client.get, [('/{}/'.format(identifier),) for identifier in sample]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--identifiers', type=int, default=1000)
+    parser.add_argument('--manifestations', type=int, default=2)
+    parser.add_argument('--filesets', type=int, default=3)
+    parser.add_argument('--languages', type=int, default=3)
+    parser.add_argument('--kinds', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='Number of calls timed for each benchmark.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pairtree', help='Generate the pairtree here and keep it, '
+                        'instead of using a temporary directory.')
+    parser.add_argument('--output', default='benchmark-results.json',
+                        help='Where to write the JSON results, or "-" for stdout.')
+    args = parser.parse_args(argv)
+
+    pairtree_base = args.pairtree or tempfile.mkdtemp(prefix='aubrey-bench-')
+    try:
+        identifier_list = generate_pairtree(
+            pairtree_base, identifier_count=args.identifiers,
+            manifestations=args.manifestations, filesets=args.filesets,
+            languages=args.languages, kinds=args.kinds, seed=args.seed)
+        results = run(pairtree_base, identifier_list, args.iterations, seed=args.seed)
+    finally:
+        if not args.pairtree:
+            shutil.rmtree(pairtree_base)
+
+    report = {
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'pairtree')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
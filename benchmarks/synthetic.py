@@ -0,0 +1,52 @@
+"""Generate a synthetic pairtree of transcription files for benchmarking."""
+import os
+import random
+
+from aubrey_transcription.utils import make_path
+
+
+LANGUAGES = ['eng', 'spa', 'fre', 'ger', 'chi', 'jpn', 'ara', 'rus', 'por', 'vie']
+KINDS = ['captions', 'subtitles', 'chapters', 'descriptions', 'metadata']
+
+
+def make_vtt(cues):
+    """Make the text of a WebVTT file with the given number of cues."""
+    lines = ['WEBVTT', '']
+    for cue in range(cues):
+        lines.append('{:02d}:{:02d}.000 --> {:02d}:{:02d}.500'.format(
+            cue // 60, cue % 60, cue // 60, cue % 60))
+        lines.append('Synthetic cue number {}.'.format(cue))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def identifiers(count, prefix='metadc'):
+    return ['{}{}'.format(prefix, number) for number in range(1, count + 1)]
+
+
+def generate_pairtree(pairtree_base, identifier_count=1000, manifestations=2, filesets=3,
+                      languages=3, kinds=2, max_cues=200, seed=0):
+    """Write a pairtree of transcription files under pairtree_base.
+
+    Each identifier gets a directory at the pairpath make_path gives for it, holding one
+    .vtt file per manifestation, fileset, kind and language, named the way
+    FILENAME_PATTERN expects. A few non-transcription files are mixed in as well.
+
+    Returns the list of identifiers written.
+    """
+    rng = random.Random(seed)
+    written = identifiers(identifier_count)
+    for identifier in written:
+        directory = os.path.normpath('{}{}'.format(pairtree_base, make_path(identifier)))
+        os.makedirs(directory, exist_ok=True)
+        for manifestation in range(1, manifestations + 1):
+            for fileset in range(1, filesets + 1):
+                for kind in KINDS[:kinds]:
+                    for language in LANGUAGES[:languages]:
+                        filename = '{}_m{}_{}-{}-{}.vtt'.format(
+                            identifier, manifestation, fileset, kind, language)
+                        with open(os.path.join(directory, filename), 'w') as vtt_file:
+                            vtt_file.write(make_vtt(rng.randint(1, max_cues)))
+        with open(os.path.join(directory, '{}.xml'.format(identifier)), 'w') as other_file:
+            other_file.write('<record/>')
+    return written
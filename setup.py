@@ -4,7 +4,7 @@ from setuptools import setup, find_packages
 setup(
     name='aubrey-transcription',
     version='3.0.0',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     description='Serves up transcriptions info for Aubrey.',
     long_description='See the GitHub page for more information.',
     include_package_data=True,
@@ -12,6 +12,9 @@ setup(
         'pypairtree @ git+https://github.com/unt-libraries/pypairtree',
         'flask~=3.0.3',
     ],
+    extras_require={
+        'orjson': ['orjson'],
+    },
     zip_safe=False,
     url='https://github.com/unt-libraries/aubrey-transcription',
     author='University of North Texas Libaries',
@@ -1,5 +1,6 @@
 import pytest
 from aubrey_transcription import create_app
+from aubrey_transcription.utils import make_path
 
 
 @pytest.fixture
@@ -17,3 +18,20 @@ def client(app):
 @pytest.fixture
 def runner(app):
     return app.test_cli_runner()
+
+
+@pytest.fixture
+def pairtree_base(tmpdir):
+    """An empty pairtree in a temporary directory."""
+    return tmpdir.mkdir('pairtree')
+
+
+@pytest.fixture
+def add_file(pairtree_base):
+    """Returns a function to write a file into the record's directory in pairtree_base."""
+    def add_file(identifier, filename, content='WEBVTT\n'):
+        path = pairtree_base.join(make_path(identifier))
+        path.ensure(dir=True)
+        path.join(filename).write(content)
+        return path.join(filename)
+    return add_file
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from aubrey_transcription.asgi import AsgiApp, build_environ, create_asgi_app
+
+
+def call_asgi(asgi_app, scope, body=b''):
+    """Run one request through the ASGI app, returning the messages it sent."""
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    return sent
+
+
+def http_scope(path, query_string=b'', method='GET', headers=()):
+    return {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'root_path': '',
+        'query_string': query_string,
+        'headers': list(headers),
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 5000),
+    }
+
+
+@pytest.fixture()
+def asgi_app(pairtree_base, add_file, monkeypatch):
+    add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+    add_file('metadc1', 'metadc1_m1_2-subtitles-spa.vtt')
+    monkeypatch.setattr('aubrey_transcription.os.makedirs', lambda path: None)
+    return create_asgi_app(test_config={'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base)})
+
+
+class TestBuildEnviron:
+    def test_environ(self):
+        scope = http_scope('/metadc1/', b'a=1', headers=[
+            (b'content-type', b'application/json'),
+            (b'accept', b'text/html'),
+            (b'accept', b'application/json'),
+        ])
+        environ = build_environ(scope, b'{}')
+        assert environ['REQUEST_METHOD'] == 'GET'
+        assert environ['PATH_INFO'] == '/metadc1/'
+        assert environ['QUERY_STRING'] == 'a=1'
+        assert environ['SERVER_NAME'] == 'testserver'
+        assert environ['SERVER_PORT'] == '80'
+        assert environ['REMOTE_ADDR'] == '127.0.0.1'
+        assert environ['CONTENT_TYPE'] == 'application/json'
+        assert environ['HTTP_ACCEPT'] == 'text/html,application/json'
+        assert environ['wsgi.input'].read() == b'{}'
+        assert environ['CONTENT_LENGTH'] == '2'
+
+    def test_path_is_latin_1_encoded(self):
+        environ = build_environ(http_scope('/café/'), b'')
+        assert environ['PATH_INFO'] == '/cafÃ©/'
+
+
+class TestAsgiApp:
+    def test_same_response_as_wsgi(self, asgi_app):
+        expected = asgi_app.wsgi_app.test_client().get('/metadc1/')
+        sent = call_asgi(asgi_app, http_scope('/metadc1/'))
+        assert sent[0]['status'] == 200
+        headers = dict(sent[0]['headers'])
+        assert headers[b'content-type'] == b'application/json'
+        assert headers[b'etag'] == expected.headers['ETag'].encode()
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        assert body == expected.data
+        assert sent[-1] == {'type': 'http.response.body', 'body': b''}
+
+    def test_post_body(self, asgi_app):
+        sent = call_asgi(asgi_app, http_scope('/batch', method='POST', headers=[
+            (b'content-type', b'application/json')]), body=b'["metadc1"]')
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        assert b'metadc1_m1_1-captions-eng.vtt' in body
+
+    def test_not_modified(self, asgi_app):
+        etag = asgi_app.wsgi_app.test_client().get('/metadc1/').headers['ETag']
+        sent = call_asgi(asgi_app, http_scope('/metadc1/', headers=[
+            (b'if-none-match', etag.encode())]))
+        assert sent[0]['status'] == 304
+
+    def test_uses_configured_pool_size(self, pairtree_base, monkeypatch):
+        monkeypatch.setattr('aubrey_transcription.os.makedirs', lambda path: None)
+        asgi_app = create_asgi_app(test_config={'ASGI_MAX_WORKERS': 3})
+        assert asgi_app.executor._max_workers == 3
+
+    def test_lifespan(self, asgi_app):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi_app({'type': 'lifespan'}, receive, send))
+        assert sent == [{'type': 'lifespan.startup.complete'},
+                        {'type': 'lifespan.shutdown.complete'}]
+
+    def test_streams_harvest(self, pairtree_base, add_file, monkeypatch):
+        for number in range(100):
+            identifier = 'metadc{}'.format(number)
+            add_file(identifier, '{}_m1_1-captions-eng.vtt'.format(identifier))
+        monkeypatch.setattr('aubrey_transcription.os.makedirs', lambda path: None)
+        asgi_app = create_asgi_app(test_config={
+            'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base), 'ASGI_MAX_WORKERS': 8,
+            'HARVEST_ENABLED': True})
+        # Each line is pulled from the pool separately, likely on different threads, and all
+        # of them need the request context the first one set up.
+        sent = call_asgi(asgi_app, http_scope('/harvest'))
+        assert sent[0]['status'] == 200
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        assert len(body.splitlines()) == 100
+
+    def test_streams_chunks(self):
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return iter([b'one', b'', b'two'])
+
+        sent = call_asgi(AsgiApp(wsgi_app, max_workers=1), http_scope('/'))
+        assert [message.get('body') for message in sent[1:]] == [b'one', b'two', b'']
@@ -1,5 +1,17 @@
+import gzip
+import json
+import threading
+import time
 from unittest import mock
 
+import pytest
+
+from aubrey_transcription import create_app
+from aubrey_transcription.bloom import BloomFilter
+from aubrey_transcription.concurrency import FilesystemLimiter
+from aubrey_transcription.index import ListingIndex, build_index
+from aubrey_transcription.utils import FileEntry, FileFilter, get_files_info
+
 
 class TestListFiles:
     @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info')
@@ -7,7 +19,7 @@ class TestListFiles:
     @mock.patch('aubrey_transcription.aubrey_transcription.make_path')
     def test_200_ok(self, mock_make_path, mock_find_files, mock_get_files_info, client):
         mock_make_path.return_value = None
-        mock_find_files.return_value = None
+        mock_find_files.return_value = []
         mock_get_files_info.return_value = None
         response = client.get('/metadc123456/')
         assert response.status_code == 200
@@ -17,7 +29,7 @@ class TestListFiles:
     @mock.patch('aubrey_transcription.aubrey_transcription.make_path')
     def test_no_slash_redirect(self, mock_make_path, mock_find_files, mock_get_files_info, client):
         mock_make_path.return_value = None
-        mock_find_files.return_value = None
+        mock_find_files.return_value = []
         mock_get_files_info.return_value = None
         response = client.get('/metadc123456')  # No trailing slash.
         assert response.status_code == 308
@@ -27,7 +39,7 @@ class TestListFiles:
     @mock.patch('aubrey_transcription.aubrey_transcription.make_path')
     def test_returns_json(self, mock_make_path, mock_find_files, mock_get_files_info, client):
         mock_make_path.return_value = None
-        mock_find_files.return_value = None
+        mock_find_files.return_value = []
         mock_get_files_info.return_value = []
         response = client.get('/metadc123456/')
         json = response.get_json()
@@ -36,13 +48,474 @@ class TestListFiles:
 
     @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info')
     @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    @mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime')
     @mock.patch('aubrey_transcription.aubrey_transcription.make_path')
-    def test_returns_expected(self, mock_make_path, mock_find_files, mock_get_files_info, client):
+    def test_returns_expected(self, mock_make_path, mock_directory_mtime, mock_find_files,
+                              mock_get_files_info, client):
         mock_make_path.return_value = 'alpha'
-        mock_find_files.return_value = ['bravo', 'charlie']
+        mock_directory_mtime.return_value = 1000
+        mock_find_files.return_value = [FileEntry('bravo', 1, None), FileEntry('charlie', 2, None)]
         mock_get_files_info.return_value = ['charlie']
         response = client.get('/metadc123456/')
         mock_make_path.assert_called_once_with('metadc123456')
         mock_find_files.assert_called_once_with('alpha')
-        mock_get_files_info.assert_called_once_with('alpha', ['bravo', 'charlie'])
+        mock_get_files_info.assert_called_once_with(
+            'alpha', [FileEntry('bravo', 1, None), FileEntry('charlie', 2, None)])
         assert response.get_json() == ['charlie']
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info')
+    @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    @mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime')
+    def test_uses_cached_listing(self, mock_directory_mtime, mock_find_files,
+                                 mock_get_files_info, client):
+        mock_directory_mtime.return_value = 1000
+        mock_find_files.return_value = [FileEntry('bravo', 1, None)]
+        mock_get_files_info.return_value = {'1': {}}
+        first = client.get('/metadc123456/')
+        second = client.get('/metadc123456/')
+        assert first.get_json() == second.get_json() == {'1': {}}
+        mock_find_files.assert_called_once()
+        mock_get_files_info.assert_called_once()
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info')
+    @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    @mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime')
+    def test_rescans_when_mtime_changes(self, mock_directory_mtime, mock_find_files,
+                                        mock_get_files_info, client):
+        mock_directory_mtime.side_effect = [1000, 2000]
+        mock_find_files.return_value = [FileEntry('bravo', 1, None)]
+        mock_get_files_info.side_effect = [{'1': {}}, {'2': {}}]
+        client.get('/metadc123456/')
+        response = client.get('/metadc123456/')
+        assert response.get_json() == {'2': {}}
+        assert mock_find_files.call_count == 2
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info')
+    @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    @mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime')
+    def test_cache_disabled(self, mock_directory_mtime, mock_find_files, mock_get_files_info,
+                            app, client):
+        app.config['LISTING_CACHE'] = None
+        mock_directory_mtime.return_value = 1000
+        mock_find_files.return_value = []
+        mock_get_files_info.return_value = {'1': {}}
+        client.get('/metadc123456/')
+        client.get('/metadc123456/')
+        assert mock_find_files.call_count == 2
+        assert mock_get_files_info.call_count == 2
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info')
+    @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    @mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime')
+    def test_cached_listing_is_not_encoded_again(self, mock_directory_mtime, mock_find_files,
+                                                 mock_get_files_info, app, client):
+        mock_directory_mtime.return_value = 1000
+        mock_find_files.return_value = []
+        mock_get_files_info.return_value = {'1': {}}
+        with mock.patch.object(app.json, 'encode', wraps=app.json.encode) as mock_encode:
+            first = client.get('/metadc123456/')
+            second = client.get('/metadc123456/')
+        assert first.data == second.data == b'{"1":{}}\n'
+        mock_encode.assert_called_once()
+
+    def test_sorted_keys(self, app, client, add_file, pairtree_base):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        for name in ('metadc1_m2_1-captions-eng.vtt', 'metadc1_m10_1-captions-eng.vtt',
+                     'metadc1_m1_2-captions-eng.vtt', 'metadc1_m1_1-captions-eng.vtt'):
+            add_file('metadc1', name)
+        keys = []
+
+        def record_keys(pairs):
+            keys.append([key for key, _ in pairs])
+            return dict(pairs)
+
+        json.loads(client.get('/metadc1/').data, object_pairs_hook=record_keys)
+        assert keys[0] == ['MIMETYPE', 'SIZE', 'USE', 'flocat', 'language', 'vtt_kind']
+        assert keys[-1] == ['1', '10', '2']
+
+    def test_same_listing_from_index(self, app, client, add_file, pairtree_base, tmpdir):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        for name in ('metadc1_m1_2-captions-fre.vtt', 'metadc1_m1_2-captions-eng.vtt',
+                     'metadc1_m1_10-captions-eng.vtt', 'metadc1_m1_1-captions-eng.vtt'):
+            add_file('metadc1', name)
+        scanned = client.get('/metadc1/')
+        index_path = str(tmpdir.join('index.sqlite3'))
+        with app.app_context():
+            build_index(index_path)
+        app.config['LISTING_INDEX'] = ListingIndex(index_path)
+        indexed = client.get('/metadc1/')
+        assert indexed.data == scanned.data
+        assert indexed.headers['ETag'] == scanned.headers['ETag']
+
+
+@mock.patch('aubrey_transcription.aubrey_transcription.load_body')
+class TestBatchListFiles:
+    def test_query_parameters(self, mock_load_body, client):
+        mock_load_body.side_effect = lambda pairpath: '{{"path":"{}"}}\n'.format(pairpath).encode()
+        response = client.get('/batch?identifier=metadc1&identifier=metadc2')
+        assert response.status_code == 200
+        assert response.get_json() == {
+            'metadc1': {'path': '/me/ta/dc/1/metadc1'},
+            'metadc2': {'path': '/me/ta/dc/2/metadc2'},
+        }
+
+    @pytest.mark.parametrize('body', [
+        ['metadc1', 'metadc2'],
+        {'identifiers': ['metadc1', 'metadc2']},
+    ])
+    def test_post_json(self, mock_load_body, client, body):
+        mock_load_body.return_value = b'{}\n'
+        response = client.post('/batch', json=body)
+        assert response.get_json() == {'metadc1': {}, 'metadc2': {}}
+
+    def test_duplicates_looked_up_once(self, mock_load_body, client):
+        mock_load_body.return_value = b'{}\n'
+        response = client.get('/batch?identifier=metadc1&identifier=metadc1')
+        assert response.get_json() == {'metadc1': {}}
+        mock_load_body.assert_called_once_with('/me/ta/dc/1/metadc1')
+
+    def test_keeps_requested_order(self, mock_load_body, app, client):
+        app.json.sort_keys = False
+        mock_load_body.return_value = b'{}\n'
+        response = client.get('/batch?identifier=metadc2&identifier=metadc1')
+        assert response.data == b'{"metadc2":{},"metadc1":{}}\n'
+
+    def test_sorts_identifiers(self, mock_load_body, app, client):
+        app.json.sort_keys = True
+        mock_load_body.return_value = b'{}\n'
+        response = client.get('/batch?identifier=metadc2&identifier=metadc1')
+        assert response.data == b'{"metadc1":{},"metadc2":{}}\n'
+
+    def test_no_identifiers(self, mock_load_body, client):
+        response = client.get('/batch')
+        assert response.get_json() == {}
+        mock_load_body.assert_not_called()
+
+    @pytest.mark.parametrize('body', [
+        'metadc1',
+        {'identifier': 'metadc1'},
+        [1, 2],
+    ])
+    def test_bad_post_body(self, mock_load_body, client, body):
+        response = client.post('/batch', json=body)
+        assert response.status_code == 400
+        mock_load_body.assert_not_called()
+
+    def test_too_many_identifiers(self, mock_load_body, app, client):
+        app.config['BATCH_MAX_IDENTIFIERS'] = 1
+        response = client.post('/batch', json=['metadc1', 'metadc2'])
+        assert response.status_code == 400
+        mock_load_body.assert_not_called()
+
+
+class TestConditionalRequests:
+    @pytest.fixture()
+    def client(self, app, add_file, pairtree_base):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        return app.test_client()
+
+    def test_sends_validators(self, client):
+        response = client.get('/metadc1/')
+        assert response.status_code == 200
+        assert response.headers['ETag']
+        assert response.last_modified is not None
+        assert response.cache_control.max_age == 60
+        assert response.cache_control.public
+
+    def test_cache_control_can_be_left_out(self, app, client):
+        app.config['CACHE_CONTROL_MAX_AGE'] = None
+        response = client.get('/metadc1/')
+        assert 'Cache-Control' not in response.headers
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info')
+    def test_if_none_match(self, mock_get_files_info, app, client):
+        app.config['LISTING_CACHE'] = None
+        mock_get_files_info.return_value = {}
+        etag = client.get('/metadc1/').headers['ETag']
+        response = client.get('/metadc1/', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+        # The files info is only built for the first request.
+        mock_get_files_info.assert_called_once()
+
+    def test_if_none_match_from_cache(self, client):
+        etag = client.get('/metadc1/').headers['ETag']
+        response = client.get('/metadc1/', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+    def test_etag_changes_with_files(self, client, add_file):
+        etag = client.get('/metadc1/').headers['ETag']
+        add_file('metadc1', 'metadc1_m1_1-subtitles-spa.vtt')
+        response = client.get('/metadc1/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_if_modified_since(self, client):
+        last_modified = client.get('/metadc1/').headers['Last-Modified']
+        response = client.get('/metadc1/', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+
+    def test_if_modified_since_earlier(self, client):
+        response = client.get('/metadc1/',
+                              headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        assert response.status_code == 200
+
+    def test_missing_record(self, client):
+        response = client.get('/metadc2/')
+        assert response.get_json() == {}
+        assert response.headers['ETag']
+        assert 'Last-Modified' not in response.headers
+
+
+class TestCompressedListings:
+    @pytest.fixture()
+    def client(self, app, add_file, pairtree_base):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        app.config['COMPRESSION_MIN_SIZE'] = 100
+        for fileset in range(1, 5):
+            add_file('metadc1', 'metadc1_m1_{}-captions-eng.vtt'.format(fileset))
+        return app.test_client()
+
+    def test_gzip(self, client):
+        plain = client.get('/metadc1/')
+        response = client.get('/metadc1/', headers={'Accept-Encoding': 'gzip'})
+        assert response.content_encoding == 'gzip'
+        assert gzip.decompress(response.data) == plain.data
+        assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+        assert 'Accept-Encoding' in response.vary
+        assert 'Accept-Encoding' in plain.vary
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.compress')
+    def test_compressed_once(self, mock_compress, client):
+        mock_compress.return_value = b'compressed'
+        client.get('/metadc1/', headers={'Accept-Encoding': 'gzip'})
+        response = client.get('/metadc1/', headers={'Accept-Encoding': 'gzip'})
+        assert response.data == b'compressed'
+        mock_compress.assert_called_once()
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.get_files_info',
+                wraps=get_files_info)
+    @mock.patch('aubrey_transcription.aubrey_transcription.compress')
+    def test_index_listing_compressed_once(self, mock_compress, mock_get_files_info, app,
+                                           client, tmpdir):
+        mock_compress.return_value = b'compressed'
+        index_path = str(tmpdir.join('index.sqlite3'))
+        with app.app_context():
+            build_index(index_path)
+        app.config['LISTING_INDEX'] = ListingIndex(index_path)
+        for _ in range(3):
+            response = client.get('/metadc1/', headers={'Accept-Encoding': 'gzip'})
+            assert response.data == b'compressed'
+        mock_get_files_info.assert_called_once()
+        mock_compress.assert_called_once()
+
+    def test_cache_counts_compressed_bytes(self, app, client):
+        plain = client.get('/metadc1/')
+        compressed = client.get('/metadc1/', headers={'Accept-Encoding': 'deflate'})
+        total = len(plain.data) + len(compressed.data)
+        assert app.config['LISTING_CACHE'].total_bytes == total
+
+    def test_small_listing_not_compressed(self, app, client):
+        app.config['COMPRESSION_MIN_SIZE'] = 100000
+        response = client.get('/metadc1/', headers={'Accept-Encoding': 'gzip'})
+        assert response.content_encoding is None
+
+    @pytest.mark.parametrize('accept_encoding', ['gzip', 'identity'])
+    def test_if_none_match_compressed(self, client, accept_encoding):
+        etag = client.get('/metadc1/', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        response = client.get('/metadc1/', headers={'If-None-Match': etag,
+                                                    'Accept-Encoding': accept_encoding})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.load_body')
+    def test_batch(self, mock_load_body, client):
+        mock_load_body.return_value = b'{"1":{}}\n' * 20
+        response = client.get('/batch?identifier=metadc1', headers={'Accept-Encoding': 'gzip'})
+        assert response.content_encoding == 'gzip'
+        assert gzip.decompress(response.data).startswith(b'{"metadc1":{"1":{}}')
+
+
+class TestMissingRecords:
+    @pytest.fixture()
+    def client(self, app, add_file, pairtree_base):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        return app.test_client()
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    @mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime')
+    def test_negative_cache(self, mock_directory_mtime, mock_find_files, client):
+        mock_directory_mtime.return_value = None
+        first = client.get('/metadc2/')
+        second = client.get('/metadc2/')
+        assert first.get_json() == second.get_json() == {}
+        assert first.headers['ETag'] == second.headers['ETag']
+        mock_directory_mtime.assert_called_once()
+        mock_find_files.assert_not_called()
+
+    def test_negative_cache_disabled(self, app, client):
+        app.config['NEGATIVE_CACHE'] = None
+        with mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime',
+                        return_value=None) as mock_directory_mtime:
+            client.get('/metadc2/')
+            client.get('/metadc2/')
+        assert mock_directory_mtime.call_count == 2
+
+    def test_negative_cache_until_invalidated(self, app, client, add_file):
+        assert client.get('/metadc2/').get_json() == {}
+        add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+        assert client.get('/metadc2/').get_json() == {}
+        app.config['NEGATIVE_CACHE'].invalidate('/me/ta/dc/2/metadc2')
+        assert client.get('/metadc2/').get_json() != {}
+
+    @mock.patch('aubrey_transcription.aubrey_transcription.directory_mtime')
+    def test_bloom_filter_rules_out(self, mock_directory_mtime, app, client):
+        app.config['NEGATIVE_CACHE'] = None
+        app.config['BLOOM_FILTER'] = BloomFilter.for_capacity(10, 0.001)
+        response = client.get('/metadc2/')
+        assert response.status_code == 200
+        assert response.get_json() == {}
+        mock_directory_mtime.assert_not_called()
+
+    def test_bloom_filter_lets_through(self, app, client):
+        app.config['BLOOM_FILTER'] = BloomFilter.for_capacity(10, 0.001)
+        app.config['BLOOM_FILTER'].add('/me/ta/dc/1/metadc1')
+        assert client.get('/metadc1/').get_json()['1']
+
+
+class TestFilteredListings:
+    @pytest.fixture()
+    def client(self, app, add_file, pairtree_base):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        add_file('metadc1', 'metadc1_m1_1-captions-fre.vtt')
+        add_file('metadc1', 'metadc1_m2_1-subtitles-eng.vtt')
+        return app.test_client()
+
+    def test_filters(self, client):
+        result = client.get('/metadc1/?language=eng').get_json()
+        assert [f['flocat'].rsplit('/', 1)[-1] for f in result['1']['1'] + result['2']['1']] == [
+            'metadc1_m1_1-captions-eng.vtt', 'metadc1_m2_1-subtitles-eng.vtt']
+        assert client.get('/metadc1/?language=eng&manifestation=2').get_json().keys() == {'2'}
+        assert client.get('/metadc1/?kind=transcript').get_json() == {}
+
+    def test_omit_size(self, client):
+        result = client.get('/metadc1/?omit_size=true').get_json()
+        assert len(result['1']['1']) == 2
+        assert all('SIZE' not in f for f in result['1']['1'] + result['2']['1'])
+        assert 'SIZE' in client.get('/metadc1/?omit_size=false').get_json()['1']['1'][0]
+
+    def test_etags_differ(self, client):
+        etags = {client.get(url).headers['ETag']
+                 for url in ('/metadc1/', '/metadc1/?language=fre', '/metadc1/?omit_size=1')}
+        assert len(etags) == 3
+
+    def test_pushes_filter_into_scan(self, app, client):
+        with mock.patch('aubrey_transcription.aubrey_transcription.find_files',
+                        return_value=[]) as mock_find_files:
+            client.get('/metadc1/?language=fre&omit_size=1')
+        mock_find_files.assert_called_once_with(
+            '/me/ta/dc/1/metadc1', FileFilter({'language': 'fre'}, sizes=False))
+        assert len(app.config['LISTING_CACHE']) == 0
+
+    def test_filters_cached_listing(self, client):
+        client.get('/metadc1/')
+        with mock.patch('aubrey_transcription.aubrey_transcription.find_files') as \
+                mock_find_files:
+            result = client.get('/metadc1/?language=fre').get_json()
+        mock_find_files.assert_not_called()
+        assert result['1']['1'][0]['language'] == 'fre'
+        assert '2' not in result
+
+
+class TestSharedListingCache:
+    @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    def test_workers_share_listings(self, mock_find_files, add_file, pairtree_base, tmpdir):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        mock_find_files.return_value = []
+        config = {'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base),
+                  'LISTING_CACHE_BACKEND': 'shared',
+                  'LISTING_CACHE_PATH': str(tmpdir.join('listing-cache'))}
+        first = create_app(config).test_client().get('/metadc1/')
+        second = create_app(config).test_client().get('/metadc1/')
+        assert first.data == second.data
+        assert first.headers['ETag'] == second.headers['ETag']
+        mock_find_files.assert_called_once()
+
+
+class TestConcurrentRequests:
+    @mock.patch('aubrey_transcription.aubrey_transcription.find_files')
+    def test_share_one_scan(self, mock_find_files, app, add_file, pairtree_base):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        release = threading.Event()
+
+        def find_files(pairpath):
+            release.wait()
+            return []
+        mock_find_files.side_effect = find_files
+        responses = []
+        threads = [threading.Thread(
+            target=lambda: responses.append(app.test_client().get('/metadc1/')))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert [response.status_code for response in responses] == [200] * 5
+        mock_find_files.assert_called_once()
+
+    def test_storage_busy(self, app, add_file, pairtree_base):
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        app.config['FS_LIMITER'] = FilesystemLimiter(1, timeout=0.01)
+        with app.config['FS_LIMITER'].slot():
+            response = app.test_client().get('/metadc1/')
+        assert response.status_code == 503
+
+
+@mock.patch('aubrey_transcription.aubrey_transcription.make_path', new=lambda identifier:
+            '/pa/th/{}'.format(identifier))
+class TestSearch:
+    @pytest.fixture()
+    def index(self, app):
+        index = mock.Mock()
+        app.config['SEARCH_INDEX'] = index
+        return index
+
+    def test_search(self, index, client):
+        index.search.return_value = ['/pa/th/metadc1', '/pa/th/metadc2']
+        response = client.get('/search?language=spa&kind=subtitles&other=x')
+        assert response.get_json() == {'identifiers': ['metadc1', 'metadc2'], 'next': None}
+        index.search.assert_called_once_with({'language': 'spa', 'kind': 'subtitles'},
+                                             after=None, limit=101)
+
+    def test_next_page(self, index, client):
+        index.search.return_value = ['/pa/th/metadc1', '/pa/th/metadc2', '/pa/th/metadc3']
+        response = client.get('/search?language=spa&limit=2&after=metadc0')
+        assert response.get_json() == {'identifiers': ['metadc1', 'metadc2'],
+                                       'next': 'metadc2'}
+        index.search.assert_called_once_with({'language': 'spa'}, after='/pa/th/metadc0',
+                                             limit=3)
+
+    def test_needs_criteria(self, index, client):
+        response = client.get('/search?identifier=metadc1')
+        assert response.status_code == 400
+        index.search.assert_not_called()
+
+    @pytest.mark.parametrize('limit', ['0', '1001'])
+    def test_bad_limit(self, index, client, limit):
+        response = client.get('/search?kind=captions&limit={}'.format(limit))
+        assert response.status_code == 400
+
+    def test_no_index(self, app, client):
+        app.config['SEARCH_INDEX'] = None
+        assert client.get('/search?kind=captions').status_code == 503
+
+    def test_index_not_built(self, index, client):
+        index.search.return_value = None
+        assert client.get('/search?kind=captions').status_code == 503
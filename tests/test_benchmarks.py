@@ -0,0 +1,52 @@
+import json
+import os
+
+from benchmarks.bench import main, percentile, summarize
+from benchmarks.synthetic import generate_pairtree, make_vtt
+
+
+class TestGeneratePairtree:
+    def test_layout(self, app, pairtree_base):
+        written = generate_pairtree(str(pairtree_base), identifier_count=2, manifestations=2,
+                                    filesets=2, languages=2, kinds=1)
+        assert written == ['metadc1', 'metadc2']
+        record = pairtree_base.join('me', 'ta', 'dc', '1', 'metadc1')
+        names = sorted(os.listdir(str(record)))
+        assert len(names) == 9
+        assert 'metadc1_m2_2-captions-spa.vtt' in names
+        assert 'metadc1.xml' in names
+
+    def test_files_are_listed(self, app, pairtree_base):
+        generate_pairtree(str(pairtree_base), identifier_count=1, manifestations=1, filesets=2,
+                          languages=2, kinds=2)
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        files_info = app.test_client().get('/metadc1/').get_json()
+        assert sum(len(files) for files in files_info['1'].values()) == 8
+
+    def test_make_vtt(self):
+        assert make_vtt(2).count('-->') == 2
+
+
+class TestSummaries:
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile([], 50) == 0
+
+    def test_summarize(self):
+        summary = summarize([2000000, 1000000])
+        assert summary['calls'] == 2
+        assert summary['ops_per_second'] == 2 / 0.003
+        assert summary['latency_ms']['max'] == 2
+
+
+class TestMain:
+    def test_writes_report(self, tmpdir):
+        output = tmpdir.join('results.json')
+        main(['--identifiers', '3', '--iterations', '5', '--output', str(output)])
+        report = json.loads(output.read())
+        assert report['parameters']['identifiers'] == 3
+        assert set(report['results']) == {'make_path', 'decrypt_filename', 'find_files',
+                                          'get_files_info', 'request_uncached', 'request'}
+        assert report['results']['find_files']['calls'] == 5
@@ -0,0 +1,83 @@
+import pytest
+
+from aubrey_transcription.bloom import BloomFilter, build_bloom_filter, load_bloom_filter
+
+
+@pytest.fixture
+def filter_path(app, pairtree_base, tmpdir):
+    app.config['PAIRTREE_BASE'] = str(pairtree_base)
+    app.config['BLOOM_FILTER_PATH'] = str(tmpdir.join('records.bloom'))
+    return app.config['BLOOM_FILTER_PATH']
+
+
+class TestBloomFilter:
+    def test_added_keys_are_present(self):
+        bloom_filter = BloomFilter.for_capacity(1000, 0.01)
+        keys = ['/me/ta/dc/{0}/metadc{0}'.format(i) for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(key)
+        assert all(key in bloom_filter for key in keys)
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add('present{}'.format(i))
+        false_positives = sum('absent{}'.format(i) in bloom_filter for i in range(10000))
+        assert false_positives < 300
+
+    def test_empty(self):
+        bloom_filter = BloomFilter.for_capacity(0, 0.01)
+        assert '/me/ta/dc/1/metadc1' not in bloom_filter
+
+    @pytest.mark.parametrize('capacity, error_rate, size, hash_count', [
+        (1000, 0.01, 9586, 7),
+        (1000, 0.001, 14378, 10),
+    ])
+    def test_for_capacity(self, capacity, error_rate, size, hash_count):
+        bloom_filter = BloomFilter.for_capacity(capacity, error_rate)
+        assert (bloom_filter.size, bloom_filter.hash_count) == (size, hash_count)
+        assert len(bloom_filter.bits) == (size + 7) // 8
+
+    def test_save_and_load(self, tmpdir):
+        path = str(tmpdir.join('records.bloom'))
+        bloom_filter = BloomFilter.for_capacity(10, 0.01)
+        bloom_filter.add('/me/ta/dc/1/metadc1')
+        bloom_filter.save(path)
+        loaded = BloomFilter.load(path)
+        assert (loaded.size, loaded.hash_count) == (bloom_filter.size, bloom_filter.hash_count)
+        assert '/me/ta/dc/1/metadc1' in loaded
+        assert not tmpdir.join('records.bloom.tmp').exists()
+
+    @pytest.mark.parametrize('content', [b'', b'not a filter at all', b'AUBLOOM1' + b'\0' * 20])
+    def test_load_invalid(self, tmpdir, content):
+        path = tmpdir.join('records.bloom')
+        path.write_binary(content)
+        with pytest.raises(ValueError):
+            BloomFilter.load(str(path))
+
+
+class TestBuildBloomFilter:
+    def test_build(self, app, add_file, filter_path):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+        with app.app_context():
+            assert build_bloom_filter(filter_path, 0.01) == 2
+        bloom_filter = BloomFilter.load(filter_path)
+        assert '/me/ta/dc/1/metadc1' in bloom_filter
+        assert '/me/ta/dc/2/metadc2' in bloom_filter
+        assert '/me/ta/dc/3/metadc3' not in bloom_filter
+
+    def test_command(self, app, add_file, filter_path):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        result = app.test_cli_runner().invoke(args=['build-bloom-filter', '--error-rate', '0.1'])
+        assert 'Added 1 records' in result.output
+        assert '/me/ta/dc/1/metadc1' in BloomFilter.load(filter_path)
+
+    def test_command_needs_a_path(self, app):
+        result = app.test_cli_runner().invoke(args=['build-bloom-filter'])
+        assert result.exit_code != 0
+        assert 'Set BLOOM_FILTER_PATH' in result.output
+
+
+def test_load_bloom_filter_missing(tmpdir):
+    assert load_bloom_filter(str(tmpdir.join('missing.bloom'))) is None
@@ -0,0 +1,82 @@
+from aubrey_transcription.cache import ListingCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestListingCache:
+    def test_miss(self):
+        cache = ListingCache(max_entries=2)
+        assert cache.get('/pa/th', 1) is None
+
+    def test_hit(self):
+        cache = ListingCache(max_entries=2)
+        cache.set('/pa/th', 1, {'1': {}})
+        assert cache.get('/pa/th', 1) == {'1': {}}
+
+    def test_changed_fingerprint_is_a_miss(self):
+        cache = ListingCache(max_entries=2)
+        cache.set('/pa/th', 1, {'1': {}})
+        assert cache.get('/pa/th', 2) is None
+        # The stale entry is dropped entirely.
+        assert len(cache) == 0
+
+    def test_expires_after_ttl(self):
+        clock = FakeClock()
+        cache = ListingCache(max_entries=2, ttl=10, clock=clock)
+        cache.set('/pa/th', 1, {'1': {}})
+        clock.now = 9
+        assert cache.get('/pa/th', 1) == {'1': {}}
+        clock.now = 10
+        assert cache.get('/pa/th', 1) is None
+
+    def test_evicts_least_recently_used_entry(self):
+        cache = ListingCache(max_entries=2)
+        cache.set('a', 1, 'alpha')
+        cache.set('b', 1, 'bravo')
+        cache.get('a', 1)
+        cache.set('c', 1, 'charlie')
+        assert cache.get('a', 1) == 'alpha'
+        assert cache.get('b', 1) is None
+        assert cache.get('c', 1) == 'charlie'
+
+    def test_evicts_to_stay_under_byte_budget(self):
+        cache = ListingCache(max_entries=10, max_bytes=100)
+        cache.set('a', 1, 'alpha', size=60)
+        cache.set('b', 1, 'bravo', size=60)
+        assert cache.get('a', 1) is None
+        assert cache.get('b', 1) == 'bravo'
+        assert cache.total_bytes == 60
+
+    def test_does_not_store_oversized_values(self):
+        cache = ListingCache(max_entries=10, max_bytes=100)
+        cache.set('a', 1, 'alpha', size=60)
+        cache.set('b', 1, 'bravo', size=101)
+        assert cache.get('a', 1) == 'alpha'
+        assert cache.get('b', 1) is None
+
+    def test_replacing_entry_updates_size(self):
+        cache = ListingCache(max_entries=10, max_bytes=100)
+        cache.set('a', 1, 'alpha', size=60)
+        cache.set('a', 2, 'alpha', size=30)
+        assert cache.total_bytes == 30
+
+    def test_invalidate(self):
+        cache = ListingCache(max_entries=2)
+        cache.set('a', 1, 'alpha', size=5)
+        cache.invalidate('a')
+        cache.invalidate('missing')
+        assert cache.get('a', 1) is None
+        assert cache.total_bytes == 0
+
+    def test_clear(self):
+        cache = ListingCache(max_entries=2)
+        cache.set('a', 1, 'alpha', size=5)
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.total_bytes == 0
@@ -0,0 +1,77 @@
+import gzip
+import zlib
+
+import pytest
+
+from aubrey_transcription.compression import (compress, compressed_response, encoded_etag,
+                                              negotiate_encoding)
+
+
+class TestCompress:
+    def test_gzip(self):
+        data = compress(b'{"a":1}\n', 'gzip', 6)
+        assert gzip.decompress(data) == b'{"a":1}\n'
+
+    def test_gzip_is_repeatable(self):
+        assert compress(b'{}', 'gzip', 6) == compress(b'{}', 'gzip', 6)
+
+    def test_deflate(self):
+        data = compress(b'{"a":1}\n', 'deflate', 1)
+        assert zlib.decompress(data) == b'{"a":1}\n'
+
+
+@pytest.mark.parametrize('encoding, expected', [
+    (None, 'abc'),
+    ('gzip', 'abc-gzip'),
+])
+def test_encoded_etag(encoding, expected):
+    assert encoded_etag('abc', encoding) == expected
+
+
+class TestNegotiateEncoding:
+    @pytest.mark.parametrize('accept_encoding, expected', [
+        ('gzip, deflate', 'gzip'),
+        ('deflate, gzip', 'gzip'),
+        ('deflate', 'deflate'),
+        ('gzip;q=0.5, deflate', 'deflate'),
+        ('gzip;q=0, deflate;q=0', None),
+        ('br', None),
+        ('*', 'gzip'),
+        ('', None),
+    ])
+    def test_accept_encoding(self, app, accept_encoding, expected):
+        with app.test_request_context(headers={'Accept-Encoding': accept_encoding}):
+            assert negotiate_encoding(2048) == expected
+
+    def test_below_min_size(self, app):
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            assert negotiate_encoding(1023) is None
+            assert negotiate_encoding(1024) == 'gzip'
+
+    def test_disabled(self, app):
+        app.config['COMPRESSION_MIN_SIZE'] = None
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            assert negotiate_encoding(2048) is None
+
+
+class TestCompressedResponse:
+    def test_compresses(self, app):
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            response = compressed_response(b'x' * 2048, 'application/json')
+        assert response.content_encoding == 'gzip'
+        assert gzip.decompress(response.get_data()) == b'x' * 2048
+        assert 'Accept-Encoding' in response.vary
+
+    def test_small_response(self, app):
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            response = compressed_response(b'{}\n', 'application/json')
+        assert response.content_encoding is None
+        assert response.get_data() == b'{}\n'
+        assert 'Accept-Encoding' in response.vary
+
+    def test_disabled(self, app):
+        app.config['COMPRESSION_MIN_SIZE'] = None
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            response = compressed_response(b'x' * 2048, 'application/json')
+        assert response.content_encoding is None
+        assert 'Vary' not in response.headers
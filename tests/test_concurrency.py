@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+
+from aubrey_transcription.concurrency import (FilesystemLimiter, RootExecutors, SingleFlight,
+                                              filesystem_access)
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+class TestSingleFlight:
+    def test_returns_result(self):
+        flights = SingleFlight()
+        assert flights.do('key', lambda a, b: a + b, 1, 2) == 3
+        assert len(flights) == 0
+
+    def test_coalesces_concurrent_calls(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def work():
+            calls.append(1)
+            release.wait()
+            return 'result'
+
+        threads = run_threads(5, lambda: results.append(flights.do('key', work)))
+        while len(flights) == 0:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert results == ['result'] * 5
+
+    def test_different_keys_run_separately(self):
+        flights = SingleFlight()
+        assert flights.do('a', lambda: 1) == 1
+        assert flights.do('b', lambda: 2) == 2
+
+    def test_shares_exceptions(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def work():
+            release.wait()
+            raise OSError('gone')
+
+        def call():
+            try:
+                flights.do('key', work)
+            except OSError as e:
+                errors.append(e)
+
+        threads = run_threads(3, call)
+        while len(flights) == 0:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(errors) == 3
+        assert len(flights) == 0
+
+
+class TestFilesystemLimiter:
+    def test_limits_concurrent_operations(self):
+        limiter = FilesystemLimiter(2)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def operation():
+            with limiter.slot():
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        for thread in run_threads(6, operation):
+            thread.join()
+        assert peak[0] == 2
+
+    def test_timeout(self):
+        limiter = FilesystemLimiter(1, timeout=0.01)
+        with limiter.slot():
+            with pytest.raises(ServiceUnavailable):
+                with limiter.slot():
+                    pass
+        # The slot is free again afterwards.
+        with limiter.slot():
+            pass
+
+
+class TestRootExecutors:
+    def test_refuses_calls_when_full(self):
+        executors = RootExecutors(2)
+        release = threading.Event()
+        hung = [executors.submit('/bad', release.wait) for _ in range(2)]
+        assert executors.submit('/bad', release.wait) is None
+        # Other roots have threads of their own.
+        assert executors.submit('/good', lambda: 'found').result(timeout=1) == 'found'
+        release.set()
+        for future in hung:
+            future.result(timeout=1)
+        assert executors.submit('/bad', lambda: 'found').result(timeout=1) == 'found'
+
+
+class TestFilesystemAccess:
+    def test_unlimited(self, app):
+        app.config['FS_LIMITER'] = None
+        with app.app_context():
+            with filesystem_access():
+                pass
+
+    def test_limited(self, app):
+        app.config['FS_LIMITER'] = FilesystemLimiter(1, timeout=0.01)
+        with app.app_context():
+            with filesystem_access():
+                with pytest.raises(ServiceUnavailable):
+                    with filesystem_access():
+                        pass
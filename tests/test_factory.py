@@ -3,6 +3,9 @@ from unittest import mock
 import pytest
 
 from aubrey_transcription import create_app, default_settings
+from aubrey_transcription.bloom import BloomFilter
+from aubrey_transcription.cache import ListingCache
+from aubrey_transcription.shared_cache import SharedListingCache
 
 
 @mock.patch('aubrey_transcription.os.makedirs')  # We don't want 'instance' dirs everywhere.
@@ -52,3 +55,68 @@ class TestCreateApp:
         assert app.config['TRANSCRIPTION_URL'] == 'something.com'
         assert app.config['EXTENSIONS_META'] == {}
         assert app.config['FILENAME_PATTERN'] == 'a pattern'
+
+    def test_creates_listing_cache(self, mock_makedirs):
+        app = create_app(test_config={'LISTING_CACHE_MAX_ENTRIES': 10,
+                                      'LISTING_CACHE_MAX_BYTES': 1000,
+                                      'LISTING_CACHE_TTL': 60})
+        cache = app.config['LISTING_CACHE']
+        assert isinstance(cache, ListingCache)
+        assert (cache.max_entries, cache.max_bytes, cache.ttl) == (10, 1000, 60)
+
+    def test_creates_shared_listing_cache(self, mock_makedirs, tmpdir):
+        path = str(tmpdir.join('listing-cache'))
+        app = create_app(test_config={'LISTING_CACHE_BACKEND': 'shared',
+                                      'LISTING_CACHE_PATH': path,
+                                      'LISTING_CACHE_MAX_ENTRIES': 10,
+                                      'LISTING_CACHE_SLOT_SIZE': 1024})
+        cache = app.config['LISTING_CACHE']
+        assert isinstance(cache, SharedListingCache)
+        assert (cache.path, cache.slots, cache.slot_size) == (path, 10, 1024)
+
+    def test_unknown_listing_cache_backend(self, mock_makedirs):
+        with pytest.raises(ValueError):
+            create_app(test_config={'LISTING_CACHE_BACKEND': 'redis'})
+
+    def test_listing_cache_can_be_disabled(self, mock_makedirs):
+        app = create_app(test_config={'LISTING_CACHE_MAX_ENTRIES': 0})
+        assert app.config['LISTING_CACHE'] is None
+
+    def test_negative_cache_can_be_disabled(self, mock_makedirs):
+        app = create_app(test_config={'NEGATIVE_CACHE_MAX_ENTRIES': 0})
+        assert app.config['NEGATIVE_CACHE'] is None
+
+    def test_loads_bloom_filter(self, mock_makedirs, tmpdir):
+        path = str(tmpdir.join('records.bloom'))
+        BloomFilter.for_capacity(10, 0.01).save(path)
+        app = create_app(test_config={'BLOOM_FILTER_PATH': path})
+        assert isinstance(app.config['BLOOM_FILTER'], BloomFilter)
+
+    def test_missing_bloom_filter(self, mock_makedirs, tmpdir):
+        app = create_app(test_config={'BLOOM_FILTER_PATH': str(tmpdir.join('missing'))})
+        assert app.config['BLOOM_FILTER'] is None
+
+    def test_creates_search_index(self, mock_makedirs):
+        app = create_app(test_config={'INDEX_PATH': '/path/to/index.sqlite3'})
+        assert app.config['SEARCH_INDEX'].index_path == '/path/to/index.sqlite3'
+        assert app.config['LISTING_INDEX'] is None
+
+    def test_search_index_is_listing_index(self, mock_makedirs):
+        app = create_app(test_config={'INDEX_PATH': '/path/to/index.sqlite3',
+                                      'SERVE_FROM_INDEX': True})
+        assert app.config['SEARCH_INDEX'] is app.config['LISTING_INDEX']
+
+    def test_creates_filesystem_limiter(self, mock_makedirs):
+        app = create_app(test_config={'FS_MAX_OPERATIONS': 4, 'FS_WAIT_TIMEOUT': 5})
+        limiter = app.config['FS_LIMITER']
+        assert (limiter.max_operations, limiter.timeout) == (4, 5)
+
+    def test_creates_batch_executor(self, mock_makedirs):
+        app = create_app(test_config={'BATCH_MAX_WORKERS': 3})
+        assert app.config['BATCH_EXECUTOR']._max_workers == 3
+
+    @mock.patch('aubrey_transcription.create_watcher')
+    def test_starts_watcher(self, mock_create_watcher, mock_makedirs):
+        app = create_app(test_config={'WATCH_PAIRTREE': True})
+        assert app.config['PAIRTREE_WATCHER'] is mock_create_watcher.return_value
+        mock_create_watcher.return_value.start.assert_called_once_with()
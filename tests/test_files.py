@@ -0,0 +1,100 @@
+import pytest
+
+from aubrey_transcription import create_app
+
+
+VTT = 'WEBVTT\n\n00:00.000 --> 00:01.000\nHello\n'
+URL = '/files/me/ta/dc/1/metadc1/metadc1_m1_1-captions-eng.vtt'
+
+
+@pytest.fixture
+def app(add_file, pairtree_base):
+    app = create_app({'TESTING': True, 'SERVE_FILES': True,
+                      'TRANSCRIPTION_URL': 'http://localhost/files'})
+    app.config['PAIRTREE_BASE'] = str(pairtree_base)
+    add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt', VTT)
+    add_file('metadc1', 'notes.vtt')
+    add_file('metadc1', 'metadc1_m1_1-captions-eng.txt')
+    return app
+
+
+class TestFileView:
+    def test_sends_file(self, client):
+        response = client.get(URL)
+        assert response.status_code == 200
+        assert response.data == VTT.encode()
+        assert response.mimetype == 'text/vtt'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        assert response.cache_control.public
+        assert response.cache_control.max_age == 86400
+        assert response.headers['ETag']
+
+    def test_flocat(self, client):
+        flocat = client.get('/metadc1/').get_json()['1']['1'][0]['flocat']
+        assert client.get(flocat).data == VTT.encode()
+
+    def test_range(self, client):
+        response = client.get(URL, headers={'Range': 'bytes=0-5'})
+        assert response.status_code == 206
+        assert response.data == b'WEBVTT'
+        assert response.headers['Content-Range'] == 'bytes 0-5/{}'.format(len(VTT))
+
+    def test_not_modified(self, client):
+        etag = client.get(URL).headers['ETag']
+        assert client.get(URL, headers={'If-None-Match': etag}).status_code == 304
+
+    @pytest.mark.parametrize('url', [
+        '/files/me/ta/dc/1/metadc1/notes.vtt',
+        '/files/me/ta/dc/1/metadc1/metadc1_m1_1-captions-eng.txt',
+        '/files/me/ta/dc/1/metadc1/metadc1_m1_2-captions-eng.vtt',
+        '/files/me/ta/dc/2/metadc2/metadc2_m1_1-captions-eng.vtt',
+        # Only the canonical pairpath of the identifier is served.
+        '/files/me/ta/dc1/metadc1/metadc1_m1_1-captions-eng.vtt',
+        '/files/me/ta/dc/1/metadc1/../metadc1/metadc1_m1_1-captions-eng.vtt',
+        '/files/metadc1/metadc1_m1_1-captions-eng.vtt',
+    ])
+    def test_not_found(self, client, url):
+        assert client.get(url).status_code == 404
+
+    def test_x_sendfile(self, add_file, pairtree_base):
+        app = create_app({'TESTING': True, 'SERVE_FILES': True,
+                          'FILES_SEND_METHOD': 'x-sendfile',
+                          'PAIRTREE_BASE': str(pairtree_base)})
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt', VTT)
+        response = app.test_client().get(URL)
+        assert response.headers['X-Sendfile'] == str(
+            pairtree_base.join('me/ta/dc/1/metadc1/metadc1_m1_1-captions-eng.vtt'))
+        assert response.data == b''
+
+    def test_x_accel_redirect(self, app, client, pairtree_base):
+        app.config['FILES_SEND_METHOD'] = 'x-accel-redirect'
+        app.config['FILES_ACCEL_LOCATIONS'] = {str(pairtree_base): '/internal/pairtree/'}
+        response = client.get(URL)
+        assert response.headers['X-Accel-Redirect'] == (
+            '/internal/pairtree/me/ta/dc/1/metadc1/metadc1_m1_1-captions-eng.vtt')
+        assert response.mimetype == 'text/vtt'
+        assert response.data == b''
+
+    def test_first_root_wins(self, app, client, add_file, pairtree_base, tmpdir):
+        first = tmpdir.mkdir('first')
+        first.join('me/ta/dc/1/metadc1').ensure(dir=True).join(
+            'metadc1_m1_1-captions-eng.vtt').write('WEBVTT\n')
+        add_file('metadc1', 'metadc1_m1_2-captions-eng.vtt', VTT)
+        app.config['PAIRTREE_BASE'] = [str(first), str(pairtree_base)]
+        assert client.get(URL).data == b'WEBVTT\n'
+        assert client.get(URL.replace('_m1_1', '_m1_2')).data == VTT.encode()
+
+    def test_disabled(self, pairtree_base):
+        app = create_app({'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base)})
+        assert app.test_client().get(URL).status_code == 404
+
+    def test_x_accel_redirect_locations_checked(self):
+        with pytest.raises(ValueError, match='/two'):
+            create_app({'TESTING': True, 'SERVE_FILES': True,
+                        'FILES_SEND_METHOD': 'x-accel-redirect',
+                        'PAIRTREE_BASE': ['/one', '/two'],
+                        'FILES_ACCEL_LOCATIONS': {'/one': '/internal/one'}})
+
+    def test_unknown_send_method(self):
+        with pytest.raises(ValueError):
+            create_app({'TESTING': True, 'SERVE_FILES': True, 'FILES_SEND_METHOD': 'copy'})
@@ -0,0 +1,169 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+
+from aubrey_transcription import create_app
+from aubrey_transcription import harvest as harvest_module
+from aubrey_transcription.harvest import harvest_lines, parse_modified_since
+from aubrey_transcription.utils import make_path, directory_mtime
+
+
+@pytest.fixture
+def app(add_file, pairtree_base):
+    app = create_app({'TESTING': True, 'HARVEST_ENABLED': True})
+    app.config['PAIRTREE_BASE'] = str(pairtree_base)
+    add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+    add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+    add_file('metadc10', 'metadc10_m1_1-captions-eng.vtt')
+    return app
+
+
+def set_mtime(pairtree_base, identifier, seconds):
+    os.utime(str(pairtree_base.join(make_path(identifier))), (seconds, seconds))
+
+
+def identifiers(lines):
+    return [json.loads(line)['identifier'] for line in lines]
+
+
+class TestParseModifiedSince:
+    @pytest.mark.parametrize('value', [
+        '2017-07-14T02:40:00+00:00',
+        '2017-07-14T02:40:00Z',
+        '2017-07-14T02:40:00',
+        '2017-07-13T21:40:00-05:00',
+    ])
+    def test_times(self, value):
+        assert parse_modified_since(value) == 1500000000 * 10 ** 9
+
+    def test_date(self):
+        assert parse_modified_since('1970-01-02') == 86400 * 10 ** 9
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            parse_modified_since('yesterday')
+
+
+class TestHarvestLines:
+    def test_every_record(self, app):
+        with app.test_request_context():
+            lines = list(harvest_lines())
+        assert identifiers(lines) == ['metadc1', 'metadc10', 'metadc2']
+        record = json.loads(lines[0])
+        assert record['files']['1']['1'][0]['flocat'].endswith('metadc1_m1_1-captions-eng.vtt')
+
+    def test_matches_listing(self, app):
+        client = app.test_client()
+        line = client.get('/harvest').data.split(b'\n')[0]
+        assert json.loads(line)['files'] == client.get('/metadc1/').get_json()
+
+    def test_after(self, app):
+        with app.test_request_context():
+            assert identifiers(harvest_lines(after='metadc1')) == ['metadc10', 'metadc2']
+            assert identifiers(harvest_lines(after='metadc2')) == []
+
+    def test_multiple_roots(self, app, pairtree_base, tmpdir):
+        other = tmpdir.mkdir('other')
+        for identifier in ('metadc1', 'metadc3'):
+            other.join(make_path(identifier)).ensure(dir=True).join(
+                '{}_m1_2-captions-eng.vtt'.format(identifier)).write('WEBVTT\n')
+        app.config['PAIRTREE_BASE'] = [str(pairtree_base), str(other)]
+        with app.test_request_context():
+            lines = list(harvest_lines())
+        assert identifiers(lines) == ['metadc1', 'metadc10', 'metadc2', 'metadc3']
+        assert sorted(json.loads(lines[0])['files']['1']) == ['1', '2']
+
+    def test_after_missing_identifier(self, app):
+        with app.test_request_context():
+            assert identifiers(harvest_lines(after='metadc11')) == ['metadc2']
+
+    def test_modified_since(self, app, pairtree_base):
+        set_mtime(pairtree_base, 'metadc1', 1000)
+        set_mtime(pairtree_base, 'metadc10', 3000)
+        set_mtime(pairtree_base, 'metadc2', 2000)
+        with app.test_request_context():
+            lines = harvest_lines(modified_since=2000 * 10 ** 9)
+            assert identifiers(lines) == ['metadc10', 'metadc2']
+
+    def test_does_not_fill_cache(self, app):
+        with app.test_request_context():
+            list(harvest_lines())
+        assert len(app.config['LISTING_CACHE']) == 0
+
+    def test_uses_cached_body(self, app):
+        client = app.test_client()
+        client.get('/metadc1/')
+        with app.app_context():
+            listing = app.config['LISTING_CACHE'].get('/me/ta/dc/1/metadc1',
+                                                      directory_mtime('/me/ta/dc/1/metadc1'))
+        listing.body = b'{"cached":true}\n'
+        line = client.get('/harvest').data.split(b'\n')[0]
+        assert json.loads(line)['files'] == {'cached': True}
+
+    def test_record_that_times_out(self, app):
+        load_listing = harvest_module.load_listing
+
+        def slow_metadc10(pairpath):
+            if pairpath == make_path('metadc10'):
+                raise ServiceUnavailable('The transcriptions storage did not respond in time.')
+            return load_listing(pairpath)
+
+        with app.test_request_context(), mock.patch.object(
+                harvest_module, 'load_listing', side_effect=slow_metadc10):
+            lines = [json.loads(line) for line in harvest_lines()]
+        assert [line['identifier'] for line in lines] == ['metadc1', 'metadc10', 'metadc2']
+        assert 'files' not in lines[1]
+        assert 'did not respond' in lines[1]['error']
+        assert 'files' in lines[2]
+
+    def test_one_line_per_record_in_debug(self, app):
+        app.debug = True
+        with app.test_request_context():
+            lines = list(harvest_lines())
+        assert all(line.count(b'\n') == 1 for line in lines)
+
+
+class TestHarvestView:
+    def test_streams_ndjson(self, app):
+        response = app.test_client().get('/harvest')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert response.is_streamed
+        assert identifiers(response.data.splitlines()) == ['metadc1', 'metadc10', 'metadc2']
+
+    def test_query_parameters(self, app, pairtree_base):
+        set_mtime(pairtree_base, 'metadc10', 1000)
+        response = app.test_client().get(
+            '/harvest?after=metadc1&modified_since=2000-01-01T00:00:00Z')
+        assert identifiers(response.data.splitlines()) == ['metadc2']
+
+    def test_bad_modified_since(self, app):
+        response = app.test_client().get('/harvest?modified_since=yesterday')
+        assert response.status_code == 400
+        assert 'error' in response.get_json()
+
+    def test_disabled_by_default(self, pairtree_base):
+        app = create_app({'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base)})
+        assert 'harvest' not in app.view_functions
+        assert app.test_client().get('/harvest').mimetype != 'application/x-ndjson'
+        assert app.test_cli_runner().invoke(args=['harvest']).exit_code == 0
+
+
+class TestHarvestCommand:
+    def test_writes_ndjson(self, app):
+        result = app.test_cli_runner().invoke(args=['harvest', '--after', 'metadc10'])
+        assert result.exit_code == 0
+        assert identifiers(result.output.splitlines()) == ['metadc2']
+
+    def test_output_file(self, app, tmpdir):
+        output = tmpdir.join('harvest.ndjson')
+        app.test_cli_runner().invoke(args=['harvest', '--output', str(output)])
+        assert identifiers(output.read().splitlines()) == ['metadc1', 'metadc10', 'metadc2']
+
+    def test_bad_modified_since(self, app):
+        result = app.test_cli_runner().invoke(args=['harvest', '--modified-since', 'yesterday'])
+        assert result.exit_code != 0
+        assert 'ISO 8601' in result.output
@@ -0,0 +1,185 @@
+import sqlite3
+from unittest import mock
+
+import pytest
+
+from aubrey_transcription import create_app
+from aubrey_transcription.index import ListingIndex, build_index
+from aubrey_transcription.utils import FileEntry, ParsedFilename
+
+
+@pytest.fixture()
+def index_path(tmpdir):
+    return str(tmpdir.join('index.sqlite3'))
+
+
+@pytest.fixture()
+def app(pairtree_base, index_path):
+    app = create_app(test_config={
+        'TESTING': True,
+        'PAIRTREE_BASE': str(pairtree_base),
+        'INDEX_PATH': index_path,
+        'SERVE_FROM_INDEX': True,
+    })
+    return app
+
+
+class TestBuildIndex:
+    def test_indexes_records(self, app, add_file, index_path):
+        files = [add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt', 'WEBVTT'),
+                 add_file('metadc1', 'metadc1_m1_2-subtitles-spa.vtt', 'WEBVTT\n'),
+                 add_file('metadc2', 'metadc2_m2_1-chapters-eng.vtt')]
+        add_file('metadc1', 'notes.txt')
+        mtimes = [path.stat().mtime_ns for path in files]
+        with app.app_context():
+            result = build_index(index_path)
+        assert result == (2, 3)
+        connection = sqlite3.connect(index_path)
+        assert connection.execute('SELECT * FROM files ORDER BY name').fetchall() == [
+            ('/me/ta/dc/1/metadc1', 'metadc1_m1_1-captions-eng.vtt', 6, mtimes[0], 'metadc1',
+             '1', '1', 'captions', 'eng', 'vtt'),
+            ('/me/ta/dc/1/metadc1', 'metadc1_m1_2-subtitles-spa.vtt', 7, mtimes[1], 'metadc1',
+             '1', '2', 'subtitles', 'spa', 'vtt'),
+            ('/me/ta/dc/2/metadc2', 'metadc2_m2_1-chapters-eng.vtt', 7, mtimes[2], 'metadc2',
+             '2', '1', 'chapters', 'eng', 'vtt'),
+        ]
+        assert connection.execute('SELECT pairpath, identifier FROM records').fetchall() == [
+            ('/me/ta/dc/1/metadc1', 'metadc1'),
+            ('/me/ta/dc/2/metadc2', 'metadc2'),
+        ]
+
+    def test_desanitizes_identifiers(self, app, add_file, index_path):
+        add_file('ark:/67531/metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        with app.app_context():
+            build_index(index_path)
+        connection = sqlite3.connect(index_path)
+        assert connection.execute('SELECT identifier FROM records').fetchall() == [
+            ('ark:/67531/metadc1',)]
+
+    def test_replaces_existing_index(self, app, add_file, index_path):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        with app.app_context():
+            build_index(index_path)
+            add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+            assert build_index(index_path) == (2, 2)
+
+    def test_command(self, app, add_file, index_path):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        result = app.test_cli_runner().invoke(args=['build-index'])
+        assert 'Indexed 1 files in 1 records' in result.output
+        assert ListingIndex(index_path).lookup('/me/ta/dc/1/metadc1')
+
+    def test_command_needs_a_path(self, app):
+        app.config['INDEX_PATH'] = None
+        result = app.test_cli_runner().invoke(args=['build-index'])
+        assert result.exit_code != 0
+        assert 'Set INDEX_PATH' in result.output
+
+
+class TestListingIndex:
+    def test_lookup(self, app, add_file, pairtree_base, index_path):
+        tenth = add_file('metadc1', 'metadc1_m1_10-captions-eng.vtt', 'WEBVTT')
+        ninth = add_file('metadc1', 'metadc1_m1_9-captions-eng.vtt', 'WEBVTT')
+        with app.app_context():
+            build_index(index_path)
+        index = ListingIndex(index_path)
+        mtime, files = index.lookup('/me/ta/dc/1/metadc1')
+        assert mtime == pairtree_base.join('/me/ta/dc/1/metadc1').stat().mtime_ns
+        assert files == [
+            FileEntry('metadc1_m1_9-captions-eng.vtt', 6,
+                      ParsedFilename('metadc1', '1', '9', 'captions', 'eng', 'vtt'),
+                      ninth.stat().mtime_ns),
+            FileEntry('metadc1_m1_10-captions-eng.vtt', 6,
+                      ParsedFilename('metadc1', '1', '10', 'captions', 'eng', 'vtt'),
+                      tenth.stat().mtime_ns),
+        ]
+
+    def test_record_without_files(self, app, pairtree_base, index_path):
+        pairtree_base.join('/me/ta/dc/1/metadc1').ensure(dir=True)
+        with app.app_context():
+            build_index(index_path)
+        assert ListingIndex(index_path).lookup('/me/ta/dc/1/metadc1')[1] == []
+
+    def test_miss(self, app, index_path):
+        with app.app_context():
+            build_index(index_path)
+        assert ListingIndex(index_path).lookup('/me/ta/dc/1/metadc1') is None
+
+    def test_no_index_file(self, index_path):
+        assert ListingIndex(index_path).lookup('/me/ta/dc/1/metadc1') is None
+
+    def test_reopens_rebuilt_index(self, app, add_file, index_path):
+        index = ListingIndex(index_path)
+        with app.app_context():
+            build_index(index_path)
+            assert index.lookup('/me/ta/dc/1/metadc1') is None
+            add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+            build_index(index_path)
+        assert index.lookup('/me/ta/dc/1/metadc1') is not None
+
+
+class TestServeFromIndex:
+    def test_serves_indexed_record(self, app, add_file, index_path):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt', 'WEBVTT')
+        with app.app_context():
+            build_index(index_path)
+        with mock.patch('aubrey_transcription.aubrey_transcription.find_files') as mock_find:
+            response = app.test_client().get('/metadc1/')
+        mock_find.assert_not_called()
+        assert response.get_json()['1']['1'][0]['SIZE'] == '6'
+
+    def test_falls_back_to_pairtree(self, app, add_file, index_path):
+        with app.app_context():
+            build_index(index_path)
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt', 'WEBVTT')
+        response = app.test_client().get('/metadc1/')
+        assert response.get_json()['1']['1'][0]['SIZE'] == '6'
+
+
+class TestSearch:
+    @pytest.fixture()
+    def index(self, app, add_file, index_path):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        add_file('metadc1', 'metadc1_m1_2-subtitles-spa.vtt')
+        add_file('metadc2', 'metadc2_m1_1-subtitles-eng.vtt')
+        add_file('metadc2', 'metadc2_m1_1-captions-spa.vtt')
+        add_file('metadc3', 'metadc3_m2_1-subtitles-spa.vtt')
+        with app.app_context():
+            build_index(index_path)
+        return ListingIndex(index_path)
+
+    @pytest.mark.parametrize('criteria, expected', [
+        ({'language': 'spa'}, ['/me/ta/dc/1/metadc1', '/me/ta/dc/2/metadc2',
+                               '/me/ta/dc/3/metadc3']),
+        ({'language': 'spa', 'kind': 'subtitles'},
+         ['/me/ta/dc/1/metadc1', '/me/ta/dc/3/metadc3']),
+        ({'manifestation': '2'}, ['/me/ta/dc/3/metadc3']),
+        ({'extension': 'vtt', 'kind': 'chapters'}, []),
+    ])
+    def test_search(self, index, criteria, expected):
+        assert index.search(criteria) == expected
+
+    def test_pages(self, index):
+        assert index.search({'language': 'spa'}, limit=2) == [
+            '/me/ta/dc/1/metadc1', '/me/ta/dc/2/metadc2']
+        assert index.search({'language': 'spa'}, after='/me/ta/dc/2/metadc2') == [
+            '/me/ta/dc/3/metadc3']
+
+    def test_unknown_field(self, index):
+        with pytest.raises(ValueError):
+            index.search({'name': 'x'})
+
+    def test_uses_search_indexes(self, index, index_path):
+        plan = sqlite3.connect(index_path).execute(
+            'EXPLAIN QUERY PLAN SELECT DISTINCT pairpath FROM files WHERE language = ? '
+            'ORDER BY pairpath', ('spa',)).fetchall()
+        assert 'files_language' in str(plan)
+
+    def test_no_index(self, index_path):
+        assert ListingIndex(index_path).search({'language': 'spa'}) is None
+
+    def test_sees_refreshed_records(self, app, index, add_file):
+        add_file('metadc4', 'metadc4_m1_1-chapters-eng.vtt')
+        with app.app_context():
+            index.refresh('/me/ta/dc/4/metadc4')
+        assert index.search({'kind': 'chapters'}) == ['/me/ta/dc/4/metadc4']
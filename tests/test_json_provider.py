@@ -0,0 +1,88 @@
+from unittest import mock
+
+import pytest
+from flask import Flask
+
+from aubrey_transcription import json_provider
+from aubrey_transcription.json_provider import JSONProvider, OrjsonProvider, make_json_provider
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update({'JSON_PROVIDER': 'auto', 'JSON_SORT_KEYS': False}, **config)
+    return app
+
+
+@pytest.fixture
+def app():
+    return make_app()
+
+
+PROVIDERS = [JSONProvider]
+if json_provider.orjson is not None:
+    PROVIDERS.append(OrjsonProvider)
+
+
+@pytest.mark.parametrize('provider_class', PROVIDERS)
+class TestProviders:
+    def test_encode_keeps_key_order(self, provider_class, app):
+        provider = provider_class(app)
+        provider.sort_keys = False
+        assert provider.encode({'b': 1, 'a': [1, 'two']}) == b'{"b":1,"a":[1,"two"]}\n'
+
+    def test_encode_sorts_keys(self, provider_class, app):
+        provider = provider_class(app)
+        provider.sort_keys = True
+        assert provider.encode({'b': 1, 'a': 2}) == b'{"a":2,"b":1}\n'
+
+    def test_encode_pretty(self, provider_class, app):
+        provider = provider_class(app)
+        provider.compact = False
+        assert provider.encode({'a': 1}) == b'{\n  "a": 1\n}\n'
+
+    def test_encode_compact_when_asked(self, provider_class, app):
+        provider = provider_class(app)
+        provider.compact = False
+        assert provider.encode({'a': 1}, pretty=False) == b'{"a":1}\n'
+
+    def test_response_matches_encode(self, provider_class, app):
+        provider = provider_class(app)
+        with app.app_context():
+            response = provider.response({'a': 1})
+        assert response.data == provider.encode({'a': 1})
+        assert response.mimetype == 'application/json'
+
+    def test_loads(self, provider_class, app):
+        assert provider_class(app).loads(b'{"a": [1]}') == {'a': [1]}
+
+    def test_dumps_with_options(self, provider_class, app):
+        assert provider_class(app).dumps({'a': 1}, indent=1) == '{\n "a": 1\n}'
+
+
+class TestMakeJsonProvider:
+    @pytest.mark.skipif(json_provider.orjson is None, reason='orjson is not installed')
+    def test_auto_uses_orjson(self, app):
+        assert isinstance(make_json_provider(app), OrjsonProvider)
+
+    @mock.patch.object(json_provider, 'orjson', None)
+    def test_auto_falls_back_to_json(self, app):
+        provider = make_json_provider(app)
+        assert type(provider) is JSONProvider
+
+    @mock.patch.object(json_provider, 'orjson', None)
+    def test_orjson_not_installed(self):
+        with pytest.raises(RuntimeError):
+            make_json_provider(make_app(JSON_PROVIDER='orjson'))
+
+    def test_json(self, app):
+        app.config['JSON_PROVIDER'] = 'json'
+        assert type(make_json_provider(app)) is JSONProvider
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            make_json_provider(make_app(JSON_PROVIDER='yaml'))
+
+    @pytest.mark.parametrize('sort_keys', [True, False])
+    def test_sort_keys_setting(self, app, sort_keys):
+        app.config['JSON_SORT_KEYS'] = sort_keys
+        assert make_json_provider(app).sort_keys is sort_keys
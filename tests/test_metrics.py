@@ -0,0 +1,112 @@
+from unittest import mock
+
+import pytest
+from flask import Response
+
+from aubrey_transcription import create_app
+from aubrey_transcription.metrics import (NULL_TIMER, Histogram, Metrics, RequestTimer,
+                                          start_timer)
+
+
+@pytest.fixture()
+def app(pairtree_base, add_file):
+    add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+    add_file('metadc1', 'metadc1_m1_2-captions-eng.vtt')
+    app = create_app(test_config={'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base),
+                                  'METRICS_ENABLED': True})
+    return app
+
+
+class TestHistogram:
+    def test_render(self):
+        histogram = Histogram((1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        assert histogram.render('things', 'kind="a"') == [
+            'things_bucket{kind="a",le="1"} 2',
+            'things_bucket{kind="a",le="5"} 3',
+            'things_bucket{kind="a",le="+Inf"} 4',
+            'things_sum{kind="a"} 14.5',
+            'things_count{kind="a"} 4',
+        ]
+
+    def test_render_without_labels(self):
+        assert Histogram((1,)).render('things') == [
+            'things_bucket{le="1"} 0',
+            'things_bucket{le="+Inf"} 0',
+            'things_sum 0',
+            'things_count 0',
+        ]
+
+
+class TestRequestTimer:
+    def test_server_timing_header(self):
+        timer = RequestTimer(Metrics())
+        with mock.patch('aubrey_transcription.metrics.time.perf_counter',
+                        side_effect=[1, 1.002, 2, 2.5]):
+            with timer.stage('make_path'):
+                pass
+            with timer.stage('find_files'):
+                pass
+        timer.cache_result('miss')
+        response = timer.finish(Response())
+        assert response.headers['Server-Timing'] == (
+            'make_path;dur=2.000, find_files;dur=500.000, cache;desc=miss')
+
+    def test_records_metrics(self):
+        metrics = Metrics()
+        timer = RequestTimer(metrics)
+        with timer.stage('find_files'):
+            pass
+        timer.cache_result('hit')
+        timer.files(3)
+        timer.finish(Response())
+        assert metrics.stages['find_files'].counts[0] == 1
+        assert metrics.cache_results == {'hit': 1, 'miss': 0, 'negative': 0, 'filtered': 0}
+        assert metrics.files.sum == 3
+
+    def test_null_timer(self):
+        response = Response()
+        with NULL_TIMER.stage('find_files'):
+            NULL_TIMER.cache_result('hit')
+            NULL_TIMER.files(3)
+        assert NULL_TIMER.finish(response) is response
+        assert 'Server-Timing' not in response.headers
+
+    def test_start_timer(self, app):
+        with app.app_context():
+            assert isinstance(start_timer(), RequestTimer)
+            app.config['METRICS'] = None
+            assert start_timer() is NULL_TIMER
+
+
+class TestInstrumentedRequests:
+    def test_server_timing(self, app):
+        client = app.test_client()
+        first = client.get('/metadc1/').headers['Server-Timing']
+        second = client.get('/metadc1/').headers['Server-Timing']
+        for stage in ('make_path', 'directory_mtime', 'find_files', 'get_files_info',
+                      'serialization'):
+            assert '{};dur='.format(stage) in first
+        assert 'cache;desc=miss' in first
+        assert 'find_files' not in second
+        assert 'cache;desc=hit' in second
+
+    def test_metrics_route(self, app):
+        client = app.test_client()
+        client.get('/metadc1/')
+        client.get('/metadc1/')
+        response = client.get('/metrics')
+        assert response.mimetype == 'text/plain'
+        text = response.get_data(as_text=True)
+        assert 'aubrey_transcription_stage_seconds_count{stage="find_files"} 1' in text
+        assert 'aubrey_transcription_stage_seconds_count{stage="make_path"} 2' in text
+        assert 'aubrey_transcription_listing_cache_total{result="hit"} 1' in text
+        assert 'aubrey_transcription_listing_files_sum 4' in text
+
+    def test_disabled(self, pairtree_base):
+        app = create_app(test_config={'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base)})
+        client = app.test_client()
+        assert 'Server-Timing' not in client.get('/metadc1/').headers
+        # Without the metrics route, this is just an identifier with no files.
+        assert client.get('/metrics').status_code == 308
@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+
+import pytest
+
+from aubrey_transcription.shared_cache import (
+    FILE_HEADER, SEQ, SLOT_HEADER, SharedListingCache, dump_listing, load_listing)
+from aubrey_transcription.utils import FileEntry, Listing, ParsedFilename
+
+
+@pytest.fixture
+def cache_path(tmpdir):
+    return str(tmpdir.join('listing-cache'))
+
+
+def make_listing(pairpath='/me/ta/dc/1/metadc1', mtime=1000, body=b'{}\n'):
+    parsed = ParsedFilename('metadc1', '1', '1', 'captions', 'eng', 'vtt')
+    listing = Listing(pairpath, [FileEntry('metadc1_m1_1-captions-eng.vtt', 6, parsed)], mtime,
+                      cacheable=True, etag='abc')
+    listing.body = body
+    return listing
+
+
+def store_from_child(path, pairpath):
+    cache = SharedListingCache(path, slots=16, slot_size=4096)
+    cache.set(pairpath, 1000, make_listing(pairpath, body=b'{"from":"child"}\n'))
+
+
+class TestSerialization:
+    def test_round_trip(self):
+        listing = make_listing()
+        listing.encoded['gzip'] = b'compressed'
+        loaded = load_listing(dump_listing(listing))
+        assert (loaded.pairpath, loaded.files, loaded.mtime, loaded.etag, loaded.body,
+                loaded.encoded) == (listing.pairpath, listing.files, 1000, 'abc', b'{}\n',
+                                    {'gzip': b'compressed'})
+        assert loaded.cacheable
+
+    def test_unparsed_files(self):
+        listing = Listing('/pa/th', [FileEntry('name', 1, None)], 1, etag='abc')
+        assert load_listing(dump_listing(listing)).files == [FileEntry('name', 1, None)]
+
+
+class TestSharedListingCache:
+    def test_get_and_set(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        listing = cache.get('/me/ta/dc/1/metadc1', 1000)
+        assert listing.body == b'{}\n'
+        assert len(cache) == 1
+        assert cache.total_bytes > 0
+
+    def test_missing(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is None
+
+    def test_stale_fingerprint(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        assert cache.get('/me/ta/dc/1/metadc1', 2000) is None
+
+    def test_expires(self, cache_path):
+        now = [100.0]
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096, ttl=10,
+                                   clock=lambda: now[0])
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        now[0] = 109.0
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is not None
+        now[0] = 110.0
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is None
+
+    def test_colliding_keys_replace_each_other(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=1, slot_size=4096)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        cache.set('/me/ta/dc/2/metadc2', 1000, make_listing('/me/ta/dc/2/metadc2'))
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is None
+        assert cache.get('/me/ta/dc/2/metadc2', 1000).pairpath == '/me/ta/dc/2/metadc2'
+
+    def test_too_big_for_a_slot(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=512)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        cache.set('/me/ta/dc/1/metadc1', 2000, make_listing(body=b'x' * 1024))
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is None
+        assert cache.get('/me/ta/dc/1/metadc1', 2000) is None
+
+    def test_writer_died_mid_write(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=1, slot_size=4096)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        # A writer killed mid-write leaves the sequence number odd.
+        SEQ.pack_into(cache._map, FILE_HEADER.size, 5)
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is None
+        with cache._write(FILE_HEADER.size):
+            assert SEQ.unpack_from(cache._map, FILE_HEADER.size)[0] & 1
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        assert not SEQ.unpack_from(cache._map, FILE_HEADER.size)[0] & 1
+        assert cache.get('/me/ta/dc/1/metadc1', 1000).body == b'{}\n'
+
+    def test_torn_value_is_a_miss(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=1, slot_size=4096)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        start = FILE_HEADER.size + SLOT_HEADER.size + len('/me/ta/dc/1/metadc1')
+        cache._map[start:start + 4] = b'\xff' * 4
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is None
+
+    def test_invalidate(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        cache.invalidate('/me/ta/dc/1/metadc1')
+        cache.invalidate('/me/ta/dc/2/metadc2')
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is None
+
+    def test_clear(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        cache.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_file_size_is_fixed(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        for i in range(100):
+            cache.set('/me/ta/dc/{0}/metadc{0}'.format(i), 1000, make_listing())
+        assert os.path.getsize(cache_path) == 20 + 16 * 4096
+
+    def test_shared_between_instances(self, cache_path):
+        first = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        second = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        first.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        assert second.get('/me/ta/dc/1/metadc1', 1000).body == b'{}\n'
+        second.invalidate('/me/ta/dc/1/metadc1')
+        assert first.get('/me/ta/dc/1/metadc1', 1000) is None
+
+    def test_shared_between_processes(self, cache_path):
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        process = multiprocessing.get_context('spawn').Process(
+            target=store_from_child, args=(cache_path, '/me/ta/dc/1/metadc1'))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        assert cache.get('/me/ta/dc/1/metadc1', 1000).body == b'{"from":"child"}\n'
+
+    def test_other_settings_replace_the_file(self, cache_path):
+        old = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        old.set('/me/ta/dc/1/metadc1', 1000, make_listing())
+        new = SharedListingCache(cache_path, slots=8, slot_size=4096)
+        assert new.get('/me/ta/dc/1/metadc1', 1000) is None
+        assert os.path.getsize(cache_path) == 20 + 8 * 4096
+        # The old instance keeps working on the file it had open.
+        assert old.get('/me/ta/dc/1/metadc1', 1000) is not None
+
+    def test_reopens_existing_file(self, cache_path):
+        SharedListingCache(cache_path, slots=16, slot_size=4096).set(
+            '/me/ta/dc/1/metadc1', 1000, make_listing())
+        cache = SharedListingCache(cache_path, slots=16, slot_size=4096)
+        assert cache.get('/me/ta/dc/1/metadc1', 1000) is not None
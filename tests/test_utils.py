@@ -1,11 +1,32 @@
+import re
+import threading
+from datetime import datetime, timezone
 from unittest import mock
 
 import pytest
 
-from aubrey_transcription.utils import (make_path, find_files, get_files_info, decrypt_filename,
-                                        assign_val_for_sorting)
-from aubrey_transcription import create_app
+from aubrey_transcription.utils import (make_path, directory_mtime, scan_directory, find_files,
+                                        get_files_info, decrypt_filename, assign_val_for_sorting,
+                                        walk_pairtree, make_etag, make_filename_parser,
+                                        compile_response_plan, configured_roots,
+                                        pairtree_roots, walk_pairtrees,
+                                        filter_files, FileEntry, FileFilter, Listing,
+                                        ParsedFilename, PartialFiles)
+from aubrey_transcription import create_app, utils
+from aubrey_transcription.concurrency import RootExecutors
 from aubrey_transcription.default_settings import FILENAME_PATTERN
+from werkzeug.exceptions import ServiceUnavailable
+
+
+parse_filename = make_filename_parser(re.compile(FILENAME_PATTERN), 100)
+
+
+def entry(name, size=256, mtime=None):
+    return FileEntry(name, size, parse_filename(name), mtime)
+
+
+def without_mtimes(files):
+    return [file_entry._replace(mtime=None) for file_entry in files]
 
 
 @pytest.fixture()
@@ -29,53 +50,184 @@ class TestMakePath():
         assert result == expected
 
 
-@mock.patch('aubrey_transcription.utils.os.path.isdir')
+class TestDirectoryMtime():
+    def test_returns_mtime(self, app, tmpdir):
+        app.config['PAIRTREE_BASE'] = str(tmpdir)
+        with app.app_context():
+            result = directory_mtime('/')
+        assert result == tmpdir.stat().mtime_ns
+
+    def test_missing_directory(self, app, tmpdir):
+        app.config['PAIRTREE_BASE'] = str(tmpdir)
+        with app.app_context():
+            result = directory_mtime('/no/th/in/g/nothing')
+        assert result is None
+
+
+class TestScanDirectory():
+    def test_yields_names_and_sizes(self, tmpdir):
+        first = tmpdir.join('metadc1_m1_1-captions-eng.vtt')
+        first.write('WEBVTT')
+        second = tmpdir.join('metadc1_m1_2-captions-eng.vtt')
+        second.write('')
+        result = sorted(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename))
+        assert result == [
+            entry('metadc1_m1_1-captions-eng.vtt', 6, first.stat().mtime_ns),
+            entry('metadc1_m1_2-captions-eng.vtt', 0, second.stat().mtime_ns),
+        ]
+        assert result[0].parsed == ParsedFilename('metadc1', '1', '1', 'captions', 'eng', 'vtt')
+
+    def test_skips_other_extensions(self, tmpdir):
+        tmpdir.join('metadc1_m1_1-captions-eng.vtt').write('WEBVTT')
+        tmpdir.join('metadc1_m1_1-captions-eng.txt').write('text')
+        result = list(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename))
+        assert [entry.name for entry in result] == ['metadc1_m1_1-captions-eng.vtt']
+
+    def test_skips_unparsable_names(self, tmpdir):
+        tmpdir.join('captions.vtt').write('WEBVTT')
+        with mock.patch('aubrey_transcription.utils.os.scandir') as mock_scandir:
+            entry = mock.Mock()
+            entry.name = 'captions.vtt'
+            mock_scandir.return_value.__enter__.return_value = [entry]
+            assert list(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename)) == []
+        entry.stat.assert_not_called()
+
+    def test_skips_directories(self, tmpdir):
+        tmpdir.mkdir('metadc1_m1_1-captions-eng.vtt')
+        assert list(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename)) == []
+
+    def test_does_not_stat_other_extensions(self, tmpdir):
+        tmpdir.join('metadc1_m1_1-captions-eng.txt').write('text')
+        with mock.patch('aubrey_transcription.utils.os.scandir') as mock_scandir:
+            entry = mock.Mock()
+            entry.name = 'metadc1_m1_1-captions-eng.txt'
+            mock_scandir.return_value.__enter__.return_value = [entry]
+            assert list(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename)) == []
+        entry.stat.assert_not_called()
+        entry.is_file.assert_not_called()
+
+    def test_skips_files_that_disappear(self, tmpdir):
+        with mock.patch('aubrey_transcription.utils.os.scandir') as mock_scandir:
+            entry = mock.Mock()
+            entry.name = 'metadc1_m1_1-captions-eng.vtt'
+            entry.stat.side_effect = OSError
+            mock_scandir.return_value.__enter__.return_value = [entry]
+            assert list(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename)) == []
+
+    def test_does_not_stat_filtered_out_files(self, tmpdir):
+        entries = []
+        for name in ('metadc1_m1_1-captions-eng.vtt', 'metadc1_m1_1-captions-fre.vtt'):
+            entries.append(mock.Mock())
+            entries[-1].name = name
+            entries[-1].stat.return_value.st_size = 10
+            entries[-1].stat.return_value.st_mtime_ns = 1000
+        file_filter = FileFilter({'language': 'fre'}, sizes=True)
+        with mock.patch('aubrey_transcription.utils.os.scandir') as mock_scandir:
+            mock_scandir.return_value.__enter__.return_value = entries
+            result = list(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename, file_filter))
+        assert result == [entry('metadc1_m1_1-captions-fre.vtt', 10, 1000)]
+        entries[0].stat.assert_not_called()
+        entries[0].is_file.assert_not_called()
+
+    def test_without_sizes(self, tmpdir):
+        file_filter = FileFilter({}, sizes=False)
+        with mock.patch('aubrey_transcription.utils.os.scandir') as mock_scandir:
+            dir_entry = mock.Mock()
+            dir_entry.name = 'metadc1_m1_1-captions-eng.vtt'
+            mock_scandir.return_value.__enter__.return_value = [dir_entry]
+            result = list(scan_directory(str(tmpdir), {'vtt': {}}, parse_filename, file_filter))
+        assert result == [entry('metadc1_m1_1-captions-eng.vtt', None)]
+        dir_entry.stat.assert_not_called()
+
+
 class TestFindFiles():
     @pytest.mark.parametrize('dir_contents, expected', [
         (
-            ['metadc977400_m1_2-subtitles-eng.vtt', 'metadc977400_m1_1-subtitles-fre.vtt'],
-            ['metadc977400_m1_1-subtitles-fre.vtt', 'metadc977400_m1_2-subtitles-eng.vtt']
+            [entry('metadc977400_m1_2-subtitles-eng.vtt', 1),
+             entry('metadc977400_m1_1-subtitles-fre.vtt', 2)],
+            [entry('metadc977400_m1_1-subtitles-fre.vtt', 2),
+             entry('metadc977400_m1_2-subtitles-eng.vtt', 1)]
+        ),
+        (
+            [entry('metadc977400_m1_1-subtitles-fre.vtt', 2)],
+            [entry('metadc977400_m1_1-subtitles-fre.vtt', 2)]
         ),
-        (['metadc977400_m1_1-subtitles-fre.vtt'], ['metadc977400_m1_1-subtitles-fre.vtt']),
         ([], []),
     ])
-    @mock.patch('aubrey_transcription.utils.os.listdir')
-    def test_path_is_dir(self, mock_listdir, mock_isdir,
-                         app, dir_contents, expected):
+    @mock.patch('aubrey_transcription.utils.scan_directory')
+    def test_path_is_dir(self, mock_scan_directory, app, dir_contents, expected):
         pairpath = '/so/me/pa/th/somepath'
-        mock_isdir.return_value = True
-        mock_listdir.return_value = dir_contents
+        mock_scan_directory.return_value = iter(dir_contents)
         with app.app_context():
             result = find_files(pairpath)
         assert result == expected
 
-    @mock.patch('aubrey_transcription.utils.sorted')
-    @mock.patch('aubrey_transcription.utils.os.listdir')
-    def test_non_int_filename(self, mock_listdir, mock_sorted, mock_isdir, app):
+    @mock.patch('aubrey_transcription.utils.scan_directory')
+    def test_non_int_filename(self, mock_scan_directory, app):
         pairpath = '/so/me/pa/th/somepath'
-        mock_isdir.return_value = True
-        expected = ['one.vtt', 'two.xml', 'three.jpg']
-        mock_listdir.return_value = expected
-        mock_sorted.side_effect = ValueError
+        files = [entry('metadc1_m1_b-captions-eng.vtt', 1),
+                 entry('metadc1_m1_2-captions-eng.vtt', 2),
+                 entry('metadc1_m1_a-captions-eng.vtt', 3)]
+        mock_scan_directory.return_value = iter(files)
         with app.app_context():
             result = find_files(pairpath)
-        # When the sorting fails, we expect to get the files in the order listdir gave them
-        assert result == expected
+        # When a fileset isn't a number, the files are sorted by name alone.
+        assert result == [files[1], files[2], files[0]]
 
-    def test_path_is_not_dir(self, mock_isdir, app):
-        pairpath = '/so/me/fi/le/somefile'
-        mock_isdir.return_value = False
+    @mock.patch('aubrey_transcription.utils.scan_directory')
+    def test_sorted_by_fileset_then_name(self, mock_scan_directory, app):
+        files = [entry('metadc1_m2_1-captions-eng.vtt'),
+                 entry('metadc1_m1_10-captions-eng.vtt'),
+                 entry('metadc1_m1_1-captions-eng.vtt'),
+                 entry('metadc1_m1_2-captions-eng.vtt')]
+        mock_scan_directory.return_value = iter(files)
         with app.app_context():
-            result = find_files(pairpath)
-        assert result == []
+            result = find_files('/so/me/pa/th/somepath')
+        assert result == [files[2], files[0], files[3], files[1]]
+
+    def test_reads_directory(self, app, tmpdir):
+        app.config['PAIRTREE_BASE'] = str(tmpdir)
+        tmpdir.mkdir('somepath').join('metadc1_m1_1-captions-eng.vtt').write('WEBVTT')
+        with app.app_context():
+            result = find_files('/somepath')
+        assert without_mtimes(result) == [entry('metadc1_m1_1-captions-eng.vtt', 6)]
+
+    def test_path_is_not_dir(self, app, tmpdir):
+        app.config['PAIRTREE_BASE'] = str(tmpdir)
+        tmpdir.join('somefile').write('')
+        with app.app_context():
+            assert find_files('/somefile') == []
+            assert find_files('/so/me/fi/le/missing') == []
 
-    def test_path_normalized(self, mock_isdir, app):
+    @mock.patch('aubrey_transcription.utils.scan_directory')
+    def test_path_normalized(self, mock_scan_directory, app):
         pairpath = '///so/./././////me//fi/le/////somefile//////'
         expected = '/so/me/fi/le/somefile'
-        mock_isdir.return_value = False
+        mock_scan_directory.return_value = iter([])
         with app.app_context():
             find_files(pairpath)
-        assert mock_isdir.call_args[0][0].endswith(expected)
+        assert mock_scan_directory.call_args[0][0].endswith(expected)
+
+
+class TestFilterFiles():
+    files = [entry('metadc1_m1_1-captions-eng.vtt', 1),
+             entry('metadc1_m1_1-captions-fre.vtt', 2),
+             entry('metadc1_m2_1-subtitles-eng.vtt', 3),
+             FileEntry('unparsed.vtt', 4, None)]
+
+    @pytest.mark.parametrize('criteria, expected', [
+        ({}, files[:3]),
+        ({'language': 'eng'}, [files[0], files[2]]),
+        ({'language': 'eng', 'manifestation': '1'}, [files[0]]),
+        ({'kind': 'subtitles', 'fileset': '1'}, [files[2]]),
+        ({'language': 'ger'}, []),
+    ])
+    def test_criteria(self, criteria, expected):
+        assert filter_files(self.files, FileFilter(criteria, sizes=True)) == expected
+
+    def test_without_sizes(self):
+        result = filter_files(self.files, FileFilter({'language': 'fre'}, sizes=False))
+        assert result == [entry('metadc1_m1_1-captions-fre.vtt', None)]
 
 
 class TestAssignValForSorting():
@@ -90,27 +242,18 @@ class TestAssignValForSorting():
         # Missing languages sort last
         ({'vtt_kind': 'metadata'}, 'ezzz'),
         ({}, 'gzzz'),
+        # Unknown vtt kinds sort with the other kinds
+        ({'vtt_kind': 'unknown', 'language': 'ara'}, 'gara'),
     ])
     def test_assigns_expected_values(self, item, expected_value):
         actual_value = assign_val_for_sorting(item)
         assert actual_value == expected_value
 
 
-@mock.patch('aubrey_transcription.utils.decrypt_filename')
 class TestGetFilesInfo():
-    @mock.patch('aubrey_transcription.utils.assign_val_for_sorting')
-    @mock.patch('aubrey_transcription.utils.os.path.getsize')
-    def test_returns_correct_info(self, mock_getsize, mock_assign_val_for_sorting,
-                                  mock_decrypt_filename, app):
+    def test_returns_correct_info(self, app):
         pairpath = '/pa/th/path'
-        files = ['metaid_m1_1-captions-eng.vtt']
-        mock_decrypt_filename.return_value = {
-            'manifestation': '1',
-            'fileset': '1',
-            'kind': 'captions',
-            'language': 'eng',
-        }
-        mock_getsize.return_value = 256
+        files = [entry('metaid_m1_1-captions-eng.vtt', 256)]
         expected = {
             '1': {
                 '1': [
@@ -128,103 +271,132 @@ class TestGetFilesInfo():
         with app.app_context():
             result = get_files_info(pairpath, files)
         assert result == expected
-        mock_assign_val_for_sorting.assert_called_once_with(expected['1']['1'][0])
+        assert list(result['1']['1'][0]) == ['MIMETYPE', 'USE', 'flocat', 'SIZE', 'vtt_kind',
+                                             'language']
+
+    def test_without_size(self, app):
+        with app.app_context():
+            result = get_files_info('/pa/th/path', [entry('metaid_m1_1-captions-eng.vtt', None)])
+        assert 'SIZE' not in result['1']['1'][0]
 
     @pytest.mark.parametrize('transcription_url', [
         'http://example.com',
         'http://example.com/'
     ])
-    @mock.patch('aubrey_transcription.utils.os.path.getsize')
-    def test_flocat_has_single_slash(self, mock_getsize, mock_decrypt_filename,
-                                     app, transcription_url):
-        app.config[''] = transcription_url
+    def test_flocat_has_single_slash(self, app, transcription_url):
+        app.config['TRANSCRIPTION_URL'] = transcription_url
+        app.config['RESPONSE_PLAN'] = compile_response_plan(app.config)
         pairpath = '/pa/th/path'
-        files = ['metaid_m1_1-captions-eng.vtt']
-        mock_decrypt_filename.return_value = {
-            'manifestation': '1',
-            'fileset': '1',
-            'kind': 'captions',
-            'language': 'eng',
-        }
-        mock_getsize.return_value = 256
+        files = [entry('metaid_m1_1-captions-eng.vtt', 256)]
         expected_flocat = 'http://example.com/pa/th/path/metaid_m1_1-captions-eng.vtt'
         with app.app_context():
             result = get_files_info(pairpath, files)
         assert result['1']['1'][0]['flocat'] == expected_flocat
 
-    @mock.patch('aubrey_transcription.utils.os.path.getsize')
-    def test_manifestation_and_fileset_structure(self, mock_getsize,
-                                                 mock_decrypt_filename, app):
+    def test_manifestation_and_fileset_structure(self, app):
         pairpath = '/pa/th/path'
         files = [
-            'metaid_m1_8-captions-eng.vtt',
-            'metaid_m2_5-captions-ger.vtt'
+            entry('metaid_m1_8-captions-eng.vtt', 256),
+            entry('metaid_m2_5-captions-ger.vtt', 256),
         ]
-        mock_decrypt_filename.side_effect = [
-            {
-                'manifestation': '1',
-                'fileset': '8',
-                'kind': 'captions',
-                'language': 'eng',
-            },
-            {
-                'manifestation': '2',
-                'fileset': '5',
-                'kind': 'captions',
-                'language': 'ger',
-            }
-        ]
-        mock_getsize.return_value = 256
         with app.app_context():
             result = get_files_info(pairpath, files)
         assert result['1']['8']
         assert result['2']['5']
         assert not result['1']['1']
 
-    @mock.patch('aubrey_transcription.utils.os.path.getsize')
-    def test_removes_bad_extensions(self, mock_getsize, mock_decrypt_filename, app):
+    def test_removes_bad_extensions(self, app):
         pairpath = '/pa/th/path'
-        files = ['id_m1_1-captions-eng.vtt', 'id_m1_1-captions-ger.txt', 'id_m1_1-captions-fr.vtt']
-        mock_decrypt_filename.return_value = {
-            'manifestation': '1',
-            'fileset': '1',
-            'kind': 'captions',
-            'language': 'eng'
-        }
-        mock_getsize.return_value = 256
+        files = [
+            entry('id_m1_1-captions-eng.vtt', 256),
+            entry('id_m1_1-captions-ger.txt', 256),
+            entry('id_m1_1-captions-fr.vtt', 256),
+        ]
         with app.app_context():
             result = get_files_info(pairpath, files)
         assert len(result['1']['1']) == 2
         assert result['1']['1'][0]['flocat'].endswith('.vtt')
         assert result['1']['1'][1]['flocat'].endswith('.vtt')
 
-    @mock.patch('aubrey_transcription.utils.os.path.getsize')
-    def test_path_does_not_exist(self, mock_getsize, mock_decrypt_filename, app):
+    def test_sorts_every_fileset(self, app):
         pairpath = '/pa/th/path'
-        files = ['id_m1_1-captions-eng.vtt']
-        mock_decrypt_filename.return_value = {
-            'manifestation': '1',
-            'fileset': '1',
-            'kind': 'captions',
-            'language': 'eng'
-        }
-        mock_getsize.side_effect = OSError
+        files = [
+            entry('id_m1_1-subtitles-spa.vtt'),
+            entry('id_m1_1-captions-fre.vtt'),
+            entry('id_m1_1-captions-eng.vtt'),
+            entry('id_m1_2-other-eng.vtt'),
+            entry('id_m1_2-unknown-ara.vtt'),
+            entry('id_m1_2-chapters-eng.vtt'),
+            entry('id_m2_1-thumbnails-eng.vtt'),
+            entry('id_m2_1-metadata-eng.vtt'),
+        ]
         with app.app_context():
             result = get_files_info(pairpath, files)
-        assert result == {}
+        ordered = {manifestation: {fileset: [(f['vtt_kind'], f['language']) for f in infos]
+                                   for fileset, infos in filesets.items()}
+                   for manifestation, filesets in result.items()}
+        assert ordered == {
+            '1': {
+                '1': [('captions', 'eng'), ('captions', 'fre'), ('subtitles', 'spa')],
+                '2': [('chapters', 'eng'), ('other', 'eng'), ('unknown', 'ara')],
+            },
+            '2': {
+                '1': [('metadata', 'eng'), ('thumbnails', 'eng')],
+            },
+        }
 
     @pytest.mark.parametrize('files', [
-        ['two'],
-        ['two.vtt'],
+        [entry('two', 256)],
+        [entry('two.vtt', 256)],
     ])
-    def test_bad_filenames(self, mock_decrypt_filename, app, files):
+    def test_bad_filenames(self, app, files):
         pairpath = '/pa/th/path'
-        mock_decrypt_filename.return_value = {}
         with app.app_context():
             result = get_files_info(pairpath, files)
         assert result == {}
 
 
+class TestCompileResponsePlan():
+    def test_plan(self):
+        plan = compile_response_plan({
+            'EXTENSIONS_META': {'vtt': {'mimetype': 'text/vtt', 'use': 'vtt'}},
+            'TRANSCRIPTION_URL': 'http://example.com/',
+        })
+        assert plan.extensions == {'vtt': {'MIMETYPE': 'text/vtt', 'USE': 'vtt'}}
+        assert plan.url_prefix == 'http://example.com'
+        assert plan.kind_ranks['captions'] == 0
+        assert plan.kind_ranks['other'] == 6
+
+    def test_plan_is_read_only(self):
+        plan = compile_response_plan({'EXTENSIONS_META': {'vtt': {'mimetype': 'text/vtt',
+                                                                  'use': 'vtt'}},
+                                      'TRANSCRIPTION_URL': 'http://example.com'})
+        with pytest.raises(TypeError):
+            plan.extensions['vtt']['USE'] = 'other'
+        with pytest.raises(AttributeError):
+            plan.url_prefix = 'http://example.org'
+
+
+class TestMakeFilenameParser():
+    def test_parses_filename(self):
+        parse = make_filename_parser(re.compile(FILENAME_PATTERN), 10)
+        assert parse('metadc1_m1_2-captions-eng.vtt') == ParsedFilename(
+            'metadc1', '1', '2', 'captions', 'eng', 'vtt')
+        assert parse('bad') is None
+
+    def test_remembers_results(self):
+        regex = mock.Mock(wraps=re.compile(FILENAME_PATTERN))
+        parse = make_filename_parser(regex, 10)
+        first = parse('metadc1_m1_2-captions-eng.vtt')
+        assert parse('metadc1_m1_2-captions-eng.vtt') is first
+        regex.match.assert_called_once_with('metadc1_m1_2-captions-eng.vtt')
+
+    def test_pattern_missing_groups(self):
+        parse = make_filename_parser(re.compile(r'(?P<metaid>[^_]*)_.*'), 10)
+        assert parse('metadc1_anything') == ParsedFilename('metadc1', None, None, None, None,
+                                                           None)
+
+
 class TestDecryptFilename():
     def test_compliant_filename(self, app):
         filename = 'metadc12345_m1_1-captions-eng.vtt'
@@ -248,3 +420,206 @@ class TestDecryptFilename():
         with app.app_context():
             result = decrypt_filename(filename)
         assert result == {}
+
+
+class TestWalkPairtree():
+    def test_finds_object_directories(self, add_file, pairtree_base):
+        add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        add_file('metadc10', 'metadc10_m1_1-captions-eng.vtt')
+        result = list(walk_pairtree(str(pairtree_base)))
+        assert result == ['/me/ta/dc/1/metadc1', '/me/ta/dc/10/metadc10', '/me/ta/dc/2/metadc2']
+
+    def test_short_identifiers(self, add_file, pairtree_base):
+        add_file('ab', 'ab_m1_1-captions-eng.vtt')
+        add_file('abcd', 'abcd_m1_1-captions-eng.vtt')
+        result = list(walk_pairtree(str(pairtree_base)))
+        assert result == ['/ab/ab', '/ab/cd/abcd']
+
+    def test_ignores_stray_directories(self, add_file, pairtree_base):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        pairtree_base.mkdir('lost+found')
+        pairtree_base.join('me', 'ta').mkdir('not_an_object')
+        assert list(walk_pairtree(str(pairtree_base))) == ['/me/ta/dc/1/metadc1']
+
+    def test_missing_base(self, tmpdir):
+        assert list(walk_pairtree(str(tmpdir.join('missing')))) == []
+
+    @pytest.mark.parametrize('after, expected', [
+        ('/ab/ab', ['/ab/cd/abcd', '/me/ta/dc/1/metadc1', '/me/ta/dc/10/0/metadc100',
+                    '/me/ta/dc/10/metadc10']),
+        ('/me/ta/dc/1/metadc1', ['/me/ta/dc/10/0/metadc100', '/me/ta/dc/10/metadc10']),
+        ('/me/ta/dc/10/0/metadc100', ['/me/ta/dc/10/metadc10']),
+        ('/me/ta/dc/10/metadc10', []),
+        # Records that aren't there resume from where they would have been.
+        ('/me/ta/dc/0/metadc0', ['/me/ta/dc/1/metadc1', '/me/ta/dc/10/0/metadc100',
+                                 '/me/ta/dc/10/metadc10']),
+    ])
+    def test_after(self, add_file, pairtree_base, after, expected):
+        for identifier in ('ab', 'abcd', 'metadc1', 'metadc10', 'metadc100'):
+            add_file(identifier, '{}_m1_1-captions-eng.vtt'.format(identifier))
+        assert list(walk_pairtree(str(pairtree_base), after=after)) == expected
+
+
+class TestMultipleRoots():
+    @pytest.fixture()
+    def roots(self, app, tmpdir):
+        roots = [tmpdir.mkdir('first'), tmpdir.mkdir('second')]
+        app.config['PAIRTREE_BASE'] = [str(root) for root in roots]
+        return roots
+
+    def add_file(self, root, identifier, filename, content='WEBVTT\n'):
+        path = root.join(make_path(identifier))
+        path.ensure(dir=True)
+        path.join(filename).write(content)
+        return path
+
+    def test_configured_roots(self, app):
+        app.config['PAIRTREE_BASE'] = ['/one', '/two']
+        app.config['PAIRTREE_ROUTES'] = {'metadc': '/two', 'metapth': ['/three', '/one']}
+        assert configured_roots(app.config) == ['/one', '/two', '/three']
+
+    @pytest.mark.parametrize('identifier, expected', [
+        ('metadc1', ['/two']),
+        ('metapth1', ['/three', '/one']),
+        ('metapth12', ['/one']),
+        ('other', ['/one', '/two']),
+    ])
+    def test_routes(self, app, identifier, expected):
+        app.config['PAIRTREE_BASE'] = ['/one', '/two']
+        app.config['PAIRTREE_ROUTES'] = {'metadc': '/two', 'metapth': ['/three', '/one'],
+                                         'metapth12': '/one'}
+        with app.app_context():
+            assert pairtree_roots(make_path(identifier)) == expected
+
+    def test_merges_files(self, app, roots):
+        self.add_file(roots[0], 'metadc1', 'metadc1_m1_2-captions-eng.vtt', 'first')
+        self.add_file(roots[0], 'metadc1', 'metadc1_m1_3-captions-eng.vtt')
+        self.add_file(roots[1], 'metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        self.add_file(roots[1], 'metadc1', 'metadc1_m1_2-captions-eng.vtt', 'second!')
+        with app.app_context():
+            result = find_files('/me/ta/dc/1/metadc1')
+        # The copy in the first root wins.
+        assert without_mtimes(result) == [entry('metadc1_m1_1-captions-eng.vtt', 7),
+                                          entry('metadc1_m1_2-captions-eng.vtt', 5),
+                                          entry('metadc1_m1_3-captions-eng.vtt', 7)]
+        assert not isinstance(result, PartialFiles)
+
+    def test_routed_roots_only(self, app, roots):
+        self.add_file(roots[0], 'metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        self.add_file(roots[1], 'metadc1', 'metadc1_m1_2-captions-eng.vtt')
+        app.config['PAIRTREE_ROUTES'] = {'metadc': str(roots[1])}
+        with app.app_context():
+            assert without_mtimes(find_files('/me/ta/dc/1/metadc1')) == [
+                entry('metadc1_m1_2-captions-eng.vtt', 7)]
+
+    def test_directory_mtime(self, app, roots):
+        first = self.add_file(roots[0], 'metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        second = self.add_file(roots[1], 'metadc1', 'metadc1_m1_2-captions-eng.vtt')
+        first.setmtime(1000)
+        second.setmtime(2000)
+        with app.app_context():
+            assert directory_mtime('/me/ta/dc/1/metadc1') == 2000 * 10 ** 9
+            assert directory_mtime('/me/ta/dc/2/metadc2') is None
+
+    @pytest.fixture()
+    def hung_root(self, app, roots):
+        """Makes reads of the second root hang until the test is over."""
+        app.config['PAIRTREE_ROOT_TIMEOUT'] = 0.1
+        release = threading.Event()
+
+        def hanging(function):
+            def call(path, *args):
+                if path.startswith(str(roots[1])):
+                    release.wait()
+                return function(path, *args)
+            return call
+
+        with mock.patch('aubrey_transcription.utils._stat_mtime',
+                        hanging(utils._stat_mtime)), \
+                mock.patch('aubrey_transcription.utils.scan_directory',
+                           hanging(utils.scan_directory)):
+            yield roots[1]
+        release.set()
+
+    def test_hung_root_files(self, app, roots, hung_root):
+        self.add_file(roots[0], 'metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        self.add_file(roots[1], 'metadc1', 'metadc1_m1_2-captions-eng.vtt')
+        with app.app_context():
+            result = find_files('/me/ta/dc/1/metadc1')
+        assert without_mtimes(result) == [entry('metadc1_m1_1-captions-eng.vtt', 7)]
+        assert isinstance(result, PartialFiles)
+
+    def test_hung_root_saturated(self, app, roots, hung_root):
+        self.add_file(roots[0], 'metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        app.config['ROOT_EXECUTORS'] = RootExecutors(2)
+        client = app.test_client()
+        # The hung root's threads stay busy, but the first root still answers every time.
+        for _ in range(6):
+            response = client.get('/metadc1/')
+            assert response.status_code == 200
+            assert response.get_json()['1']['1'][0]['flocat'].endswith(
+                'metadc1_m1_1-captions-eng.vtt')
+
+    def test_hung_root_mtime(self, app, roots, hung_root):
+        first = self.add_file(roots[0], 'metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        first.setmtime(1000)
+        with app.app_context():
+            assert directory_mtime('/me/ta/dc/1/metadc1') == 1000 * 10 ** 9
+            # It may be in the root that didn't answer, so it can't be said to be missing.
+            with pytest.raises(ServiceUnavailable):
+                directory_mtime('/me/ta/dc/2/metadc2')
+
+
+class TestWalkPairtrees():
+    def test_merges_roots(self, tmpdir):
+        roots = [tmpdir.mkdir('first'), tmpdir.mkdir('second')]
+        for root, identifiers in zip(roots, [('ab', 'metadc10'), ('abcd', 'metadc1', 'ab')]):
+            for identifier in identifiers:
+                root.join(make_path(identifier)).ensure(dir=True)
+        result = list(walk_pairtrees([str(root) for root in roots]))
+        assert result == ['/ab/ab', '/ab/cd/abcd', '/me/ta/dc/1/metadc1', '/me/ta/dc/10/metadc10']
+        result = list(walk_pairtrees([str(root) for root in roots], after='/ab/cd/abcd'))
+        assert result == ['/me/ta/dc/1/metadc1', '/me/ta/dc/10/metadc10']
+
+
+class TestListing():
+    def test_size(self, app):
+        with app.app_context():
+            listing = Listing('/pa/th/path', [], None)
+        assert listing.size == 0
+        listing.body = b'{}\n'
+        listing.encoded['gzip'] = b'12345'
+        assert listing.size == 8
+
+    def test_last_modified(self, app):
+        with app.app_context():
+            listing = Listing('/pa/th/path', [], 1500000000123456789)
+        assert listing.last_modified == datetime(2017, 7, 14, 2, 40, 0, 123457, timezone.utc)
+
+    def test_no_last_modified(self, app):
+        with app.app_context():
+            listing = Listing('/pa/th/path', [], None)
+        assert listing.last_modified is None
+
+
+class TestMakeEtag():
+    @pytest.mark.parametrize('other_args', [
+        ('/pa/th/other', [entry('a.vtt', 1)], 1),
+        ('/pa/th/path', [entry('b.vtt', 1)], 1),
+        ('/pa/th/path', [entry('a.vtt', 2)], 1),
+        ('/pa/th/path', [entry('a.vtt', 1)], 2),
+        ('/pa/th/path', [], 1),
+    ])
+    def test_differs_when_listing_differs(self, app, other_args):
+        with app.app_context():
+            etag = make_etag('/pa/th/path', [entry('a.vtt', 1)], 1)
+            assert etag == make_etag('/pa/th/path', [entry('a.vtt', 1)], 1)
+            assert etag != make_etag(*other_args)
+
+    def test_differs_with_transcription_url(self, app):
+        with app.app_context():
+            etag = make_etag('/pa/th/path', [], 1)
+            app.config['TRANSCRIPTION_URL'] = 'http://example.org'
+            app.config['RESPONSE_PLAN'] = compile_response_plan(app.config)
+            assert etag != make_etag('/pa/th/path', [], 1)
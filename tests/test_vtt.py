@@ -0,0 +1,130 @@
+import os
+from unittest import mock
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+
+from aubrey_transcription import create_app
+from aubrey_transcription.files import find_file
+from aubrey_transcription.vtt import VttMetadata, VttMetadataReader, parse_vtt
+
+
+VTT = '''WEBVTT - Captions
+
+NOTE timings are in order
+
+1
+00:00.000 --> 00:01.500
+Hello
+
+2
+00:01:02.250 --> 01:00:03.125 align:start
+There
+'''
+
+
+class TestParseVtt:
+    def test_counts_cues(self, tmpdir):
+        path = tmpdir.join('captions.vtt')
+        path.write(VTT)
+        assert parse_vtt(str(path)) == VttMetadata(True, 2, 3603.125)
+
+    def test_longest_cue_end(self, tmpdir):
+        path = tmpdir.join('captions.vtt')
+        path.write('WEBVTT\n\n00:10.000 --> 00:20.000\nA\n\n00:05.000 --> 00:06.000\nB\n')
+        assert parse_vtt(str(path)).duration == 20.0
+
+    @pytest.mark.parametrize('content, valid', [
+        (b'WEBVTT', True),
+        (b'\xef\xbb\xbfWEBVTT\r\n', True),
+        (b'WEBVTT\tKind: captions\n', True),
+        (b'WEBVTTX\n', False),
+        (b'1\n00:00.000 --> 00:01.000\nNo header\n', False),
+    ])
+    def test_header(self, tmpdir, content, valid):
+        path = tmpdir.join('captions.vtt')
+        path.write_binary(content)
+        assert parse_vtt(str(path)).valid_header is valid
+
+    def test_empty_file(self, tmpdir):
+        path = tmpdir.join('captions.vtt')
+        path.write('')
+        assert parse_vtt(str(path)) == VttMetadata(False, 0, 0.0)
+
+
+def read_fields(reader, path):
+    """Get the fields for the file at path, as it is now, in the metadc1 record."""
+    result = os.stat(str(path))
+    return reader.fields('/me/ta/dc/1/metadc1', path.basename, result.st_mtime_ns,
+                         result.st_size)
+
+
+class TestVttMetadataReader:
+    @pytest.fixture
+    def vtt_file(self, add_file):
+        return add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt', VTT)
+
+    @pytest.fixture
+    def app(self, vtt_file, pairtree_base):
+        app = create_app({'TESTING': True, 'VTT_METADATA_EXTENSIONS': ['vtt']})
+        app.config['PAIRTREE_BASE'] = str(pairtree_base)
+        return app
+
+    def test_in_files_info(self, client):
+        file_info = client.get('/metadc1/').get_json()['1']['1'][0]
+        assert file_info['vtt_valid_header'] is True
+        assert file_info['vtt_cue_count'] == 2
+        assert file_info['vtt_duration'] == 3603.125
+
+    def test_not_without_sizes(self, client):
+        with mock.patch('aubrey_transcription.vtt.find_file') as mock_find_file:
+            file_info = client.get('/metadc1/?omit_size=true').get_json()['1']['1'][0]
+        assert 'vtt_cue_count' not in file_info
+        mock_find_file.assert_not_called()
+
+    def test_parses_once(self, app, vtt_file):
+        with app.app_context(), mock.patch('aubrey_transcription.vtt.parse_vtt',
+                                           return_value=VttMetadata(True, 1, 1.0)) as mock_parse:
+            reader = VttMetadataReader(['vtt'], 10)
+            read_fields(reader, vtt_file)
+            read_fields(reader, vtt_file)
+        mock_parse.assert_called_once()
+
+    def test_parses_changed_file(self, app, add_file, vtt_file):
+        reader = VttMetadataReader(['vtt'], 10)
+        with app.app_context():
+            assert read_fields(reader, vtt_file)['vtt_cue_count'] == 2
+            add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt',
+                     VTT + '\n3\n01:00:04.000 --> 01:00:05.000\nAgain\n')
+            assert read_fields(reader, vtt_file)['vtt_cue_count'] == 3
+
+    def test_missing_file(self, app):
+        with app.app_context():
+            assert VttMetadataReader(['vtt'], 10).fields(
+                '/me/ta/dc/1/metadc1', 'gone.vtt', 1000, 6) == {}
+
+    def test_storage_not_answering(self, app, vtt_file):
+        with app.app_context(), mock.patch(
+                'aubrey_transcription.vtt.find_file',
+                side_effect=ServiceUnavailable('The transcriptions storage did not respond.')):
+            assert read_fields(VttMetadataReader(['vtt'], 10), vtt_file) == {}
+
+    def test_known_versions_not_stated(self, app, client):
+        # Each request builds the body again when listings aren't cached.
+        app.config['LISTING_CACHE'] = None
+        with mock.patch('aubrey_transcription.vtt.find_file',
+                        wraps=find_file) as mock_find_file:
+            for _ in range(3):
+                file_info = client.get('/metadc1/').get_json()['1']['1'][0]
+                assert file_info['vtt_cue_count'] == 2
+        mock_find_file.assert_called_once()
+
+    def test_other_extensions(self, app, client):
+        app.config['VTT_METADATA'] = VttMetadataReader(['srt'], 10)
+        assert 'vtt_cue_count' not in client.get('/metadc1/').get_json()['1']['1'][0]
+
+    def test_disabled(self, add_file, pairtree_base):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt', VTT)
+        app = create_app({'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base)})
+        assert app.config['VTT_METADATA'] is None
+        assert 'vtt_cue_count' not in app.test_client().get('/metadc1/').get_json()['1']['1'][0]
@@ -0,0 +1,277 @@
+import errno
+import os
+import select
+import sys
+from unittest import mock
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+
+from aubrey_transcription import create_app
+from aubrey_transcription.bloom import BloomFilter
+from aubrey_transcription.index import ListingIndex, build_index
+from aubrey_transcription.watcher import (InotifyWatcher, PollingWatcher, WatchLimitReached,
+                                          create_watcher, record_pairpath, refresh_record)
+
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='needs inotify')
+
+
+@pytest.fixture()
+def app(pairtree_base):
+    app = create_app(test_config={'TESTING': True, 'PAIRTREE_BASE': str(pairtree_base)})
+    return app
+
+
+def wait_for_events(watcher):
+    """Collect the changes inotify reports, allowing a moment for the events to arrive."""
+    changed = set()
+    while select.select([watcher.fd], [], [], 0.2)[0]:
+        changed.update(watcher.read_events())
+    return changed
+
+
+class TestRecordPairpath:
+    @pytest.mark.parametrize('path, expected', [
+        ('me/ta/dc/1/metadc1', '/me/ta/dc/1/metadc1'),
+        ('me/ta/dc/1/metadc1/metadc1_m1_1-captions-eng.vtt', '/me/ta/dc/1/metadc1'),
+        ('ar/k+/=6/75/31/=m/et/ad/c1/ark+=67531=metadc1/a.vtt',
+         '/ar/k+/=6/75/31/=m/et/ad/c1/ark+=67531=metadc1'),
+        ('ab/ab', '/ab/ab'),
+        ('me/ta/dc', None),
+        ('me/ta/dc/1/notes', None),
+        ('', None),
+        ('../elsewhere/metadc1', None),
+    ])
+    def test_record_pairpath(self, path, expected):
+        assert record_pairpath('/base', os.path.join('/base', path)) == expected
+
+
+class TestRefreshRecord:
+    def test_invalidates_cache(self, app):
+        cache = app.config['LISTING_CACHE']
+        cache.set('/me/ta/dc/1/metadc1', 1, {})
+        with app.app_context():
+            refresh_record('/me/ta/dc/1/metadc1')
+        assert cache.get('/me/ta/dc/1/metadc1', 1) is None
+
+    def test_invalidates_negative_cache(self, app):
+        cache = app.config['NEGATIVE_CACHE']
+        cache.set('/me/ta/dc/1/metadc1', None, {})
+        with app.app_context():
+            refresh_record('/me/ta/dc/1/metadc1')
+        assert cache.get('/me/ta/dc/1/metadc1', None) is None
+
+    def test_adds_to_bloom_filter(self, app):
+        app.config['BLOOM_FILTER'] = BloomFilter.for_capacity(10, 0.01)
+        with app.app_context():
+            refresh_record('/me/ta/dc/1/metadc1')
+        assert '/me/ta/dc/1/metadc1' in app.config['BLOOM_FILTER']
+
+    def test_updates_index(self, app, add_file, tmpdir):
+        index_path = str(tmpdir.join('index.sqlite3'))
+        app.config['LISTING_INDEX'] = ListingIndex(index_path)
+        with app.app_context():
+            build_index(index_path)
+            add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+            refresh_record('/me/ta/dc/1/metadc1')
+        assert app.config['LISTING_INDEX'].lookup('/me/ta/dc/1/metadc1')
+
+
+class TestPollingWatcher:
+    def test_first_poll_records_mtimes(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = PollingWatcher(app)
+        with app.app_context():
+            assert watcher.poll() == set()
+        assert list(watcher.mtimes) == ['/me/ta/dc/1/metadc1']
+
+    def test_finds_changes(self, app, add_file, pairtree_base):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+        add_file('metadc3', 'metadc3_m1_1-captions-eng.vtt')
+        watcher = PollingWatcher(app)
+        with app.app_context():
+            watcher.poll()
+            os.utime(str(pairtree_base.join('/me/ta/dc/1/metadc1')), ns=(1, 1))
+            pairtree_base.join('/me/ta/dc/2/metadc2').remove()
+            add_file('metadc4', 'metadc4_m1_1-captions-eng.vtt')
+            changed = watcher.poll()
+        assert changed == {'/me/ta/dc/1/metadc1', '/me/ta/dc/2/metadc2', '/me/ta/dc/4/metadc4'}
+
+    def test_root_timeout_keeps_previous_mtime(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+        watcher = PollingWatcher(app)
+        with app.app_context():
+            watcher.poll()
+            before = dict(watcher.mtimes)
+            with mock.patch('aubrey_transcription.watcher.directory_mtime',
+                            side_effect=[ServiceUnavailable(), 5]):
+                changed = watcher.poll()
+        # The record that couldn't be checked is neither changed nor removed.
+        assert changed == {'/me/ta/dc/2/metadc2'}
+        assert watcher.mtimes['/me/ta/dc/1/metadc1'] == before['/me/ta/dc/1/metadc1']
+
+    def test_keeps_polling_after_errors(self, app):
+        watcher = PollingWatcher(app, interval=0.01)
+        polls = []
+
+        def poll():
+            polls.append(None)
+            if len(polls) == 3:
+                watcher._stop.set()
+            raise OSError('The pairtree is unavailable')
+
+        with mock.patch.object(watcher, 'poll', poll), app.app_context():
+            watcher.watch()
+        assert len(polls) == 3
+
+    def test_notifies_callback(self, app):
+        callback = mock.Mock()
+        watcher = PollingWatcher(app, callback=callback)
+        watcher.notify({'/b', '/a'})
+        assert callback.call_args_list == [mock.call('/a'), mock.call('/b')]
+
+    def test_callback_errors_are_logged(self, app):
+        callback = mock.Mock(side_effect=[ValueError, None])
+        watcher = PollingWatcher(app, callback=callback)
+        watcher.notify({'/b', '/a'})
+        assert callback.call_count == 2
+
+
+@linux_only
+class TestInotifyWatcher:
+    def test_new_file(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = InotifyWatcher(app)
+        watcher.add_initial_watches()
+        with app.app_context():
+            add_file('metadc1', 'metadc1_m1_2-captions-eng.vtt')
+            assert wait_for_events(watcher) == {'/me/ta/dc/1/metadc1'}
+
+    def test_ignores_other_files(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = InotifyWatcher(app)
+        watcher.add_initial_watches()
+        with app.app_context():
+            add_file('metadc1', 'upload.part')
+            assert wait_for_events(watcher) == set()
+
+    def test_deleted_file(self, app, add_file):
+        path = add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = InotifyWatcher(app)
+        watcher.add_initial_watches()
+        with app.app_context():
+            path.remove()
+            assert wait_for_events(watcher) == {'/me/ta/dc/1/metadc1'}
+
+    def test_new_record_directories(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = InotifyWatcher(app)
+        watcher.add_initial_watches()
+        with app.app_context():
+            add_file('metadc2', 'metadc2_m1_1-captions-eng.vtt')
+            assert '/me/ta/dc/2/metadc2' in wait_for_events(watcher)
+            # New directories are watched too.
+            add_file('metadc2', 'metadc2_m1_2-captions-eng.vtt')
+            assert wait_for_events(watcher) == {'/me/ta/dc/2/metadc2'}
+
+    def test_deleted_record_directory(self, app, add_file, pairtree_base):
+        path = add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = InotifyWatcher(app)
+        watcher.add_initial_watches()
+        with app.app_context():
+            path.dirpath().remove()
+            assert wait_for_events(watcher) == {'/me/ta/dc/1/metadc1'}
+
+    def test_walks_on_watcher_thread(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = InotifyWatcher(app)
+        assert watcher.watches == {}
+        os.close(watcher.fd)
+
+    def test_watch_limit(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        watcher = InotifyWatcher(app)
+        watcher.libc = mock.Mock()
+        watcher.libc.inotify_add_watch.return_value = -1
+        with mock.patch('aubrey_transcription.watcher.ctypes.get_errno',
+                        return_value=errno.ENOSPC):
+            with pytest.raises(WatchLimitReached):
+                watcher.add_initial_watches()
+        # It stops at the first directory rather than trying every one.
+        watcher.libc.inotify_add_watch.assert_called_once()
+        os.close(watcher.fd)
+
+    def test_falls_back_to_polling(self, app):
+        watcher = InotifyWatcher(app, fallback_interval=7)
+        polling = []
+
+        def poll_watch(polling_watcher):
+            polling.append(polling_watcher)
+            watcher._stop.set()
+
+        with mock.patch.object(watcher, 'add_initial_watches',
+                               side_effect=WatchLimitReached(errno.ENOSPC, 'full')), \
+                mock.patch.object(PollingWatcher, 'watch', poll_watch):
+            watcher.watch()
+        assert polling[0].interval == 7
+        assert polling[0]._stop is watcher._stop
+
+    def test_no_fallback(self, app):
+        watcher = InotifyWatcher(app)
+        with mock.patch.object(watcher, 'add_initial_watches',
+                               side_effect=WatchLimitReached(errno.ENOSPC, 'full')):
+            with pytest.raises(WatchLimitReached):
+                watcher.watch()
+
+    def test_thread_calls_back(self, app, add_file):
+        add_file('metadc1', 'metadc1_m1_1-captions-eng.vtt')
+        callback = mock.Mock()
+        watcher = InotifyWatcher(app, callback=callback)
+        watcher.start()
+        try:
+            # Give the thread time to add its watches.
+            for _ in range(50):
+                if watcher.watches:
+                    break
+                select.select([], [], [], 0.1)
+            add_file('metadc1', 'metadc1_m1_2-captions-eng.vtt')
+            for _ in range(50):
+                if callback.called:
+                    break
+                select.select([], [], [], 0.1)
+        finally:
+            watcher.stop()
+        callback.assert_called_with('/me/ta/dc/1/metadc1')
+
+
+class TestCreateWatcher:
+    def test_poll(self, app):
+        app.config['WATCH_METHOD'] = 'poll'
+        app.config['WATCH_POLL_INTERVAL'] = 5
+        watcher = create_watcher(app)
+        assert isinstance(watcher, PollingWatcher)
+        assert watcher.interval == 5
+
+    @linux_only
+    def test_auto_prefers_inotify(self, app):
+        watcher = create_watcher(app)
+        assert isinstance(watcher, InotifyWatcher)
+        assert watcher.fallback_interval == app.config['WATCH_POLL_INTERVAL']
+
+    @linux_only
+    def test_inotify_does_not_fall_back(self, app):
+        app.config['WATCH_METHOD'] = 'inotify'
+        assert create_watcher(app).fallback_interval is None
+
+    @mock.patch('aubrey_transcription.watcher.InotifyWatcher', side_effect=OSError)
+    def test_auto_falls_back_to_polling(self, mock_inotify_watcher, app):
+        assert isinstance(create_watcher(app), PollingWatcher)
+
+    @mock.patch('aubrey_transcription.watcher.InotifyWatcher', side_effect=OSError)
+    def test_inotify_required(self, mock_inotify_watcher, app):
+        app.config['WATCH_METHOD'] = 'inotify'
+        with pytest.raises(OSError):
+            create_watcher(app)